@@ -1,18 +1,25 @@
 from dotenv import load_dotenv
 import os
 from langchain_openai import AzureChatOpenAI
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+
+from service_requests.credentials import OPENAI_SCOPE, token_cache
 
 # import service_requests.db_tools as db_tools
 from service_requests.db_tools import (
     fetch_customer_information,
+    fetch_vehicle_models,
     get_available_service_slots,
+    hold_service_slot,
     create_service_appointment_slot,
     store_service_feedback
 )
 
 # import service_requests.search_tools as search_tools
 from service_requests.search_tools import perform_search_based_qna
+from service_requests.checkpointer import create_checkpointer
+from service_requests.history_policy import HistoryPolicy
+from service_requests.intent_router import load_router
+from service_requests.llm_gateway import llm_gateway
 
 from langchain_core.tools import tool
 from langgraph.prebuilt import tools_condition
@@ -20,19 +27,19 @@ from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from typing import Callable
 
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
 from langchain_core.runnables import RunnableLambda
 
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import HumanMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
 
 from typing_extensions import TypedDict
 from langgraph.graph import MessagesState
 from langgraph.types import Command
 
+import time
 import traceback
 import uuid
 import datetime
@@ -60,8 +67,8 @@ az_openai_embedding_deployment_name = os.getenv(
 az_api_type = os.getenv("API_TYPE")
 az_openai_version = os.getenv("API_VERSION")
 
-credential = DefaultAzureCredential()
-token_provider = get_bearer_token_provider(credential, "https://cognitiveservices.azure.com/.default")
+# Tokens come from the process-wide cache, refreshed in the background
+token_provider = token_cache.bearer_token_provider(OPENAI_SCOPE)
 
 llm = AzureChatOpenAI(
     azure_endpoint=az_openai_endpoint,
@@ -69,6 +76,9 @@ llm = AzureChatOpenAI(
     azure_ad_token_provider=token_provider,
     openai_api_type=az_api_type,
     api_version=az_openai_version,
+    # Retries, backoff and the shared budget are handled by llm_gateway
+    max_retries=0,
+    stream_usage=True,
 )
 
 thread_id = str(uuid.uuid4())
@@ -94,6 +104,7 @@ def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     customer_info: str
+    vehicle_models: list[str]  # injected into the search tool to scope it to the customer's vehicles
     dialog_state: Annotated[
         list[Literal["assistant", "service_scheduling", "search_qna", "service_feedback"]],
         update_dialog_stack,
@@ -101,24 +112,27 @@ class State(TypedDict):
 
 
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(self, runnable: Runnable, name: str = ""):
         self.runnable = runnable
+        self.name = name
+
+    def _bounded(self, state: State) -> State:
+        # The LLM sees the recent turns plus a summary of older ones; the state keeps everything
+        return {**state, "messages": history_policy.apply_and_log(state["messages"], self.name)}
 
     def __call__(self, state: State, config: RunnableConfig):
-        while True:
-            result = self.runnable.invoke(state)
-
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-            else:
-                break
+        # The gateway applies the shared budget, retries throttled calls and caps re-asks
+        result = llm_gateway.respond(self.name, self.runnable, self._bounded(state), config)
         return {"messages": result}
 
+    async def acall(self, state: State, config: RunnableConfig):
+        result = await llm_gateway.arespond(self.name, self.runnable, self._bounded(state), config)
+        return {"messages": result}
+
+    def as_node(self) -> RunnableLambda:
+        """Graph node with both implementations, so the graph runs under invoke and ainvoke."""
+        return RunnableLambda(self.__call__, afunc=self.acall)
+
 
 class CompleteOrEscalate(BaseModel):
     """A tool to mark the current task as completed and/or to escalate control of the dialog to the main assistant,
@@ -151,6 +165,7 @@ service_scheduling_prompt = ChatPromptTemplate(
             "You are a specialized assistant for handling service scheduling for customers. "
             " The primary assistant delegates work to you whenever the user needs help scheduling appointments or querying existing ones. "
             "Confirm the appointment with the customer and inform them of any additional fees. "
+            " Once the customer picks a slot, hold it with hold_service_slot while they confirm, and pass the HoldID when creating the appointment. "
             " When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "If you need more information or the customer changes their mind, escalate the task back to the main assistant."
             " Remember that a service schedule booking isn't completed until after the relevant tool has successfully been used."
@@ -165,6 +180,7 @@ service_scheduling_prompt = ChatPromptTemplate(
 
 service_scheduling_tools = [
     get_available_service_slots,
+    hold_service_slot,
     create_service_appointment_slot,
 ]
 service_scheduling_runnable = service_scheduling_prompt | llm.bind_tools(
@@ -211,6 +227,7 @@ search_qna_prompt = ChatPromptTemplate(
             " When searching, be persistent. Expand your query bounds if the first search returns no results. "
             "If you need more information or the customer changes their mind, escalate the task back to the main assistant."
             " Remember that a search query isn't completed until after the relevant tool has successfully been used."
+            " Searches are limited to the customer's vehicle models; pass vehicle_model only when the question is about one specific model."
             "\n\nCurrent customer information:\n<Customer_service_records>\n{customer_info}\n</Customer_service_records>"
             "\nCurrent time: {time}."
             "\n\nIf the user needs help, and none of your tools are appropriate for it, then"
@@ -232,8 +249,9 @@ class ToServiceScheduler(BaseModel):
     request: str = Field(
         description="Any additional information or requests from the user regarding the service scheduling."
     )
-    start_date: str = Field(
-        description="The date on which the service appointments are sought."
+    start_date: Optional[str] = Field(
+        default=None,
+        description="The date on which the service appointments are sought, if the customer has given one."
     )
     customer_name: str = Field(
         description="The name of the Customer on which the service appointment is to be scheduled."
@@ -253,17 +271,22 @@ class ToServiceFeedback(BaseModel):
     request: str = Field(
         description="Any additional information or requests from the user regarding the service feedback."
     )
-    schedule_id: int = Field(
+    # The feedback assistant collects whatever the customer has not given yet
+    schedule_id: Optional[int] = Field(
+        default=None,
         description="The schedule id in the system for the vehicle servicing."
     )
-    customer_id: int = Field(
+    customer_id: Optional[int] = Field(
+        default=None,
         description="The id of the Customer against which the service appointment was scheduled and completed."
     )
     
-    overall_rating: int = Field(
+    overall_rating: Optional[int] = Field(
+        default=None,
         description="The overall rating provided by the customer for the service provided."
     )
-    overall_comments: str = Field(
+    overall_comments: Optional[str] = Field(
+        default=None,
         description="The overall comments provided by the customer for the service provided."
     )
 
@@ -314,6 +337,16 @@ assistant_runnable = primary_assistant_prompt | llm.bind_tools(
     [ToServiceScheduler, ToSearchQnA, ToServiceFeedback]
 )
 
+# Keeps the last turns verbatim and collapses finished specialist episodes (HISTORY_* settings)
+history_policy = HistoryPolicy(
+    entry_tools={
+        ToServiceScheduler.__name__: "Service Scheduling Assistant",
+        ToSearchQnA.__name__: "Search Q&A Assistant",
+        ToServiceFeedback.__name__: "Service feedback Assistant",
+    },
+    exit_tool=CompleteOrEscalate.__name__,
+)
+
 
 def create_entry_node(assistant_name: str, new_dialog_state: str) -> Callable:
     def entry_node(state: State) -> dict:
@@ -374,14 +407,22 @@ def _print_event(event: dict, _printed: set, max_length=1500):
 builder = StateGraph(State)
 
 
-def customer_info(state: State):
-    if state.get("customer_info"):
-        return {"customer_info": state.get("customer_info")}
-    else:
-        return {"customer_info": fetch_customer_information.invoke({})}
+def customer_info(state: State, config: RunnableConfig):
+    # Read through the shared profile cache every turn: it is patched by the booking and
+    # feedback tools, so this picks up writes (and other sessions' writes) without a query
+    return {
+        "customer_info": fetch_customer_information.invoke({}, config),
+        "vehicle_models": fetch_vehicle_models(config),
+    }
+
 
+async def acustomer_info(state: State, config: RunnableConfig):
+    info = await fetch_customer_information.ainvoke({}, config)
+    # The profile rows were just loaded into the cache, so this does not query the database
+    return {"customer_info": info, "vehicle_models": fetch_vehicle_models(config)}
 
-builder.add_node("fetch_customer_info", customer_info)
+
+builder.add_node("fetch_customer_info", RunnableLambda(customer_info, afunc=acustomer_info))
 builder.add_edge(START, "fetch_customer_info")
 
 
@@ -390,7 +431,7 @@ builder.add_node(
     "enter_service_scheduling",
     create_entry_node("Service Scheduling Assistant", "service_scheduling"),
 )
-builder.add_node("service_scheduling", Assistant(service_scheduling_runnable))
+builder.add_node("service_scheduling", Assistant(service_scheduling_runnable, "service_scheduling").as_node())
 builder.add_edge("enter_service_scheduling", "service_scheduling")
 builder.add_node(
     "service_scheduling_tools", create_tool_node_with_fallback(service_scheduling_tools)
@@ -429,7 +470,7 @@ builder.add_node(
     "enter_service_feedback",
     create_entry_node("Service feedback Assistant", "service_feedback"),
 )
-builder.add_node("service_feedback", Assistant(service_feedback_runnable))
+builder.add_node("service_feedback", Assistant(service_feedback_runnable, "service_feedback").as_node())
 builder.add_edge("enter_service_feedback", "service_feedback")
 builder.add_node(
     "service_feedback_tools", create_tool_node_with_fallback(service_feedback_tools)
@@ -485,7 +526,7 @@ builder.add_node(
     "enter_search_qna",
     create_entry_node("Search Q&A Assistant", "search_qna"),
 )
-builder.add_node("search_qna", Assistant(search_qna_runnable))
+builder.add_node("search_qna", Assistant(search_qna_runnable, "search_qna").as_node())
 builder.add_edge("enter_search_qna", "search_qna")
 builder.add_node("search_qna_tools", create_tool_node_with_fallback(search_qna_tools))
 
@@ -516,7 +557,7 @@ builder.add_conditional_edges(
 )
 
 # Primary assistant
-builder.add_node("primary_assistant", Assistant(assistant_runnable))
+builder.add_node("primary_assistant", Assistant(assistant_runnable, "primary_assistant").as_node())
 
 
 def route_primary_assistant(
@@ -547,22 +588,77 @@ builder.add_conditional_edges(
 # builder.add_edge("primary_assistant_tools", "primary_assistant")
 
 
+# Fast path: a local classifier picks the specialist for clear requests, so the
+# primary assistant's LLM call is skipped; anything uncertain still goes to the LLM
+intent_router = load_router()
+INTENT_TOOLS = {
+    "service_scheduling": ToServiceScheduler,
+    "search_qna": ToSearchQnA,
+    "service_feedback": ToServiceFeedback,
+}
+
+
+def _delegation_args(intent: str, text: str, config: RunnableConfig) -> dict:
+    """Arguments of the delegation tool for `intent`, valid against its schema."""
+    if intent == "search_qna":
+        args = {"query": text}
+    elif intent == "service_scheduling":
+        args = {"request": text, "customer_name": config["configurable"]["customer_name"]}
+    else:
+        args = {"request": text}
+    return INTENT_TOOLS[intent](**args).model_dump(exclude_none=True)
+
+
+def route_intent(state: State, config: RunnableConfig) -> dict:
+    message = state["messages"][-1]
+    if intent_router is None or not isinstance(message, HumanMessage):
+        return {}
+    intent = intent_router.route(message.content)
+    if intent is None:
+        return {}
+    # Stand in for the primary assistant's delegation call, so the entry node and the
+    # specialist see the same messages as on the LLM path
+    tool_call = {
+        "name": INTENT_TOOLS[intent].__name__,
+        "args": _delegation_args(intent, message.content, config),
+        "id": f"route_{uuid.uuid4().hex}",
+    }
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+
+builder.add_node("intent_router", route_intent)
+
+
+def route_after_intent(state: State):
+    if isinstance(state["messages"][-1], AIMessage) and state["messages"][-1].tool_calls:
+        return route_primary_assistant(state)
+    return "primary_assistant"
+
+
+builder.add_conditional_edges(
+    "intent_router",
+    route_after_intent,
+    ["primary_assistant", "enter_service_scheduling", "enter_search_qna", "enter_service_feedback"],
+)
+
+
 # Each delegated workflow can directly respond to the user
 # When the user responds, we want to return to the currently active workflow
 def route_to_workflow(
     state: State,
-) -> Literal["primary_assistant", "service_scheduling", "search_qna","service_feedback"]:
+) -> Literal["intent_router", "service_scheduling", "search_qna","service_feedback"]:
     """If we are in a delegated state, route directly to the appropriate assistant."""
     dialog_state = state.get("dialog_state")
     if not dialog_state:
-        return "primary_assistant"
+        return "intent_router"
     return dialog_state[-1]
 
 
 builder.add_conditional_edges("fetch_customer_info", route_to_workflow)
 
 # Compile graph
-memory = MemorySaver()
+# Durable, compacting checkpoints (SQLite locally, Azure SQL in production; see CHECKPOINTER)
+memory = create_checkpointer()
 graph = builder.compile(checkpointer=memory)
 
 # graph_image = graph.get_graph().draw_mermaid_png()
@@ -571,42 +667,132 @@ graph = builder.compile(checkpointer=memory)
 # display(Image("graph_bot_app_v2.png"))
 
 
-def stream_graph_updates(user_input: str):
-    events = graph.stream(
+# Nodes whose LLM output is the reply to the customer; their tokens are streamed
+ASSISTANT_NODES = ("primary_assistant", "service_scheduling", "service_feedback", "search_qna")
+
+
+class _TurnStream:
+    """Turns `stream_mode=["messages", "updates"]` chunks into token / node / done events."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.reply = ""
+
+    def events(self, mode: str, chunk) -> list[dict]:
+        if mode == "messages":
+            message, metadata = chunk
+            node = metadata.get("langgraph_node")
+            if isinstance(message, AIMessageChunk) and node in ASSISTANT_NODES and message.content:
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                return [{"type": "token", "node": node, "content": message.content}]
+            return []
+        events = []
+        # "updates": only what each node changed, not the whole state
+        for node, update in chunk.items():
+            event = {"type": "node", "node": node}
+            if isinstance(update, dict):
+                if update.get("dialog_state"):
+                    event["dialog_state"] = update["dialog_state"]
+                messages = update.get("messages")
+                if messages is not None and not isinstance(messages, list):
+                    messages = [messages]
+                for message in messages or []:
+                    if isinstance(message, AIMessage) and message.content and not message.tool_calls:
+                        self.reply = message.content
+            events.append(event)
+        return events
+
+    def done(self) -> dict:
+        now = time.perf_counter()
+        return {
+            "type": "done",
+            "content": self.reply,
+            "ttft_seconds": None if self.first_token_at is None else self.first_token_at - self.started,
+            "seconds": now - self.started,
+        }
+
+
+def stream_turn(user_input: str, run_config: dict = config):
+    """Stream one turn: LLM tokens of the active assistant, node transitions, then a "done" event."""
+    stream = _TurnStream()
+    for mode, chunk in graph.stream(
         {"messages": [("user", user_input)]},
-        config,
-        subgraphs=True,
-        stream_mode="values",
-    )
-    l_events = list(events)
-    msg = list(l_events[-1])
-    r1 = msg[-1]["messages"]
-    # response_to_user = msg[-1].messages[-1].content
-
-    print(r1[-1].content)
-
-
-customer_name = config["configurable"]["customer_name"]
-print(f"\n{'='*60}")
-print(f"  Contoso Motocorp Service Assistant")
-print(f"{'='*60}")
-print(f"\n  Hello, {customer_name}! Welcome to Contoso Motocorp.")
-print(f"  I'm your AI service assistant. Here's how I can help:\n")
-print(f"  - Schedule vehicle service appointments")
-print(f"  - Capture feedback on completed services")
-print(f"  - Answer questions about your vehicle or services")
-print(f"\n  Type 'quit' or 'exit' to end the conversation.\n")
-
-while True:
-    try:
-        user_input = input("User: ")
-        if user_input.lower() in ["quit", "exit", "q"]:
-            print("Goodbye!")
+        run_config,
+        stream_mode=["messages", "updates"],
+    ):
+        yield from stream.events(mode, chunk)
+    yield stream.done()
+
+
+async def astream_turn(user_input: str, run_config: dict = config):
+    """Async counterpart of `stream_turn`."""
+    stream = _TurnStream()
+    async for mode, chunk in graph.astream(
+        {"messages": [("user", user_input)]},
+        run_config,
+        stream_mode=["messages", "updates"],
+    ):
+        for event in stream.events(mode, chunk):
+            yield event
+    yield stream.done()
+
+
+def stream_graph_updates(user_input: str):
+    streamed = False
+    for event in stream_turn(user_input):
+        if event["type"] == "token":
+            if not streamed:
+                print("Assistant: ", end="", flush=True)
+            streamed = True
+            print(event["content"], end="", flush=True)
+        elif event["type"] == "done":
+            if not streamed:
+                print(f"Assistant: {event['content']}", end="")
+            ttft = event["ttft_seconds"]
+            print(
+                f"\n  (first token {ttft * 1000:.0f} ms, turn {event['seconds'] * 1000:.0f} ms)"
+                if ttft is not None
+                else f"\n  (turn {event['seconds'] * 1000:.0f} ms)"
+            )
+
+
+async def astream_graph_updates(user_input: str, run_config: dict = config) -> str:
+    """Runs one turn without printing; returns the reply for the turn."""
+    reply = ""
+    async for event in astream_turn(user_input, run_config):
+        if event["type"] == "done":
+            reply = event["content"]
+    return reply
+
+
+def main():
+    customer_name = config["configurable"]["customer_name"]
+    print(f"\n{'='*60}")
+    print(f"  Contoso Motocorp Service Assistant")
+    print(f"{'='*60}")
+    print(f"\n  Hello, {customer_name}! Welcome to Contoso Motocorp.")
+    print(f"  I'm your AI service assistant. Here's how I can help:\n")
+    print(f"  - Schedule vehicle service appointments")
+    print(f"  - Capture feedback on completed services")
+    print(f"  - Answer questions about your vehicle or services")
+    print(f"\n  Type 'quit' or 'exit' to end the conversation.\n")
+
+    while True:
+        try:
+            user_input = input("User: ")
+            if user_input.lower() in ["quit", "exit", "q"]:
+                print("Goodbye!")
+                break
+
+            stream_graph_updates(user_input)
+        except Exception as e:
+            print("An error occurred:", e)
+            traceback.print_exc()
+            # stream_graph_updates(user_input)
             break
 
-        stream_graph_updates(user_input)
-    except Exception as e:
-        print("An error occurred:", e)
-        traceback.print_exc()
-        # stream_graph_updates(user_input)
-        break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Concurrent load test for the CreateServiceSchedule booking path.
+
+Many threads book the same slot at once against Azure SQL. Some threads share an
+idempotency key to simulate retried tool calls. Afterwards the test checks that:
+
+    * no technician has overlapping appointments on the test date,
+    * no more bookings succeeded than there are technicians,
+    * every idempotency key produced at most one schedule,
+    * rejected calls failed with the "no available technician" error (50010).
+
+The rows it creates are deleted at the end. Use a date with no real bookings.
+
+Run with:
+    python -m benchmarks.booking_load_test --date 2030-01-07 --threads 32
+    python -m benchmarks.booking_load_test --date 2030-01-07 --threads 64 --keys 16 --rounds 3
+"""
+
+import argparse
+import collections
+import datetime
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from service_requests.credentials import token_cache
+from service_requests.sql_pool import SqlConnectionPool
+
+NO_TECHNICIAN_ERROR = "(50010)"
+
+BOOK_SQL = """
+EXEC CreateServiceSchedule @SelectedSlotStart = ?, @VehicleID = ?, @ServiceTypeID = ?, @IdempotencyKey = ?
+"""
+
+OVERLAP_QUERY = """
+SELECT a1.technician_id, ss1.schedule_id, ss2.schedule_id
+FROM Appointments a1
+    INNER JOIN Service_Schedules ss1 ON ss1.schedule_id = a1.schedule_id
+    INNER JOIN Appointments a2 ON a2.technician_id = a1.technician_id AND a2.schedule_id > a1.schedule_id
+    INNER JOIN Service_Schedules ss2 ON ss2.schedule_id = a2.schedule_id
+WHERE ss1.service_date = ? AND ss2.service_date = ?
+    AND ss1.status = 'Scheduled' AND ss2.status = 'Scheduled'
+    AND ss1.start_time < ss2.end_time AND ss2.start_time < ss1.end_time;
+"""
+
+
+def book(pool, slot_start: datetime.datetime, vehicle_id: int, service_type_id: int, key: str) -> dict:
+    started = time.perf_counter()
+    try:
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(BOOK_SQL, (slot_start, vehicle_id, service_type_id, key))
+            booking = None
+            while True:
+                if cursor.description:
+                    columns = [column[0] for column in cursor.description]
+                    rows = cursor.fetchall()
+                    if "TechnicianID" in columns and rows:
+                        booking = dict(zip(columns, rows[0]))
+                if not cursor.nextset():
+                    break
+            connection.commit()
+            cursor.close()
+        outcome = "replayed" if booking and booking["IsReplay"] else "booked"
+        return {"key": key, "outcome": outcome, "booking": booking, "seconds": time.perf_counter() - started}
+    except Exception as e:
+        outcome = "rejected" if NO_TECHNICIAN_ERROR in str(e) else "error"
+        return {"key": key, "outcome": outcome, "error": str(e), "seconds": time.perf_counter() - started}
+
+
+def scalar(pool, sql: str, params=()):
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        value = cursor.fetchone()[0]
+        cursor.close()
+    return value
+
+
+def cleanup(pool, keys: list[str]):
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        for key in keys:
+            cursor.execute(
+                "SELECT schedule_id FROM Booking_Requests WHERE idempotency_key = ?", (key,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            cursor.execute("DELETE FROM Booking_Requests WHERE idempotency_key = ?", (key,))
+            cursor.execute("DELETE FROM Appointments WHERE schedule_id = ?", (row[0],))
+            cursor.execute("DELETE FROM Service_Schedules WHERE schedule_id = ?", (row[0],))
+        connection.commit()
+        cursor.close()
+
+
+def run_round(pool, args, slot_start: datetime.datetime) -> tuple[list[dict], list[str]]:
+    run_id = uuid.uuid4().hex[:8]
+    keys = [f"loadtest:{run_id}:{i}" for i in range(args.keys)]
+    # Every key is used by threads / keys callers, so each key is "retried" concurrently
+    assignments = [keys[i % len(keys)] for i in range(args.threads)]
+    barrier = threading.Barrier(args.threads)
+
+    def worker(key):
+        barrier.wait()
+        return book(pool, slot_start, args.vehicle_id, args.service_type_id, key)
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(worker, assignments))
+    return results, keys
+
+
+def check(pool, args, results: list[dict], technicians: int) -> list[str]:
+    failures = []
+    overlaps = []
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(OVERLAP_QUERY, (args.date, args.date))
+        overlaps = cursor.fetchall()
+        cursor.close()
+    if overlaps:
+        failures.append(f"{len(overlaps)} overlapping appointment pairs: {overlaps[:5]}")
+
+    schedules_by_key = collections.defaultdict(set)
+    for result in results:
+        if result.get("booking"):
+            schedules_by_key[result["key"]].add(result["booking"]["ScheduleID"])
+    duplicated = {key: ids for key, ids in schedules_by_key.items() if len(ids) > 1}
+    if duplicated:
+        failures.append(f"idempotency keys with more than one schedule: {duplicated}")
+
+    distinct = set().union(*schedules_by_key.values()) if schedules_by_key else set()
+    if len(distinct) > technicians:
+        failures.append(f"{len(distinct)} bookings for one slot but only {technicians} technicians")
+
+    errors = [r for r in results if r["outcome"] == "error"]
+    if errors:
+        failures.append(f"{len(errors)} unexpected errors, first: {errors[0]['error']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--date", required=True, type=datetime.date.fromisoformat, help="service date to book (YYYY-MM-DD)")
+    parser.add_argument("--time", default="14:00", type=datetime.time.fromisoformat, help="slot start time")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent booking calls per round")
+    parser.add_argument("--keys", type=int, default=8, help="distinct idempotency keys per round")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--vehicle-id", type=int, default=1)
+    parser.add_argument("--service-type-id", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="do not delete the bookings made")
+    args = parser.parse_args()
+    args.keys = max(1, min(args.keys, args.threads))
+
+    # One connection per thread, so the database (not the pool) is what serializes callers
+    pool = SqlConnectionPool(token_cache.get_token, size=args.threads, timeout=120)
+    slot_start = datetime.datetime.combine(args.date, args.time)
+    technicians = scalar(pool, "SELECT COUNT(*) FROM Technicians")
+    existing = scalar(
+        pool,
+        "SELECT COUNT(*) FROM Service_Schedules WHERE service_date = ? AND status = 'Scheduled'",
+        (args.date,),
+    )
+    if existing:
+        print(f"warning: {existing} schedules already exist on {args.date}; fewer bookings can succeed")
+
+    all_keys = []
+    all_failures = []
+    try:
+        for round_number in range(1, args.rounds + 1):
+            results, keys = run_round(pool, args, slot_start)
+            all_keys.extend(keys)
+            counts = collections.Counter(r["outcome"] for r in results)
+            seconds = [r["seconds"] for r in results]
+            print(
+                f"round {round_number}: {args.threads} calls, {len(keys)} keys -> "
+                + ", ".join(f"{name} {counts[name]}" for name in ("booked", "replayed", "rejected", "error"))
+                + f" | latency p50 {statistics.median(seconds) * 1000:.0f} ms, max {max(seconds) * 1000:.0f} ms"
+            )
+            failures = check(pool, args, results, technicians)
+            all_failures.extend(f"round {round_number}: {failure}" for failure in failures)
+            if not args.keep:
+                cleanup(pool, keys)
+    finally:
+        if not args.keep:
+            cleanup(pool, all_keys)
+        print(f"pool: {pool.metrics()}")
+        pool.close()
+
+    if all_failures:
+        print("FAILED")
+        for failure in all_failures:
+            print(f"  {failure}")
+        raise SystemExit(1)
+    print(f"PASSED: zero double bookings across {args.rounds} round(s) ({technicians} technicians)")
+
+
+if __name__ == "__main__":
+    main()
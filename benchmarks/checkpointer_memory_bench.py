@@ -0,0 +1,133 @@
+"""
+Benchmark: process memory and resume latency, MemorySaver vs CompactingCheckpointer.
+
+Runs a small message-accumulating graph (the same `add_messages` state shape as the
+bot, with realistic reply sizes) for thousands of conversation threads and a few
+turns each, then reports for each checkpointer:
+
+    * Python heap held after the run (tracemalloc),
+    * on-disk size of the checkpoint store,
+    * mean time per turn,
+    * cold resume latency: a fresh checkpointer loading a random thread by ID.
+
+No Azure services are needed; the compacting saver uses a temporary SQLite file.
+
+Run with:
+    python -m benchmarks.checkpointer_memory_bench
+    python -m benchmarks.checkpointer_memory_bench --threads 5000 --turns 8 --keep-latest 10
+"""
+
+import argparse
+import gc
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Annotated
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, START, StateGraph, add_messages
+from typing_extensions import TypedDict
+
+from service_requests.checkpointer import CompactingCheckpointer, SqliteStore
+
+REPLY = (
+    "Your Splendor+ is due for its periodic service. The earliest available slots are "
+    "Monday 10:00, Monday 14:00 and Tuesday 09:30. Shall I book one of these for you? "
+)
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+    customer_info: str
+
+
+def build_graph(checkpointer):
+    def assistant(state: State):
+        return {"messages": [AIMessage(REPLY * 3)]}
+
+    def customer_info(state: State):
+        return {"customer_info": "Customer: Ravi Kumar | Splendor+ (2021, KA05CD1234) | last service 2024-11-02"}
+
+    builder = StateGraph(State)
+    builder.add_node("fetch_customer_info", customer_info)
+    builder.add_node("assistant", assistant)
+    builder.add_edge(START, "fetch_customer_info")
+    builder.add_edge("fetch_customer_info", "assistant")
+    builder.add_edge("assistant", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def run(checkpointer, threads: int, turns: int) -> dict:
+    graph = build_graph(checkpointer)
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for turn in range(turns):
+        for thread in range(threads):
+            config = {"configurable": {"thread_id": f"thread-{thread}"}}
+            graph.invoke({"messages": [HumanMessage(f"turn {turn}: when can I service my bike?")]}, config)
+    seconds = time.perf_counter() - started
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return {"held_bytes": held, "turn_ms": seconds / (threads * turns) * 1000}
+
+
+def cold_resume(make_checkpointer, threads: int, samples: int) -> list[float]:
+    graph = build_graph(make_checkpointer())
+    latencies = []
+    for thread in random.sample(range(threads), min(samples, threads)):
+        started = time.perf_counter()
+        state = graph.get_state({"configurable": {"thread_id": f"thread-{thread}"}})
+        latencies.append(time.perf_counter() - started)
+        assert state.values["messages"], "resumed thread has no messages"
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--keep-latest", type=int, default=10, help="checkpoints kept per thread")
+    parser.add_argument("--hot-threads", type=int, default=200, help="threads kept in memory")
+    parser.add_argument("--resume-samples", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.turns} turns")
+
+    memory = run(MemorySaver(), args.threads, args.turns)
+    print(
+        f"MemorySaver            heap held {memory['held_bytes'] / 2**20:8.1f} MiB"
+        f" | disk        - | {memory['turn_ms']:.2f} ms/turn | resume: state is lost on restart"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "checkpoints.sqlite")
+
+        def make_checkpointer():
+            return CompactingCheckpointer(
+                SqliteStore(path),
+                keep_latest=args.keep_latest,
+                max_hot_threads=args.hot_threads,
+            )
+
+        saver = make_checkpointer()
+        compacting = run(saver, args.threads, args.turns)
+        disk = saver.store.size_bytes()
+        latencies = cold_resume(make_checkpointer, args.threads, args.resume_samples)
+        print(
+            f"CompactingCheckpointer heap held {compacting['held_bytes'] / 2**20:8.1f} MiB"
+            f" | disk {disk / 2**20:6.1f} MiB | {compacting['turn_ms']:.2f} ms/turn"
+            f" | cold resume p50 {statistics.median(latencies) * 1000:.2f} ms,"
+            f" max {max(latencies) * 1000:.2f} ms"
+        )
+        print(f"metrics: {saver.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Evaluation: recall@k and latency of the DiskANN path vs the exact path in Azure SQL.
+
+Needs Service_Feedback with the vector index from scripts/feedback-vector-index.sql.
+Queries are stored feedback vectors with a little noise (--queries of them,
+sampled from the table). For each scenario of the Feedback Explorer (no filter,
+one rating filter, all ratings <= 2, a distance threshold) and each --overfetch
+it runs the exact query and the approximate one without fallback, and reports
+recall@k against the exact top k, latency percentiles, the candidates requested
+and how often automatic fallback (FEEDBACK_ANN_MIN_ROWS,
+FEEDBACK_ANN_MIN_SELECTIVITY, candidates running out) would have used the exact
+query instead.
+
+Run with:
+    python -m benchmarks.feedback_ann_recall
+    python -m benchmarks.feedback_ann_recall --top 50 --overfetch 1 2 4 8
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.feedback_index_bench import SCENARIOS, percentiles
+from service_requests.credentials import token_cache
+from service_requests.feedback_search import FeedbackSearch, recall_at_k
+from service_requests.sql_pool import get_pool
+
+SAMPLE_SQL = """
+SELECT TOP ({rows}) CAST(feedback_vector AS nvarchar(max))
+FROM Service_Feedback
+WHERE feedback_vector IS NOT NULL
+ORDER BY NEWID()
+"""
+
+
+def sample_queries(pool, rng: np.random.Generator, count: int) -> list[np.ndarray]:
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(SAMPLE_SQL.format(rows=int(count)))
+        rows = cursor.fetchall()
+        cursor.close()
+    vectors = [np.array(json.loads(row[0]), dtype=np.float32) for row in rows]
+    return [v + rng.normal(0.0, 0.01, len(v)).astype(np.float32) for v in vectors]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--overfetch", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    args = parser.parse_args()
+
+    pool = get_pool(token_cache.get_token)
+    search = FeedbackSearch(pool)
+    queries = sample_queries(pool, np.random.default_rng(0), args.queries)
+    total, _ = search.selectivity({})
+    print(f"{total:,} feedback vectors, {len(queries)} queries, top {args.top}")
+
+    for label, (rating_filters, threshold) in SCENARIOS.items():
+        _, share = search.selectivity(rating_filters)
+        exact, exact_seconds = [], []
+        for query in queries:
+            started = time.perf_counter()
+            exact.append(search.exact(query, rating_filters, threshold, args.top))
+            exact_seconds.append(time.perf_counter() - started)
+        print(f"\n{label} ({share:.1%} of rows pass the rating filters)")
+        print(f"  {'exact':<16} {percentiles(exact_seconds)}")
+
+        for overfetch in args.overfetch:
+            search.overfetch = overfetch
+            recalls, seconds, candidates, fallbacks = [], [], [], 0
+            for query, expected in zip(queries, exact):
+                started = time.perf_counter()
+                found, info = search.approximate(query, rating_filters, threshold, args.top, fallback=False)
+                seconds.append(time.perf_counter() - started)
+                recalls.append(recall_at_k(found, expected))
+                candidates.append(info["candidates"])
+                fallbacks += (
+                    total < search.min_rows
+                    or share < search.min_selectivity
+                    or (len(found) < min(args.top, len(expected)) and info["candidates"] >= search.max_candidates)
+                )
+            print(
+                f"  {f'ann x{overfetch:g}':<16} {percentiles(seconds)}  recall@{args.top} "
+                f"{sum(recalls) / len(recalls):.3f} (min {min(recalls):.2f}), "
+                f"{sum(candidates) / len(candidates):,.0f} candidates, {fallbacks / len(queries):.0%} would fall back"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark: the in-process feedback vector index vs vector_distance in Azure SQL.
+
+Offline it fills a scratch index (service_requests/feedback_index.py) with
+synthetic feedback at each --sizes row count (clustered unit vectors, random
+ratings, a few NULLs) and reports build rate, snapshot size, cold load time and
+search latency percentiles for the explorer's typical queries: no filter, one
+rating filter, all five ratings <= 2 (selective) and a distance threshold. Sizes
+whose vector matrix does not fit in --max-gib are skipped; lower --dimensions to
+measure them on a small machine.
+
+With --live it also syncs an index from Service_Feedback and runs the same
+queries through the explorer's SQL (vector_distance over the table) and the
+index, reporting both latencies and how many of the SQL top N the index returns.
+feedback_text is fetched by the SQL path but not by the index path.
+
+Run with:
+    python -m benchmarks.feedback_index_bench
+    python -m benchmarks.feedback_index_bench --sizes 1000000 --dimensions 384
+    python -m benchmarks.feedback_index_bench --sizes --live
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from service_requests.feedback_index import RATING_NAMES, RATING_NULL, FeedbackIndex
+from service_requests.feedback_search import FeedbackSearch
+
+BUILD_BATCH = 20000
+
+SCENARIOS = {
+    "no filter": ({}, None),
+    "timeliness <= 2": ({"rating_timeliness": 2}, None),
+    "all ratings <= 2": ({name: 2 for name in RATING_NAMES}, None),
+    "distance <= 0.5": ({}, 0.5),
+}
+
+
+def percentiles(seconds: list[float]) -> str:
+    ordered = sorted(seconds)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000  # noqa: E731
+    return f"p50 {pick(0.50):8.3f} ms  p95 {pick(0.95):8.3f} ms  p99 {pick(0.99):8.3f} ms"
+
+
+def synthetic_batch(rng: np.random.Generator, centers: np.ndarray, start_id: int, rows: int) -> tuple[dict, np.ndarray]:
+    """Feedback rows scattered around topic centers, with ratings 1..5 and ~2% NULL ratings."""
+    vectors = centers[rng.integers(0, len(centers), rows)] + rng.normal(0.0, 0.03, (rows, centers.shape[1]))
+    ratings = rng.integers(1, 6, (rows, len(RATING_NAMES))).astype(np.int8)
+    ratings[rng.random((rows, len(RATING_NAMES))) < 0.02] = RATING_NULL
+    columns = {
+        "feedback_id": np.arange(start_id, start_id + rows, dtype=np.int64),
+        "customer_id": rng.integers(1, 5000, rows),
+        "schedule_id": np.arange(start_id, start_id + rows, dtype=np.int64),
+        "ratings": ratings,
+        "feedback_date": np.datetime64("2024-01-01") + rng.integers(0, 365, rows).astype("timedelta64[D]"),
+    }
+    return columns, vectors.astype(np.float32)
+
+
+def queries_near(rng: np.random.Generator, index: FeedbackIndex, count: int) -> list[np.ndarray]:
+    """Queries close to indexed rows, as a real sentiment query is close to some feedback."""
+    rows = rng.integers(0, index.count, count)
+    return [np.asarray(index.vectors[row]) + rng.normal(0.0, 0.02, index.dimensions).astype(np.float32) for row in rows]
+
+
+def time_searches(index: FeedbackIndex, queries: list, rating_filters: dict, threshold: float | None, top: int):
+    latencies, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        results = index.search(query, rating_filters, threshold, top)
+        latencies.append(time.perf_counter() - started)
+        hits += len(results)
+    return latencies, hits / len(queries)
+
+
+def bench_size(args, rng: np.random.Generator, rows: int):
+    matrix_gib = rows * args.dimensions * 4 / 2**30
+    if matrix_gib > args.max_gib:
+        print(f"\n{rows:,} rows x {args.dimensions}: skipped, the vector matrix needs {matrix_gib:.1f} GiB (> --max-gib {args.max_gib:.1f})")
+        return
+    centers = rng.normal(0.0, 1.0, (args.topics, args.dimensions)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = FeedbackIndex(index_dir, args.dimensions)
+        started = time.perf_counter()
+        for start in range(0, rows, BUILD_BATCH):
+            index.append(*synthetic_batch(rng, centers, start + 1, min(BUILD_BATCH, rows - start)))
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = FeedbackIndex(index_dir, args.dimensions)
+        load_ms = (time.perf_counter() - started) * 1000
+        column_bytes = sum(column.nbytes for column in index.columns.values())
+        print(
+            f"\n{rows:,} rows x {args.dimensions}: built in {build_seconds:.1f}s ({rows / build_seconds:,.0f} rows/s), "
+            f"snapshot {index.size_bytes() / 2**20:,.1f} MiB on disk, in memory {index.vectors.nbytes / 2**20:,.1f} MiB "
+            f"vectors + {column_bytes / 2**20:,.1f} MiB columns, cold load {load_ms:.1f} ms"
+        )
+
+        queries = queries_near(rng, index, args.queries)
+        time_searches(index, queries[:5], {}, None, args.top)  # fault the mapped matrix in
+        for label, (rating_filters, threshold) in SCENARIOS.items():
+            latencies, hits = time_searches(index, queries, rating_filters, threshold, args.top)
+            print(f"  {label:<18} {percentiles(latencies)}  ({hits:.1f} hits)")
+
+
+# ── live comparison ─────────────────────────────────────────────
+
+
+def live_report(args, rng: np.random.Generator):
+    from service_requests.credentials import token_cache
+    from service_requests.sql_pool import get_pool
+
+    pool = get_pool(token_cache.get_token)
+    sql = FeedbackSearch(pool)
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = FeedbackIndex(index_dir)
+        stats = index.sync(pool)
+        print(f"\nlive: synced {stats['rows']:,} rows from Service_Feedback in {stats['seconds']:.1f}s")
+        if not index.count:
+            print("live: Service_Feedback has no vectors")
+            return
+        queries = queries_near(rng, index, args.live_queries)
+        for label, (rating_filters, threshold) in SCENARIOS.items():
+            sql_latencies, overlap = [], 0.0
+            for query in queries:
+                started = time.perf_counter()
+                expected = [r["feedback_id"] for r in sql.exact(query, rating_filters, threshold, args.top)]
+                sql_latencies.append(time.perf_counter() - started)
+                found = {r["feedback_id"] for r in index.search(query, rating_filters, threshold, args.top)}
+                overlap += len(found & set(expected)) / len(expected) if expected else 1.0
+            index_latencies, _ = time_searches(index, queries, rating_filters, threshold, args.top)
+            print(f"  {label:<18} sql   {percentiles(sql_latencies)}")
+            print(f"  {'':<18} index {percentiles(index_latencies)}  ({overlap / len(queries):.0%} of the SQL top {args.top})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=200, help="synthetic topic clusters")
+    parser.add_argument("--queries", type=int, default=200, help="timed searches per scenario")
+    parser.add_argument("--top", type=int, default=20)
+    default_gib = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30 * 0.6 if hasattr(os, "sysconf") else 8.0
+    parser.add_argument("--max-gib", type=float, default=default_gib, help="largest vector matrix to build")
+    parser.add_argument("--live", action="store_true", help="also compare against vector_distance in Azure SQL")
+    parser.add_argument("--live-queries", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"top {args.top}, {args.queries} searches per scenario")
+    for rows in args.sizes:
+        bench_size(args, rng, rows)
+    if args.live:
+        live_report(args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Evaluation: keyword vs vector vs hybrid (RRF) retrieval for the Search Q&A tool.
+
+Questions come from documents/search_eval.jsonl, labelled with the text a
+relevant chunk of the manual contains (part numbers, specs and paraphrased
+procedures). For each mode it reports recall@1/@3/@top, MRR, how many hits the
+first call returns and the search latency (query embedding excluded; the
+embedding is timed separately).
+
+The local index (service_requests/local_search.py) is built in a scratch
+directory. --embeddings azure embeds chunks and questions with Azure OpenAI; the
+default, hashed, is an offline stand-in (hashed word and character 4-gram
+features) so the fusion can be measured without network access; its "vector"
+numbers say little about a real embedding model. --azure also compares the
+semantic and hybrid query modes against the live Azure AI Search index.
+
+Run with:
+    python -m benchmarks.hybrid_search_eval
+    python -m benchmarks.hybrid_search_eval --embeddings azure --azure
+"""
+
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from service_requests.intent_router import features
+from service_requests.local_search import LocalSearchIndex, local_search_source
+
+DEFAULT_EVAL_PATH = os.path.join(os.path.dirname(local_search_source), "search_eval.jsonl")
+MODES = ("keyword", "vector", "hybrid")
+
+
+def load_questions(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normal(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def first_relevant(results: list[dict], expected: list[str]) -> int | None:
+    """1-based rank of the first result containing an expected passage."""
+    expected = [_normal(e) for e in expected]
+    for rank, result in enumerate(results, start=1):
+        text = _normal(f"{result.get('title', '')} {result.get('content', '')}")
+        if any(e in text for e in expected):
+            return rank
+    return None
+
+
+def hashed_embeddings(texts: list[str], dimensions: int = 1024) -> np.ndarray:
+    """Offline stand-in for an embedding model: signed feature hashing with sublinear tf."""
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for gram, count in features(text).items():
+            digest = zlib.crc32(gram.encode("utf-8"))
+            sign = 1.0 if digest & 1 else -1.0
+            matrix[row, (digest >> 1) % dimensions] += sign * (1 + math.log(count))
+    return matrix
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def report(label: str, ranks: list[int | None], hits: list[int], seconds: list[float], top: int):
+    n = len(ranks)
+
+    def recall(k):
+        return sum(1 for r in ranks if r is not None and r <= k) / n
+
+    mrr = sum(1 / r for r in ranks if r is not None) / n
+    print(
+        f"{label:<16} {recall(1):>6.0%} {recall(3):>6.0%} {recall(top):>6.0%} {mrr:>6.2f} "
+        f"{sum(hits) / n:>6.1f} {percentile(seconds, 0.5) * 1000:>8.2f} {percentile(seconds, 0.95) * 1000:>8.2f}"
+    )
+
+
+def evaluate_local(args, questions: list[dict]):
+    if args.embeddings == "azure":
+        from service_requests.embeddings import get_embeddings as embed_many
+    else:
+        embed_many = hashed_embeddings
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = LocalSearchIndex(index_dir, args.source, dense=True)
+        stats = index.build(embed_many)
+        print(f"local index: {stats['chunks']} chunks, built in {stats['seconds']:.2f}s ({args.embeddings} embeddings)")
+
+        started = time.perf_counter()
+        vectors = embed_many([q["question"] for q in questions])
+        print(f"query embeddings: {(time.perf_counter() - started) / len(questions) * 1000:.2f} ms per question\n")
+
+        print(f"{'mode':<16} {'R@1':>6} {'R@3':>6} {f'R@{args.top}':>6} {'MRR':>6} {'hits':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for mode in MODES:
+            ranks, hits, seconds = [], [], []
+            for question, vector in zip(questions, vectors):
+                for _ in range(args.rounds):
+                    started = time.perf_counter()
+                    results = index.search(question["question"], args.top, vector, mode=mode, candidates=args.candidates)
+                    seconds.append(time.perf_counter() - started)
+                ranks.append(first_relevant(results, question["expected"]))
+                hits.append(len(results))
+            report(f"local {mode}", ranks, hits, seconds, args.top)
+            if args.verbose:
+                for question, rank in zip(questions, ranks):
+                    if rank is None:
+                        print(f"    missed: {question['question']}")
+
+
+def evaluate_azure(args, questions: list[dict]):
+    from service_requests import search_tools
+    from service_requests.embeddings import get_embeddings
+
+    vectors = get_embeddings([q["question"] for q in questions])
+    client = search_tools._search_client()
+    for mode in ("semantic", "hybrid"):
+        search_tools.search_mode = mode
+        ranks, hits, seconds = [], [], []
+        for question, vector in zip(questions, vectors):
+            started = time.perf_counter()
+            results = list(client.search(**search_tools._search_kwargs(question["question"], vector)))
+            seconds.append(time.perf_counter() - started)
+            results, _ = search_tools._dedupe(results)
+            ranks.append(first_relevant(results, question["expected"]))
+            hits.append(len(results))
+        report(f"azure {mode}", ranks, hits, seconds, args.top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval", default=DEFAULT_EVAL_PATH)
+    parser.add_argument("--source", default=local_search_source)
+    parser.add_argument("--embeddings", choices=("hashed", "azure"), default="hashed")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20, help="hits per ranking before fusion")
+    parser.add_argument("--rounds", type=int, default=20, help="timed repetitions per question")
+    parser.add_argument("--azure", action="store_true", help="also evaluate the live Azure AI Search index")
+    parser.add_argument("--verbose", action="store_true", help="list missed questions")
+    args = parser.parse_args()
+
+    questions = load_questions(args.eval)
+    print(f"{len(questions)} labelled questions from {args.eval}")
+    evaluate_local(args, questions)
+    if args.azure:
+        print()
+        evaluate_azure(args, questions)
+
+
+if __name__ == "__main__":
+    main()
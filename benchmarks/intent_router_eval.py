@@ -0,0 +1,143 @@
+"""
+Evaluation: local intent router vs the primary assistant LLM call.
+
+Trains the router on documents/intents/train.jsonl and scores the labelled
+utterances in documents/intents/eval.jsonl. For each confidence threshold pair it
+reports:
+
+    * coverage  - share of messages routed locally (the LLM call is skipped),
+    * precision - share of locally routed messages sent to the right specialist,
+    * accuracy  - end-to-end routing accuracy, counting fallbacks as correct when the
+                  LLM is assumed right (or as scored with --llm),
+
+and the router's classification latency. With --llm the same utterances are sent to
+the primary assistant (needs Azure OpenAI) to measure its routing accuracy and
+latency, which is what a local route saves.
+
+Run with:
+    python -m benchmarks.intent_router_eval
+    python -m benchmarks.intent_router_eval --llm
+"""
+
+import argparse
+import statistics
+import time
+
+from service_requests.intent_router import (
+    FALLBACK_INTENT,
+    IntentRouter,
+    intent_router_min_margin,
+    intent_router_min_score,
+    intent_train_path,
+    load_utterances,
+)
+
+DEFAULT_EVAL_PATH = intent_train_path.replace("train.jsonl", "eval.jsonl")
+
+
+def llm_routes(utterances: list[tuple[str, str]]) -> tuple[list[str], list[float]]:
+    """Intent chosen by the primary assistant for each utterance, and its latency."""
+    from agent import INTENT_TOOLS, assistant_runnable
+
+    by_tool = {tool.__name__: intent for intent, tool in INTENT_TOOLS.items()}
+    intents, seconds = [], []
+    for text, _ in utterances:
+        started = time.perf_counter()
+        result = assistant_runnable.invoke({"messages": [("user", text)], "customer_info": ""})
+        seconds.append(time.perf_counter() - started)
+        tool = result.tool_calls[0]["name"] if result.tool_calls else None
+        intents.append(by_tool.get(tool, FALLBACK_INTENT))
+    return intents, seconds
+
+
+def evaluate(router: IntentRouter, utterances, llm_intents) -> dict:
+    routed = correct_routed = correct = 0
+    for (text, expected), llm_intent in zip(utterances, llm_intents):
+        prediction = router.predict(text)
+        if prediction.confident:
+            routed += 1
+            correct_routed += prediction.intent == expected
+            correct += prediction.intent == expected
+        else:
+            correct += llm_intent == expected
+    return {
+        "coverage": routed / len(utterances),
+        "precision": correct_routed / routed if routed else 1.0,
+        "accuracy": correct / len(utterances),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train", default=intent_train_path)
+    parser.add_argument("--eval", default=DEFAULT_EVAL_PATH)
+    parser.add_argument("--llm", action="store_true", help="also score the primary assistant LLM (Azure OpenAI)")
+    parser.add_argument("--min-scores", type=float, nargs="+", default=[0.1, 0.2, 0.3, 0.4])
+    parser.add_argument("--min-margins", type=float, nargs="+", default=[0.05, 0.1, 0.15])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    router = IntentRouter(load_utterances(args.train))
+    train_seconds = time.perf_counter() - started
+    utterances = load_utterances(args.eval)
+    print(
+        f"trained on {len(load_utterances(args.train))} utterances in {train_seconds * 1000:.1f} ms; "
+        f"evaluating {len(utterances)} utterances"
+    )
+
+    latencies = []
+    misses = []
+    for text, expected in utterances:
+        started = time.perf_counter()
+        prediction = router.predict(text)
+        latencies.append(time.perf_counter() - started)
+        if prediction.intent != expected:
+            misses.append((text, expected, prediction))
+    print(
+        f"router latency p50 {statistics.median(latencies) * 1e6:.0f} us, "
+        f"max {max(latencies) * 1e6:.0f} us; top-1 accuracy {1 - len(misses) / len(utterances):.1%}"
+    )
+
+    if args.llm:
+        llm_intents, llm_seconds = llm_routes(utterances)
+        llm_accuracy = sum(i == e for i, (_, e) in zip(llm_intents, utterances)) / len(utterances)
+        print(
+            f"primary assistant LLM: accuracy {llm_accuracy:.1%}, latency p50 "
+            f"{statistics.median(llm_seconds) * 1000:.0f} ms, max {max(llm_seconds) * 1000:.0f} ms"
+        )
+    else:
+        # Without --llm, fallbacks are assumed to be routed correctly by the LLM
+        llm_intents = [expected for _, expected in utterances]
+        llm_seconds = None
+
+    print(f"\n{'min_score':>9} {'min_margin':>10} {'coverage':>9} {'precision':>9} {'accuracy':>9}")
+    for min_score in args.min_scores:
+        for min_margin in args.min_margins:
+            router.min_score, router.min_margin = min_score, min_margin
+            result = evaluate(router, utterances, llm_intents)
+            marker = "  <- configured" if (min_score, min_margin) == (intent_router_min_score, intent_router_min_margin) else ""
+            print(
+                f"{min_score:>9.2f} {min_margin:>10.2f} {result['coverage']:>9.1%} "
+                f"{result['precision']:>9.1%} {result['accuracy']:>9.1%}{marker}"
+            )
+
+    router.min_score, router.min_margin = intent_router_min_score, intent_router_min_margin
+    if llm_seconds:
+        coverage = evaluate(router, utterances, llm_intents)["coverage"]
+        print(
+            f"\nat the configured thresholds {coverage:.0%} of first messages skip an LLM call of "
+            f"~{statistics.median(llm_seconds) * 1000:.0f} ms"
+        )
+
+    if misses:
+        print("\nmisclassified (top-1):")
+        for text, expected, prediction in misses:
+            print(
+                f"  {text!r}: expected {expected}, got {prediction.intent} "
+                f"(score {prediction.score:.2f}, margin {prediction.margin:.2f}, "
+                f"{'routed' if prediction.confident else 'fallback'})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark: the offline local retrieval backend over the owner's manual.
+
+Builds the index from LOCAL_SEARCH_SOURCE into a scratch directory and reports
+the build time, the index size on disk and query latency percentiles, using the
+search_qna utterances from documents/intents as queries (repeated --rounds times).
+
+By default only BM25 is measured and nothing leaves the machine. --dense embeds
+the chunks and queries with Azure OpenAI; --synthetic-dense instead fills the
+memory-mapped vector index with random unit vectors, which measures dense search
+latency and size offline (the rankings are meaningless).
+
+Run with:
+    python -m benchmarks.local_search_bench
+    python -m benchmarks.local_search_bench --synthetic-dense --dimensions 1536
+    python -m benchmarks.local_search_bench --dense
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from service_requests.intent_router import intent_train_path, load_utterances
+from service_requests.local_search import LocalSearchIndex, local_search_source
+
+
+def percentiles(seconds: list[float]) -> str:
+    ordered = sorted(seconds)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000  # noqa: E731
+    return f"p50 {pick(0.50):.3f} ms, p95 {pick(0.95):.3f} ms, p99 {pick(0.99):.3f} ms, max {ordered[-1] * 1000:.3f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=local_search_source)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--dense", action="store_true", help="embed chunks and queries with Azure OpenAI")
+    parser.add_argument("--synthetic-dense", action="store_true", help="random vectors instead of embeddings")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    queries = [
+        text
+        for path in (intent_train_path, intent_train_path.replace("train.jsonl", "eval.jsonl"))
+        for text, intent in load_utterances(path)
+        if intent == "search_qna"
+    ]
+    rng = np.random.default_rng(0)
+    embed_many = None
+    if args.synthetic_dense:
+        embed_many = lambda texts: rng.normal(size=(len(texts), args.dimensions))  # noqa: E731
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = LocalSearchIndex(index_dir, args.source, dense=args.dense or args.synthetic_dense)
+        stats = index.build(embed_many)
+        print(
+            f"built {stats['chunks']} chunks from {args.source} in {stats['seconds'] * 1000:.1f} ms; "
+            f"index on disk {stats['bytes'] / 1024:.1f} KiB"
+        )
+
+        started = time.perf_counter()
+        reloaded = LocalSearchIndex(index_dir, args.source, dense=index.dense_enabled)
+        reloaded.ensure_loaded()
+        print(f"cold load of the persisted index: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        latencies = []
+        for _ in range(args.rounds):
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, args.top)
+                latencies.append(time.perf_counter() - started)
+        print(f"BM25 over {len(latencies)} queries: {percentiles(latencies)}")
+
+        if index.dense is not None:
+            if args.dense:
+                from service_requests.embeddings import get_embeddings
+
+                vectors = get_embeddings(queries)
+            else:
+                vectors = list(rng.normal(size=(len(queries), args.dimensions)))
+            latencies = []
+            for _ in range(args.rounds):
+                for query, vector in zip(queries, vectors):
+                    started = time.perf_counter()
+                    index.search(query, args.top, vector)
+                    latencies.append(time.perf_counter() - started)
+            print(f"dense over {len(latencies)} queries (embedding excluded): {percentiles(latencies)}")
+
+        print("\nsample results:")
+        for query in queries[:3]:
+            titles = [r["title"] for r in index.search(query, 3)]
+            print(f"  {query!r}")
+            for title in titles:
+                print(f"      {title}")
+
+
+if __name__ == "__main__":
+    main()
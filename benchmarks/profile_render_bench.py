@@ -0,0 +1,101 @@
+"""
+Benchmark: prompt tokens of the customer profile, legacy text vs compact rendering.
+
+The profile text is injected into the system prompt of every LLM call, so its size
+is paid on each call of each turn. This builds synthetic customers with growing
+service histories and reports, per history size, the tokens of the legacy
+row-per-schedule text and of the budgeted compact rendering, and the saving per turn.
+
+Run with:
+    python -m benchmarks.profile_render_bench
+    python -m benchmarks.profile_render_bench --schedules 10 50 200 1000 --budget 300 --calls-per-turn 3
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from service_requests.customer_profile import build_profile, render_profile
+from service_requests.token_count import count_tokens, counting_method
+
+STATUSES = ("Completed", "Completed", "Completed", "Cancelled")
+MODELS = (("HF 100", "KA01AB"), ("Splendor+", "KA05CD"), ("Xpulse 200", "KA03EF"))
+
+
+def legacy_render(rows: list[dict]) -> str:
+    """The original `fetch_customer_information` text: every field repeated per schedule row."""
+    response_message = ""
+    for result in rows:
+        response_message += f"Customer ID: {result['CustomerID']}\n"
+        response_message += f"Customer Name: {result['CustomerName']}\n"
+        response_message += f"Vehicle ID: {result['VehicleID']}\n"
+        response_message += f"Model: {result['Model']}\n"
+        response_message += f"Year of Manufacture: {result['YearOfManufacture']}\n"
+        response_message += f"Registration Number: {result['RegistrationNumber']}\n"
+        response_message += f"Schedule ID: {result['ScheduleID']}\n"
+        response_message += f"Service Date: {result['ServiceDate']}\n"
+        response_message += f"Start Time: {result['StartTime']}\n"
+        response_message += f"End Time: {result['EndTime']}\n"
+        response_message += f"Schedule Status: {result['ScheduleStatus']}\n\n"
+    return response_message
+
+
+def synthetic_rows(schedules: int, vehicles: int, today: datetime.date, rng: random.Random) -> list[dict]:
+    rows = []
+    for i in range(schedules):
+        vehicle = i % vehicles
+        model, registration = MODELS[vehicle % len(MODELS)]
+        upcoming = i < vehicles  # one upcoming booking per vehicle
+        service_date = today + datetime.timedelta(days=rng.randint(1, 14) if upcoming else -rng.randint(1, 3650))
+        start = datetime.time(rng.choice((9, 10, 11, 12, 14, 15, 16, 17)), 0)
+        rows.append(
+            {
+                "CustomerID": 1,
+                "CustomerName": "Ravi Kumar",
+                "VehicleID": vehicle + 1,
+                "Model": model,
+                "YearOfManufacture": 2018 + vehicle,
+                "RegistrationNumber": f"{registration}{1234 + vehicle}",
+                "ScheduleID": i + 1,
+                "ServiceDate": service_date,
+                "StartTime": start,
+                "EndTime": datetime.time(start.hour + 1, 0),
+                "ScheduleStatus": "Scheduled" if upcoming else rng.choice(STATUSES),
+                "FeedbackCaptured": int(not upcoming and rng.random() < 0.6),
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schedules", type=int, nargs="+", default=[3, 10, 50, 200, 1000])
+    parser.add_argument("--vehicles", type=int, default=2)
+    parser.add_argument("--budget", type=int, default=None, help="token budget (defaults to CUSTOMER_PROFILE_TOKEN_BUDGET)")
+    parser.add_argument("--calls-per-turn", type=int, default=2, help="LLM calls per turn (primary + specialist)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    today = datetime.date.today()
+    print(f"Token counting: {counting_method()}, {args.calls_per_turn} LLM calls per turn")
+    print(
+        f"{'schedules':>9} {'legacy tok':>11} {'compact tok':>12} {'listed':>7} {'summarized':>11} "
+        f"{'saved/turn':>11} {'saved %':>8} {'render ms':>10}"
+    )
+    for schedules in args.schedules:
+        rows = synthetic_rows(schedules, args.vehicles, today, rng)
+        legacy_tokens = count_tokens(legacy_render(rows))
+        started = time.perf_counter()
+        text, stats = render_profile(build_profile(rows), args.budget, today)
+        render_ms = (time.perf_counter() - started) * 1000
+        compact_tokens = count_tokens(text)
+        saved = (legacy_tokens - compact_tokens) * args.calls_per_turn
+        print(
+            f"{schedules:>9} {legacy_tokens:>11,} {compact_tokens:>12,} {stats['listed']:>7} {stats['summarized']:>11} "
+            f"{saved:>11,} {100 * (1 - compact_tokens / legacy_tokens):>7.1f}% {render_ms:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Micro-benchmark: JSON vs table-valued-parameter transport of feedback vectors.
+
+Offline it compares the size of each encoded parameter value and client-side
+encoding time for a 1536-dimension vector. With --live it also inserts rows
+through both paths of InsertServiceFeedback and reports insert latency and the
+bytes the process actually wrote to the connection per insert (from
+/proc/self/io, so Linux only; this includes TDS and TLS framing), then deletes
+the rows it wrote.
+
+Run with:
+    python -m benchmarks.vector_transport_bench
+    python -m benchmarks.vector_transport_bench --live --rows 50 --schedule-id 1 --customer-id 1
+"""
+
+import argparse
+import datetime
+import json
+import statistics
+import time
+
+import numpy as np
+
+from service_requests.vector_codec import (
+    json_param_bytes,
+    pack_float32,
+    tvp_param_bytes,
+    vector_to_json,
+    vector_to_tvp_rows,
+)
+
+BENCH_MARKER = "[vector-transport-bench]"
+
+
+def synthetic_embedding(rng: np.random.Generator, dimensions: int) -> list[float]:
+    """Roughly the value distribution of ada-002 embeddings, as Python floats."""
+    vector = rng.normal(0.0, 0.025, dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def time_call(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def bytes_written() -> int | None:
+    """Bytes this process has passed to write()/send() so far, where the OS reports it."""
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def offline_report(vector: list[float], repeat: int):
+    legacy = lambda: json.dumps(json.loads(str(vector)))  # what store_service_feedback used to do
+    rows = [
+        ("json (legacy, NVARCHAR)", json_param_bytes(vector), time_call(legacy, repeat)),
+        ("json (direct)", json_param_bytes(vector), time_call(lambda: vector_to_json(vector), repeat)),
+        ("tvp dbo.FeedbackVector", tvp_param_bytes(vector), time_call(lambda: vector_to_tvp_rows(vector), repeat)),
+        ("packed float32 (lower bound)", len(pack_float32(vector)), time_call(lambda: pack_float32(vector), repeat)),
+    ]
+    print(f"\nVector dimensions: {len(vector)}")
+    print(f"{'encoding':32} {'param bytes':>14} {'encode (us)':>12}")
+    for name, size, seconds in rows:
+        print(f"{name:32} {size:>14,} {seconds * 1e6:>12.1f}")
+
+
+def live_report(vectors: list[list[float]], schedule_id: int, customer_id: int):
+    from service_requests.credentials import token_cache
+    from service_requests.sql_pool import get_pool
+
+    pool = get_pool(token_cache.get_token)
+    ratings = (4, 4, 4, 4, 4)
+    today = datetime.date.today()
+
+    def insert_json(vector):
+        return (
+            "EXEC InsertServiceFeedback ?, ?, ?, ?, ?, ?, ?, ?, ?, ?",
+            (schedule_id, customer_id, BENCH_MARKER, json.dumps(vector), *ratings, today),
+        )
+
+    def insert_tvp(vector):
+        return (
+            "EXEC InsertServiceFeedback ?, ?, ?, NULL, ?, ?, ?, ?, ?, ?, ?",
+            (schedule_id, customer_id, BENCH_MARKER, *ratings, today, vector_to_tvp_rows(vector)),
+        )
+
+    print(f"\nLive inserts over {len(vectors)} rows per path")
+    print(f"{'path':10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'mean (ms)':>10} {'bytes sent':>12}")
+    try:
+        for name, build in (("json", insert_json), ("tvp", insert_tvp)):
+            samples, sent = [], []
+            for vector in vectors:
+                sql, params = build(vector)
+                with pool.connection() as connection:
+                    cursor = connection.cursor()
+                    written = bytes_written()
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    connection.commit()
+                    samples.append(time.perf_counter() - started)
+                    if written is not None:
+                        sent.append(bytes_written() - written)
+                    cursor.close()
+            measured = f"{statistics.mean(sent):>12,.0f}" if sent else f"{'n/a':>12}"
+            print(
+                f"{name:10} {percentile(samples, 50) * 1000:>10.2f} "
+                f"{percentile(samples, 95) * 1000:>10.2f} {statistics.mean(samples) * 1000:>10.2f} {measured}"
+            )
+    finally:
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM Service_Feedback WHERE feedback_text = ?", (BENCH_MARKER,))
+            connection.commit()
+            cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=200, help="encode iterations per encoding")
+    parser.add_argument("--live", action="store_true", help="also measure inserts against Azure SQL")
+    parser.add_argument("--rows", type=int, default=20, help="rows inserted per path with --live")
+    parser.add_argument("--schedule-id", type=int, default=1)
+    parser.add_argument("--customer-id", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    offline_report(synthetic_embedding(rng, args.dimensions), args.repeat)
+    if args.live:
+        vectors = [synthetic_embedding(rng, args.dimensions) for _ in range(args.rows)]
+        live_report(vectors, args.schedule_id, args.customer_id)
+
+
+if __name__ == "__main__":
+    main()
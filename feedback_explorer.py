@@ -5,76 +5,43 @@ Run with:
     streamlit run feedback_explorer.py
 """
 
-import json
-import os
-import struct
-from urllib import request as url_request
+import time
 
 import pandas as pd
-import pyodbc
 import streamlit as st
-from azure.identity import DefaultAzureCredential
 from dotenv import load_dotenv
 
+from service_requests.credentials import token_cache
+from service_requests.embeddings import embedding_cache, embedding_client
+from service_requests.embeddings import get_embedding as get_cached_embedding
+from service_requests.feedback_index import FeedbackIndex, feedback_index_enabled, feedback_texts
+from service_requests.feedback_schema import RATING_COLUMNS
+from service_requests.feedback_search import RESULT_COLUMNS, FeedbackSearch, feedback_search_mode
+from service_requests.sql_pool import get_pool
+
 load_dotenv()
 
-SQL_SCOPE = "https://database.windows.net/.default"
-OPENAI_SCOPE = "https://cognitiveservices.azure.com/.default"
 
-# Rating columns in Service_Feedback
-RATING_COLUMNS = {
-    "rating_overall_experience": "Overall Experience",
-    "rating_quality_of_work": "Quality of Work",
-    "rating_timeliness": "Timeliness",
-    "rating_politeness": "Politeness",
-    "rating_cleanliness": "Cleanliness",
-}
+@st.cache_resource
+def get_sql_pool():
+    """Connection pool shared across Streamlit sessions and reruns."""
+    return get_pool(token_cache.get_token)
 
 
 @st.cache_resource
-def get_credential():
-    return DefaultAzureCredential()
-
-
-def get_sql_connection():
-    credential = get_credential()
-    server = os.getenv("az_db_server", "")
-    database = os.getenv("az_db_database", "")
-    token = credential.get_token(SQL_SCOPE).token
-    token_bytes = token.encode("UTF-16-LE")
-    token_struct = struct.pack(f"<I{len(token_bytes)}s", len(token_bytes), token_bytes)
-    conn_str = (
-        "Driver={ODBC Driver 18 for SQL Server};"
-        f"SERVER={server};"
-        f"DATABASE={database};"
-        "Encrypt=yes;TrustServerCertificate=no;"
-    )
-    return pyodbc.connect(
-        conn_str, attrs_before={1256: token_struct}
-    )
+def get_feedback_index():
+    """In-process feedback vector index shared across Streamlit sessions."""
+    return FeedbackIndex()
+
+
+@st.cache_resource
+def get_feedback_search():
+    """Exact / DiskANN search over Service_Feedback, shared across Streamlit sessions."""
+    return FeedbackSearch(get_sql_pool())
 
 
 def get_embedding(text: str) -> list[float]:
-    credential = get_credential()
-    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "").rstrip("/")
-    deployment = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME", "")
-    api_version = os.getenv("AZURE_OPENAI_EMBEDDINGS_API_VERSION", "2023-05-15")
-    token = credential.get_token(OPENAI_SCOPE).token
-
-    url = f"{endpoint}/openai/deployments/{deployment}/embeddings?api-version={api_version}"
-    body = json.dumps({"input": text}).encode("utf-8")
-    req = url_request.Request(
-        url=url,
-        method="POST",
-        data=body,
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
-    with url_request.urlopen(req, timeout=60) as resp:
-        payload = json.loads(resp.read().decode("utf-8"))
-    return payload["data"][0]["embedding"]
+    return get_cached_embedding(text)
 
 
 def build_query(
@@ -122,6 +89,36 @@ def build_query(
     return "\n".join(lines)
 
 
+def build_approximate_query(
+    rating_filters: dict[str, int | None],
+    distance_threshold: float | None,
+    top_n: int,
+) -> str:
+    """Build the DiskANN T-SQL query string for display."""
+    post_filters = [f"distance <= {distance_threshold}"] if distance_threshold is not None else []
+    post_filters += [f"{col} <= {max_val}" for col, max_val in rating_filters.items() if max_val is not None]
+    lines = [
+        "DECLARE @embedding_json nvarchar(max) = <embedding from query text>;",
+        "DECLARE @e vector(1536) = CAST(@embedding_json AS vector(1536));",
+        "",
+        "SELECT t.feedback_id, t.customer_id, t.schedule_id, t.rating_*, t.feedback_date, s.distance",
+        "FROM VECTOR_SEARCH(",
+        "    TABLE = Service_Feedback AS t,",
+        "    COLUMN = feedback_vector,",
+        "    SIMILAR_TO = @e,",
+        "    METRIC = 'cosine',",
+        "    TOP_N = <candidates, over-fetched for the filters>",
+        ") AS s",
+        "ORDER BY s.distance;",
+        "",
+        f"-- then, in the app: keep the first {top_n} candidates where "
+        + (" AND ".join(post_filters) if post_filters else "(no filters)")
+        + ";",
+        "-- fetch feedback_text for them; exact query if too few pass",
+    ]
+    return "\n".join(lines)
+
+
 def execute_query(
     embedding: list[float],
     rating_filters: dict[str, int | None],
@@ -129,60 +126,36 @@ def execute_query(
     top_n: int,
 ) -> pd.DataFrame:
     """Execute the parameterized vector search query and return a DataFrame."""
-    parts = []
-    params = []
-
-    parts.append(
-        "DECLARE @embedding_json nvarchar(max) = ?;\n"
-        "DECLARE @e vector(1536) = CAST(@embedding_json AS vector(1536));\n"
-    )
-    params.append(json.dumps(embedding))
-
-    parts.append(f"SELECT TOP ({top_n})")
-    select_cols = [
-        "    sf.feedback_id",
-        "    sf.customer_id",
-        "    sf.schedule_id",
-        "    sf.feedback_text",
-        "    sf.rating_quality_of_work",
-        "    sf.rating_timeliness",
-        "    sf.rating_politeness",
-        "    sf.rating_cleanliness",
-        "    sf.rating_overall_experience",
-        "    sf.feedback_date",
-        "    vector_distance('cosine', @e, sf.feedback_vector) AS distance",
-    ]
-    parts.append(",\n".join(select_cols))
-    parts.append("FROM Service_Feedback sf")
-
-    where_clauses = ["sf.feedback_vector IS NOT NULL"]
-    if distance_threshold is not None:
-        where_clauses.append(
-            f"vector_distance('cosine', @e, sf.feedback_vector) <= {distance_threshold}"
-        )
+    records = get_feedback_search().exact(embedding, rating_filters, distance_threshold, top_n)
+    return pd.DataFrame.from_records(records, columns=RESULT_COLUMNS)
 
-    for col, max_val in rating_filters.items():
-        if max_val is not None:
-            where_clauses.append(f"sf.{col} <= ?")
-            params.append(max_val)
 
-    parts.append("WHERE")
-    parts.append("    " + "\n    AND ".join(where_clauses))
-    parts.append("ORDER BY distance;")
-
-    sql = "\n".join(parts)
+def execute_approximate_query(
+    embedding: list[float],
+    rating_filters: dict[str, int | None],
+    distance_threshold: float | None,
+    top_n: int,
+) -> tuple[pd.DataFrame, dict]:
+    """Search through the DiskANN index, falling back to the exact query; also returns the path taken."""
+    records, info = get_feedback_search().search(embedding, rating_filters, distance_threshold, top_n, mode="approximate")
+    return pd.DataFrame.from_records(records, columns=RESULT_COLUMNS), info
 
-    conn = get_sql_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        cursor.close()
-    finally:
-        conn.close()
 
-    return pd.DataFrame.from_records(rows, columns=columns)
+def execute_index_query(
+    embedding: list[float],
+    rating_filters: dict[str, int | None],
+    distance_threshold: float | None,
+    top_n: int,
+) -> pd.DataFrame:
+    """Answer the same query from the in-process index; only feedback_text is read from Azure SQL."""
+    pool = get_sql_pool()
+    index = get_feedback_index()
+    index.sync_if_due(pool)
+    records = index.search(embedding, rating_filters, distance_threshold, top_n)
+    texts = feedback_texts(pool, [r["feedback_id"] for r in records])
+    for record in records:
+        record["feedback_text"] = texts.get(record["feedback_id"])
+    return pd.DataFrame.from_records(records, columns=RESULT_COLUMNS)
 
 
 # ── Streamlit UI ──────────────────────────────────────────────
@@ -219,36 +192,80 @@ with st.sidebar:
     )
     top_n = st.slider("Top N results", min_value=1, max_value=100, value=20)
 
+    search_paths = ["Exact (Azure SQL)", "Approximate (DiskANN index)", "In-process vector index"]
+    default_path = 2 if feedback_index_enabled else 1 if feedback_search_mode == "approximate" else 0
+    search_path = st.radio(
+        "Search path",
+        search_paths,
+        index=default_path,
+        help="Exact runs vector_distance over every matching row. Approximate asks the DiskANN index (scripts/feedback-vector-index.sql) for over-fetched candidates and filters them, falling back to exact when needed. The in-process index searches a copy of the feedback vectors synced from Azure SQL by feedback_id.",
+    )
+    use_index = search_path == search_paths[2]
+    use_approximate = search_path == search_paths[1]
+
     run_button = st.button("Run Query", type="primary", use_container_width=True)
 
+    with st.expander("Connection pool"):
+        st.json(get_sql_pool().metrics())
+
+    with st.expander("Token refresh"):
+        st.json(token_cache.metrics())
+
+    with st.expander("Embeddings client"):
+        st.json(embedding_client.metrics())
+        st.json(embedding_cache.metrics())
+
+    if use_approximate:
+        with st.expander("DiskANN search"):
+            st.json(get_feedback_search().metrics())
+
+    if use_index:
+        with st.expander("Feedback index"):
+            if st.button("Rebuild index"):
+                with st.spinner("Reloading feedback vectors from Azure SQL..."):
+                    get_feedback_index().rebuild(get_sql_pool())
+            st.json(get_feedback_index().metrics())
+
 # Main area
 if run_button:
     if not sentiment_text.strip():
         st.warning("Please enter a query text for vector search.")
     else:
         # Build display SQL
-        display_sql = build_query(
+        display_sql = (build_approximate_query if use_approximate else build_query)(
             rating_filters=rating_filters,
             distance_threshold=distance_threshold,
             top_n=top_n,
         )
 
-        st.subheader("Generated T-SQL")
+        st.subheader("Equivalent T-SQL (answered by the in-process index)" if use_index else "Generated T-SQL")
         st.code(display_sql, language="sql")
 
         # Execute
         with st.spinner("Generating embedding from Azure OpenAI..."):
             embedding = get_embedding(sentiment_text.strip())
 
-        with st.spinner("Running vector search on Azure SQL..."):
-            df = execute_query(
+        started = time.perf_counter()
+        path_note = ""
+        with st.spinner("Searching the in-process index..." if use_index else "Running vector search on Azure SQL..."):
+            query_args = dict(
                 embedding=embedding,
                 rating_filters=rating_filters,
                 distance_threshold=distance_threshold,
                 top_n=top_n,
             )
+            if use_approximate:
+                df, info = execute_approximate_query(**query_args)
+                if info["path"] == "approximate":
+                    path_note = f" via the DiskANN index ({info['candidates']} candidates, {info['rounds']} round(s))"
+                else:
+                    path_note = f" via the exact query ({info['reason']})"
+            else:
+                df = (execute_index_query if use_index else execute_query)(**query_args)
+        elapsed_ms = (time.perf_counter() - started) * 1000
 
         st.subheader(f"Results ({len(df)} rows)")
+        st.caption(f"Search took {elapsed_ms:.1f} ms{path_note}")
         if df.empty:
             st.info("No matching feedback found. Try adjusting your filters or increasing the distance threshold.")
         else:
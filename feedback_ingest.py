@@ -0,0 +1,299 @@
+"""
+Bulk feedback ingest and re-embedding pipeline for Service_Feedback.
+
+Modes:
+    load     stream feedback from a JSONL or CSV export, embed it in large batches
+             and insert it chunk by chunk with fast_executemany
+    reembed  recompute feedback_vector for rows already in Service_Feedback, e.g.
+             after the embedding deployment changed
+
+Each chunk is written in one transaction together with its checkpoint row in
+Feedback_Ingest_Checkpoints (scripts/feedback-ingest-checkpoints.sql). Re-running
+the same command after a crash resumes right after the last committed chunk.
+While one chunk is being written the next one is already being embedded.
+
+Source records use the Service_Feedback column names: schedule_id, customer_id,
+feedback_text, the rating_* columns and feedback_date (YYYY-MM-DD).
+
+Run with:
+    python feedback_ingest.py load exports/feedback.jsonl
+    python feedback_ingest.py load exports/feedback.csv --chunk-size 2000
+    python feedback_ingest.py reembed --only-missing
+"""
+
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from service_requests.credentials import token_cache
+from service_requests.embeddings import EmbeddingClient
+from service_requests.feedback_schema import (
+    FEEDBACK_VECTOR_DIMENSIONS,
+    RATING_COLUMNS,
+    RATING_MAX,
+    RATING_MIN,
+)
+from service_requests.sql_pool import get_pool
+from service_requests.vector_codec import vector_to_json
+
+RATING_NAMES = list(RATING_COLUMNS)
+
+INSERT_SQL = f"""
+INSERT INTO Service_Feedback (
+    schedule_id, customer_id, feedback_text, feedback_vector,
+    {", ".join(RATING_NAMES)}, feedback_date
+) VALUES (?, ?, ?, CAST(? AS vector({FEEDBACK_VECTOR_DIMENSIONS})), {", ".join("?" for _ in RATING_NAMES)}, ?)
+"""
+
+UPDATE_SQL = f"""
+UPDATE Service_Feedback
+SET feedback_vector = CAST(? AS vector({FEEDBACK_VECTOR_DIMENSIONS}))
+WHERE feedback_id = ?
+"""
+
+
+# ── source records ──────────────────────────────────────────────
+
+
+def read_records(path: str):
+    """Yield raw records from a .jsonl or .csv export, one dict per source row."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _optional_int(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def parse_record(raw: dict) -> tuple | None:
+    """Convert a raw record into INSERT parameters (without the vector), or None if invalid."""
+    text = (raw.get("feedback_text") or "").strip()
+    if not text:
+        return None
+    try:
+        ratings = [_optional_int(raw.get(name)) for name in RATING_NAMES]
+        if any(r is not None and not RATING_MIN <= r <= RATING_MAX for r in ratings):
+            return None
+        feedback_date = raw.get("feedback_date") or None
+        if feedback_date:
+            feedback_date = datetime.date.fromisoformat(str(feedback_date)[:10])
+        return (
+            _optional_int(raw.get("schedule_id")),
+            _optional_int(raw.get("customer_id")),
+            text,
+            ratings,
+            feedback_date,
+        )
+    except ValueError:
+        return None
+
+
+# ── checkpoints ─────────────────────────────────────────────────
+
+
+def read_checkpoint(pool, job: str) -> tuple[int, int]:
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT position, rows_written FROM Feedback_Ingest_Checkpoints WHERE job_name = ?",
+            (job,),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def write_checkpoint(cursor, job: str, position: int, rows_written: int):
+    """Advance the checkpoint; runs inside the caller's transaction."""
+    cursor.execute(
+        "UPDATE Feedback_Ingest_Checkpoints SET position = ?, rows_written = ?, updated_at = SYSUTCDATETIME() "
+        "WHERE job_name = ?",
+        (position, rows_written, job),
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            "INSERT INTO Feedback_Ingest_Checkpoints (job_name, position, rows_written) VALUES (?, ?, ?)",
+            (job, position, rows_written),
+        )
+
+
+def reset_checkpoint(pool, job: str):
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM Feedback_Ingest_Checkpoints WHERE job_name = ?", (job,))
+        connection.commit()
+        cursor.close()
+
+
+# ── pipeline helpers ────────────────────────────────────────────
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def prefetch(chunks, prepare):
+    """Run `prepare` on the next chunk in the background while the caller writes the current one."""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-prefetch") as executor:
+        pending = None
+        for chunk in chunks:
+            future = executor.submit(prepare, chunk)
+            if pending is not None:
+                yield pending.result()
+            pending = future
+        if pending is not None:
+            yield pending.result()
+
+
+class Progress:
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.skipped = 0
+
+    def report(self, rows: int, skipped: int, position: int):
+        self.rows += rows
+        self.skipped += skipped
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        print(
+            f"{self.label}: +{rows} rows (total {self.rows}, skipped {self.skipped}, "
+            f"position {position}) {rate:,.1f} rows/sec"
+        )
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        print(
+            f"{self.label} finished: {self.rows} rows written, {self.skipped} skipped "
+            f"in {elapsed:.1f}s ({rate:,.1f} rows/sec)"
+        )
+
+
+# ── modes ───────────────────────────────────────────────────────
+
+
+def run_load(args, pool, client: EmbeddingClient):
+    job = args.job or f"load:{os.path.basename(args.path)}"
+    if args.restart:
+        reset_checkpoint(pool, job)
+    position, rows_written = read_checkpoint(pool, job)
+    if position:
+        print(f"resuming {job} after {position} source records ({rows_written} rows written)")
+
+    def prepare(chunk):
+        parsed = [parse_record(raw) for raw in chunk]
+        valid = [p for p in parsed if p is not None]
+        vectors = client.embed_many([p[2] for p in valid]) if valid else []
+        rows = [
+            (schedule_id, customer_id, text, vector_to_json(vector), *ratings, feedback_date)
+            for (schedule_id, customer_id, text, ratings, feedback_date), vector in zip(valid, vectors)
+        ]
+        return len(chunk), rows
+
+    progress = Progress(job)
+    records = itertools.islice(read_records(args.path), position, None)
+    for consumed, rows in prefetch(chunked(records, args.chunk_size), prepare):
+        position += consumed
+        rows_written += len(rows)
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.fast_executemany = True
+            if rows:
+                cursor.executemany(INSERT_SQL, rows)
+            write_checkpoint(cursor, job, position, rows_written)
+            connection.commit()
+            cursor.close()
+        progress.report(len(rows), consumed - len(rows), position)
+    progress.summary()
+
+
+def run_reembed(args, pool, client: EmbeddingClient):
+    job = args.job or f"reembed:{client.deployment}"
+    if args.restart:
+        reset_checkpoint(pool, job)
+    position, rows_written = read_checkpoint(pool, job)
+    if position:
+        print(f"resuming {job} after feedback_id {position} ({rows_written} rows written)")
+
+    only_missing = "AND feedback_vector IS NULL" if args.only_missing else ""
+
+    def pages(after_id: int):
+        while True:
+            with pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    f"SELECT TOP ({args.chunk_size}) feedback_id, feedback_text FROM Service_Feedback "
+                    f"WHERE feedback_id > ? {only_missing} ORDER BY feedback_id",
+                    (after_id,),
+                )
+                page = cursor.fetchall()
+                cursor.close()
+            if not page:
+                return
+            yield page
+            after_id = page[-1][0]
+
+    def prepare(page):
+        valid = [(feedback_id, text) for feedback_id, text in page if text and text.strip()]
+        vectors = client.embed_many([text for _, text in valid]) if valid else []
+        rows = [(vector_to_json(vector), feedback_id) for (feedback_id, _), vector in zip(valid, vectors)]
+        return page[-1][0], len(page), rows
+
+    progress = Progress(job)
+    for last_id, fetched, rows in prefetch(pages(position), prepare):
+        position = last_id
+        rows_written += len(rows)
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.fast_executemany = True
+            if rows:
+                cursor.executemany(UPDATE_SQL, rows)
+            write_checkpoint(cursor, job, position, rows_written)
+            connection.commit()
+            cursor.close()
+        progress.report(len(rows), fetched - len(rows), position)
+    progress.summary()
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--chunk-size", type=int, default=1000, help="rows per transaction")
+    common.add_argument("--batch-size", type=int, default=256, help="inputs per embeddings request")
+    common.add_argument("--job", help="checkpoint name (defaults to the mode and source)")
+    common.add_argument("--restart", action="store_true", help="ignore any existing checkpoint")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    modes = parser.add_subparsers(dest="mode", required=True)
+    load = modes.add_parser("load", parents=[common], help="insert feedback from a JSONL or CSV export")
+    load.add_argument("path")
+    reembed = modes.add_parser("reembed", parents=[common], help="re-embed existing Service_Feedback rows")
+    reembed.add_argument("--only-missing", action="store_true", help="only rows without a vector")
+    args = parser.parse_args()
+
+    pool = get_pool(token_cache.get_token)
+    # A dedicated client, so bulk traffic neither pollutes the embedding cache nor waits on the micro-batcher
+    client = EmbeddingClient(max_batch_size=args.batch_size)
+    if args.mode == "load":
+        run_load(args, pool, client)
+    else:
+        run_reembed(args, pool, client)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Incremental ingestion of the owner's manual into the Q&A search index.
+
+The manual (default documents/heromotocorp-sample-understood.md) is chunked by
+service_requests/manual_chunks.py: on headings and page breaks, with every
+<figure> description as a separate low-weight chunk. A chunk's id is the hash of
+its title, content and vehicle models, so a re-run only embeds and uploads chunks
+that changed and deletes the ones that disappeared; unchanged chunks are skipped.
+
+Targets:
+    azure  upload to the Azure AI Search index (ai_search_url / ai_index_name) in
+           parallel batches. Documents carry id, title, content, page, kind, weight,
+           vehicle_models, source and the embedding in --vector-field (empty to
+           upload text only). The index is created with these fields, a
+           semantic configuration and a default scoring profile that boosts by
+           `weight` when missing; fields missing from an existing index are added
+           before uploading.
+           The ids already uploaded are kept in a manifest under
+           .cache/manual_ingest/, updated only for batches the service accepted,
+           so a failed run is completed by running it again
+    local  sync the offline index used with SEARCH_BACKEND=local
+           (service_requests/local_search.py); chunks are embedded only with
+           LOCAL_SEARCH_DENSE=true or --dense
+
+After a change the search index version is bumped, which clears the semantic
+search cache and reloads the local index in running processes.
+
+Run with:
+    python manual_ingest.py --target local
+    python manual_ingest.py --target azure --workers 4
+    python manual_ingest.py --target azure --full     # re-embed and re-upload every chunk
+    python manual_ingest.py --source manuals/hf-deluxe.md --models "HF Deluxe"
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from service_requests.embeddings import EmbeddingClient
+from service_requests.local_search import (
+    LocalSearchIndex,
+    file_hash,
+    local_search_dense,
+    local_search_index_dir,
+    local_search_source,
+)
+from service_requests.manual_chunks import chunk_manual
+from service_requests.search_cache import bump_index_version
+
+MANIFEST_DIR = os.path.join(".cache", "manual_ingest")
+VECTOR_PROFILE = "manual-vector-profile"
+VECTOR_ALGORITHM = "manual-hnsw"
+WEIGHT_PROFILE = "chunk-weight"
+
+
+def chunked(items: list, size: int):
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+# ── manifest ────────────────────────────────────────────────────
+
+
+def manifest_path(index_name: str) -> str:
+    return os.path.join(MANIFEST_DIR, f"{index_name}.json")
+
+
+def read_manifest(path: str) -> set[str]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return set(json.load(f)["ids"])
+    except FileNotFoundError:
+        return set()
+
+
+def write_manifest(path: str, ids: set[str]):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"ids": sorted(ids)}, f)
+    os.replace(tmp, path)
+
+
+# ── Azure index schema ──────────────────────────────────────────
+
+
+def index_fields(vector_field: str | None, dimensions: int) -> list:
+    """Fields of the documents ingest_azure uploads."""
+    from azure.search.documents.indexes.models import (
+        SearchableField,
+        SearchField,
+        SearchFieldDataType,
+        SimpleField,
+    )
+
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="title", type=SearchFieldDataType.String),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SimpleField(name="page", type=SearchFieldDataType.Int32, filterable=True),
+        SimpleField(name="kind", type=SearchFieldDataType.String, filterable=True),
+        SimpleField(name="weight", type=SearchFieldDataType.Double, filterable=True),
+        SimpleField(
+            name="vehicle_models", type=SearchFieldDataType.Collection(SearchFieldDataType.String), filterable=True
+        ),
+        SimpleField(name="source", type=SearchFieldDataType.String, filterable=True),
+    ]
+    if vector_field:
+        fields.append(
+            SearchField(
+                name=vector_field,
+                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                searchable=True,
+                vector_search_dimensions=dimensions,
+                vector_search_profile_name=VECTOR_PROFILE,
+            )
+        )
+    return fields
+
+
+def ensure_index(credential, endpoint: str, index_name: str, vector_field: str | None, dimensions: int):
+    """
+    Create the index when missing, or add the fields it lacks, so uploads are not
+    rejected for unknown fields. `weight` only ranks figure descriptions below text
+    through the index's default scoring profile, which is set up here too.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    from azure.search.documents.indexes import SearchIndexClient
+    from azure.search.documents.indexes.models import (
+        HnswAlgorithmConfiguration,
+        MagnitudeScoringFunction,
+        MagnitudeScoringParameters,
+        ScoringProfile,
+        SearchIndex,
+        SemanticConfiguration,
+        SemanticField,
+        SemanticPrioritizedFields,
+        SemanticSearch,
+        VectorSearch,
+        VectorSearchProfile,
+    )
+
+    from service_requests.search_tools import ai_semantic_config
+
+    indexes = SearchIndexClient(endpoint=endpoint, credential=credential)
+    fields = index_fields(vector_field, dimensions)
+    try:
+        index = indexes.get_index(index_name)
+    except ResourceNotFoundError:
+        index = SearchIndex(
+            name=index_name,
+            fields=[],
+            semantic_search=SemanticSearch(
+                configurations=[
+                    SemanticConfiguration(
+                        name=ai_semantic_config or "default",
+                        prioritized_fields=SemanticPrioritizedFields(
+                            title_field=SemanticField(field_name="title"),
+                            content_fields=[SemanticField(field_name="content")],
+                        ),
+                    )
+                ]
+            ),
+        )
+        print(f"creating search index {index_name}")
+
+    existing = {field.name for field in index.fields}
+    missing = [field for field in fields if field.name not in existing]
+    changed = bool(missing)
+    index.fields = list(index.fields) + missing
+    if any(field.name == vector_field for field in missing):
+        vector_search = index.vector_search or VectorSearch(algorithms=[], profiles=[])
+        if not any(p.name == VECTOR_PROFILE for p in vector_search.profiles or []):
+            vector_search.algorithms = list(vector_search.algorithms or []) + [HnswAlgorithmConfiguration(name=VECTOR_ALGORITHM)]
+            vector_search.profiles = list(vector_search.profiles or []) + [
+                VectorSearchProfile(name=VECTOR_PROFILE, algorithm_configuration_name=VECTOR_ALGORITHM)
+            ]
+            index.vector_search = vector_search
+            changed = True
+    if not any(p.name == WEIGHT_PROFILE for p in index.scoring_profiles or []):
+        index.scoring_profiles = list(index.scoring_profiles or []) + [
+            ScoringProfile(
+                name=WEIGHT_PROFILE,
+                functions=[
+                    MagnitudeScoringFunction(
+                        field_name="weight",
+                        boost=2.0,
+                        parameters=MagnitudeScoringParameters(boosting_range_start=0.0, boosting_range_end=1.0),
+                        interpolation="linear",
+                    )
+                ],
+            )
+        ]
+        index.default_scoring_profile = index.default_scoring_profile or WEIGHT_PROFILE
+        changed = True
+    if changed:
+        if missing and existing:
+            print(f"adding fields {[field.name for field in missing]} to search index {index_name}")
+        indexes.create_or_update_index(index)
+
+
+# ── targets ─────────────────────────────────────────────────────
+
+
+def ingest_azure(args, chunks: list[dict], client: EmbeddingClient) -> dict:
+    from azure.search.documents import SearchClient
+
+    from service_requests.credentials import token_cache
+    from service_requests.embedding_cache import embedding_dimensions
+    from service_requests.search_tools import ai_index_name, ai_search_url
+
+    ensure_index(token_cache, ai_search_url, ai_index_name, args.vector_field, embedding_dimensions)
+    search = SearchClient(endpoint=ai_search_url, index_name=ai_index_name, credential=token_cache)
+    path = manifest_path(ai_index_name)
+    indexed = read_manifest(path)
+    changed = chunks if args.full else [c for c in chunks if c["id"] not in indexed]
+    stale = sorted(indexed - {c["id"] for c in chunks})
+    source = os.path.basename(args.source)
+    stats = {"chunks": len(chunks), "uploaded": 0, "deleted": 0, "failed": 0, "unchanged": len(chunks) - len(changed)}
+
+    def upload(batch: list[dict], vectors) -> list[str]:
+        documents = [{**c, "source": source} for c in batch]
+        if vectors is not None:
+            for document, vector in zip(documents, vectors):
+                document[args.vector_field] = vector
+        results = search.upload_documents(documents=documents)
+        return [r.key for r in results if r.succeeded]
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="manual-upload") as executor:
+        futures = []
+        for batch in chunked(changed, args.upload_batch):
+            # Embedding the next batch overlaps with the uploads already submitted
+            vectors = client.embed_many([f"{c['title']}\n{c['content']}" for c in batch]) if args.vector_field else None
+            futures.append((batch, executor.submit(upload, batch, vectors)))
+        for batch, future in futures:
+            try:
+                succeeded = future.result()
+            except Exception as e:
+                print(f"upload of {len(batch)} chunks failed: {e}")
+                succeeded = []
+            indexed.update(succeeded)
+            stats["uploaded"] += len(succeeded)
+            stats["failed"] += len(batch) - len(succeeded)
+
+    for batch in chunked(stale, args.upload_batch):
+        results = search.delete_documents(documents=[{"id": chunk_id} for chunk_id in batch])
+        deleted = {r.key for r in results if r.succeeded}
+        indexed -= deleted
+        stats["deleted"] += len(deleted)
+    write_manifest(path, indexed)
+    return stats
+
+
+def ingest_local(args, chunks: list[dict], client: EmbeddingClient) -> dict:
+    index = LocalSearchIndex(args.index_dir, args.source, dense=args.dense)
+    if args.full and os.path.exists(index.chunks_path):
+        os.remove(index.chunks_path)
+    stats = index.sync(chunks, client.embed_many, file_hash(args.source))
+    return {
+        "chunks": stats["chunks"],
+        "uploaded": stats["added"],
+        "deleted": stats["deleted"],
+        "failed": 0,
+        "unchanged": stats["unchanged"],
+        "embedded": stats["embedded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=local_search_source, help="manual markdown to ingest")
+    parser.add_argument("--target", choices=("azure", "local"), default="azure")
+    parser.add_argument("--full", action="store_true", help="treat every chunk as changed")
+    parser.add_argument(
+        "--models", nargs="+", help="vehicle models the manual covers (default: MANUAL_VEHICLE_MODELS or its title)"
+    )
+    parser.add_argument("--batch-size", type=int, default=256, help="inputs per embeddings request")
+    parser.add_argument("--upload-batch", type=int, default=100, help="documents per upload request")
+    parser.add_argument("--workers", type=int, default=4, help="parallel upload requests")
+    parser.add_argument("--vector-field", default=os.getenv("SEARCH_VECTOR_FIELD", "content_vector"))
+    parser.add_argument("--index-dir", default=local_search_index_dir, help="local index directory")
+    parser.add_argument("--dense", action="store_true", default=local_search_dense, help="embed chunks for the local index")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with open(args.source, encoding="utf-8") as f:
+        chunks = chunk_manual(f.read(), vehicle_models=args.models)
+    chunks = list({c["id"]: c for c in chunks}.values())
+    figures = sum(c["kind"] == "figure" for c in chunks)
+    print(
+        f"{args.source}: {len(chunks)} chunks ({figures} figure descriptions) for models "
+        f"{chunks[0]['vehicle_models'] if chunks else []} in {time.perf_counter() - started:.2f}s"
+    )
+
+    # A dedicated client, so bulk traffic neither pollutes the embedding cache nor waits on the micro-batcher
+    client = EmbeddingClient(max_batch_size=args.batch_size)
+    if args.target == "azure":
+        stats = ingest_azure(args, chunks, client)
+    else:
+        stats = ingest_local(args, chunks, client)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{args.target}: {stats['uploaded']} chunks written, {stats['unchanged']} unchanged skipped, "
+        f"{stats['deleted']} deleted, {stats['failed']} failed in {elapsed:.1f}s "
+        f"({stats['chunks'] / elapsed if elapsed else 0.0:,.1f} chunks/sec, "
+        f"{stats['uploaded'] / elapsed if elapsed else 0.0:,.1f} written/sec)"
+    )
+    if stats["uploaded"] or stats["deleted"]:
+        bump_index_version()
+        print("search index version bumped; semantic search caches will be cleared")
+
+
+if __name__ == "__main__":
+    main()
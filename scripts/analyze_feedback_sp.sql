@@ -10,7 +10,15 @@ GO
 -- =============================================
 CREATE OR ALTER PROCEDURE [dbo].[AnalyzeFeedback]
 (
-	@user_query_vector_json NVARCHAR(MAX)
+	@user_query_vector_json NVARCHAR(MAX),
+	-- 1 = read candidates from the DiskANN index (scripts/feedback-vector-index.sql)
+	@approximate BIT = 0,
+	-- Rows to return; NULL = every match (exact only)
+	@top_n INT = NULL,
+	-- Below this many rows the exact scan is used
+	@min_ann_rows INT = 20000,
+	-- Largest candidate set requested from the index before falling back to exact
+	@max_candidates INT = 2000
 )
 AS
 BEGIN
@@ -33,7 +41,51 @@ BEGIN
 		) V(a)
 	;
 	declare @v1 vector(1536) = (SELECT vector FROM #query_vectors WHERE id = 1)
-	select 
+
+	-- Approximate path: VECTOR_SEARCH ranks the whole table, so the filters below
+	-- are applied to its candidates; over-fetch and double until @top_n rows pass,
+	-- the candidates get farther than the distance cut-off, or @max_candidates.
+	declare @rows bigint = (
+		select sum(p.rows) from sys.partitions p
+		where p.object_id = OBJECT_ID(N'dbo.Service_Feedback') and p.index_id in (0, 1)
+	);
+	if @approximate = 1 and @top_n is not null and @rows >= @min_ann_rows
+	begin
+		declare @candidates int = @top_n * 4, @found int, @returned int, @farthest float;
+		if @candidates > @max_candidates set @candidates = @max_candidates;
+		create table #matches (feedback_text nvarchar(max), distance float);
+		while 1 = 1
+		begin
+			truncate table #matches;
+			select s.distance, t.rating_overall_experience, t.feedback_id
+			into #candidates
+			from VECTOR_SEARCH(
+				TABLE = Service_Feedback AS t,
+				COLUMN = feedback_vector,
+				SIMILAR_TO = @v1,
+				METRIC = 'cosine',
+				TOP_N = @candidates
+			) AS s;
+			select @returned = count(*), @farthest = max(distance) from #candidates;
+			insert into #matches (feedback_text, distance)
+			select top (@top_n) sf.feedback_text, c.distance
+			from #candidates c join Service_Feedback sf on sf.feedback_id = c.feedback_id
+			where c.distance < 0.5 and c.rating_overall_experience <= 3
+			order by c.distance;
+			set @found = @@ROWCOUNT;
+			drop table #candidates;
+			if @found >= @top_n or @returned < @candidates or @farthest >= 0.5
+			begin
+				select feedback_text, distance from #matches order by distance;
+				return;
+			end
+			if @candidates >= @max_candidates break;
+			set @candidates = case when @candidates * 2 > @max_candidates then @max_candidates else @candidates * 2 end;
+		end
+		-- candidates ran out before @top_n rows passed the filters: exact scan below
+	end
+
+	select top (isnull(@top_n, 2147483647))
     sf.feedback_text,    
     vector_distance('cosine', @v1, sf.feedback_vector) as distance
 from
@@ -1,39 +1,44 @@
+/****** Object:  UserDefinedTableType [dbo].[FeedbackVector] ******/
+-- One row per embedding dimension. Sent from Python as a table-valued parameter,
+-- so the vector travels as fixed-width binary instead of a UTF-16 JSON string.
+-- The vector type is only built from text, so the procedure still formats the rows
+-- as a JSON array on the server; the saving is on the wire, not in the cast.
+IF TYPE_ID(N'dbo.FeedbackVector') IS NULL
+    CREATE TYPE [dbo].[FeedbackVector] AS TABLE
+    (
+        ordinal SMALLINT NOT NULL PRIMARY KEY,
+        value REAL NOT NULL
+    );
+GO
 /****** Object:  StoredProcedure [dbo].[InsertServiceFeedback]    Script Date: 16-12-2024 10:01:00 ******/
 SET ANSI_NULLS ON
 GO
 SET QUOTED_IDENTIFIER ON
 GO
-CREATE PROCEDURE [dbo].[InsertServiceFeedback]
+CREATE OR ALTER PROCEDURE [dbo].[InsertServiceFeedback]
     @schedule_id INT,
     @customer_id INT,
     @feedback_text NVARCHAR(MAX),
-    @feedback_vector_json NVARCHAR(MAX), -- Accept JSON string
+    @feedback_vector_json NVARCHAR(MAX), -- Legacy JSON path; pass NULL when @feedback_vector is used
     @rating_quality_of_work INT,
     @rating_timeliness INT,
     @rating_politeness INT,
     @rating_cleanliness INT,
     @rating_overall_experience INT,
-    @feedback_date DATE
+    @feedback_date DATE,
+    @feedback_vector dbo.FeedbackVector READONLY -- Compact path: one row per dimension
 AS
 BEGIN
     SET NOCOUNT ON;
 
-	
-drop table if exists #vectors
-create table #vectors
-(
-    id int not null identity primary key,
-    vector vector(1536) not null
-);
-	insert into #vectors (vector)
-select 
-    cast(a as vector(1536))
-from
-    ( values 
-        (@feedback_vector_json)
-    ) V(a)
-;
-declare @v1 vector(1536) = (SELECT vector FROM #vectors WHERE id = 1)
+    -- Use the table-valued parameter when supplied, otherwise the JSON string.
+    -- Either way the vector is cast directly, with no temp table round-trip;
+    -- vector(n) has no conversion from rows or binary, so the TVP is formatted as JSON here.
+    IF EXISTS (SELECT 1 FROM @feedback_vector)
+        SELECT @feedback_vector_json =
+            '[' + STRING_AGG(CONVERT(VARCHAR(MAX), CONVERT(VARCHAR(32), value, 3)), ',')
+                  WITHIN GROUP (ORDER BY ordinal) + ']'
+        FROM @feedback_vector;
 
     -- Insert the feedback data into the Service_Feedback table
     INSERT INTO Service_Feedback (
@@ -51,7 +56,7 @@ declare @v1 vector(1536) = (SELECT vector FROM #vectors WHERE id = 1)
         @schedule_id,
         @customer_id,
         @feedback_text,
-        @v1,
+        CAST(@feedback_vector_json AS vector(1536)),
         @rating_quality_of_work,
         @rating_timeliness,
         @rating_politeness,
@@ -1,19 +1,153 @@
+/****** Booking support objects ******/
+-- IDs come from sequences instead of MAX(id)+1, so concurrent bookings never collide.
+IF OBJECT_ID(N'dbo.Service_Schedule_Seq', N'SO') IS NULL
+BEGIN
+    DECLARE @NextScheduleID INT = (SELECT ISNULL(MAX(schedule_id), 0) + 1 FROM Service_Schedules);
+    EXEC('CREATE SEQUENCE dbo.Service_Schedule_Seq AS INT START WITH ' + CONVERT(VARCHAR(12), @NextScheduleID) + ' INCREMENT BY 1;');
+END
+GO
+IF OBJECT_ID(N'dbo.Appointment_Seq', N'SO') IS NULL
+BEGIN
+    DECLARE @NextAppointmentID INT = (SELECT ISNULL(MAX(appointment_id), 0) + 1 FROM Appointments);
+    EXEC('CREATE SEQUENCE dbo.Appointment_Seq AS INT START WITH ' + CONVERT(VARCHAR(12), @NextAppointmentID) + ' INCREMENT BY 1;');
+END
+GO
+-- One row per client idempotency key: a retried booking call returns the original booking.
+IF OBJECT_ID(N'dbo.Booking_Requests', N'U') IS NULL
+CREATE TABLE Booking_Requests (
+    idempotency_key NVARCHAR(100) PRIMARY KEY,
+    schedule_id INT NOT NULL,
+    created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+    FOREIGN KEY (schedule_id) REFERENCES Service_Schedules(schedule_id)
+);
+GO
+-- Short-lived holds on a technician's time between "list slots" and "confirm".
+IF OBJECT_ID(N'dbo.Slot_Holds', N'U') IS NULL
+CREATE TABLE Slot_Holds (
+    hold_id UNIQUEIDENTIFIER PRIMARY KEY DEFAULT NEWID(),
+    technician_id INT NOT NULL,
+    vehicle_id INT NOT NULL,
+    service_date DATE NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    expires_at DATETIME2 NOT NULL,
+    idempotency_key NVARCHAR(100) NULL,
+    FOREIGN KEY (technician_id) REFERENCES Technicians(technician_id),
+    FOREIGN KEY (vehicle_id) REFERENCES Vehicles(vehicle_id)
+);
+GO
+-- Databases set up before holds were idempotent: add the key column
+IF COL_LENGTH(N'dbo.Slot_Holds', N'idempotency_key') IS NULL
+    ALTER TABLE Slot_Holds ADD idempotency_key NVARCHAR(100) NULL;
+GO
+-- At most one live hold per client idempotency key: a retried hold call returns the original hold.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'UX_Slot_Holds_idempotency_key')
+    CREATE UNIQUE INDEX UX_Slot_Holds_idempotency_key ON Slot_Holds (idempotency_key) WHERE idempotency_key IS NOT NULL;
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Service_Schedules_service_date')
+    CREATE INDEX IX_Service_Schedules_service_date ON Service_Schedules (service_date) INCLUDE (start_time, end_time, status);
+GO
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Appointments_schedule_id')
+    CREATE INDEX IX_Appointments_schedule_id ON Appointments (schedule_id) INCLUDE (technician_id);
+GO
+/****** Object:  StoredProcedure [dbo].[HoldServiceSlot] ******/
+SET ANSI_NULLS ON
+GO
+SET QUOTED_IDENTIFIER ON
+GO
+CREATE OR ALTER PROCEDURE [dbo].[HoldServiceSlot]
+    @SelectedSlotStart DATETIME,
+    @VehicleID INT,
+    @ServiceTypeID INT,
+    @HoldSeconds INT = 300,
+    @IdempotencyKey NVARCHAR(100) = NULL -- Retried calls with the same key return the original hold
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    DECLARE @ServiceDuration INT = (SELECT duration_minutes FROM Service_Types WHERE service_type_id = @ServiceTypeID);
+    DECLARE @SlotDate DATE = CAST(@SelectedSlotStart AS DATE);
+    DECLARE @SlotStart TIME = CAST(@SelectedSlotStart AS TIME);
+    DECLARE @SlotEnd TIME = CAST(DATEADD(MINUTE, @ServiceDuration, @SelectedSlotStart) AS TIME);
+    DECLARE @TechnicianID INT;
+    DECLARE @LockResource NVARCHAR(255) = N'ServiceSlots:' + CONVERT(NVARCHAR(10), @SlotDate, 120);
+
+    BEGIN TRANSACTION;
+    -- Serialize everything that books or holds time on this date
+    EXEC sp_getapplock @Resource = @LockResource, @LockMode = 'Exclusive', @LockOwner = 'Transaction';
+
+    DELETE FROM Slot_Holds WHERE expires_at <= SYSUTCDATETIME();
+
+    -- A live hold already taken under this key is returned as is, instead of blocking another technician
+    IF @IdempotencyKey IS NOT NULL AND EXISTS (SELECT 1 FROM Slot_Holds WHERE idempotency_key = @IdempotencyKey)
+    BEGIN
+        SELECT hold_id AS HoldID, technician_id AS TechnicianID, service_date AS ServiceDate,
+               start_time AS StartTime, end_time AS EndTime, expires_at AS ExpiresAt, CAST(1 AS BIT) AS IsReplay
+        FROM Slot_Holds
+        WHERE idempotency_key = @IdempotencyKey;
+
+        COMMIT TRANSACTION;
+        RETURN;
+    END
+
+    SELECT TOP 1 @TechnicianID = t.technician_id
+    FROM Technicians t
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM Appointments a
+        INNER JOIN Service_Schedules ss ON a.schedule_id = ss.schedule_id
+        WHERE a.technician_id = t.technician_id
+          AND ss.service_date = @SlotDate
+          AND ss.status = 'Scheduled'
+          AND ss.start_time < @SlotEnd AND ss.end_time > @SlotStart
+    )
+    AND NOT EXISTS (
+        SELECT 1
+        FROM Slot_Holds h
+        WHERE h.technician_id = t.technician_id
+          AND h.service_date = @SlotDate
+          AND h.start_time < @SlotEnd AND h.end_time > @SlotStart
+    )
+    ORDER BY t.technician_id;
+
+    IF @TechnicianID IS NULL
+    BEGIN
+        ROLLBACK TRANSACTION;
+        THROW 50010, 'No available technician found for the selected time slot.', 1;
+    END
+
+    INSERT INTO Slot_Holds (technician_id, vehicle_id, service_date, start_time, end_time, expires_at, idempotency_key)
+    OUTPUT INSERTED.hold_id AS HoldID, INSERTED.technician_id AS TechnicianID, INSERTED.service_date AS ServiceDate,
+           INSERTED.start_time AS StartTime, INSERTED.end_time AS EndTime, INSERTED.expires_at AS ExpiresAt,
+           CAST(0 AS BIT) AS IsReplay
+    VALUES (@TechnicianID, @VehicleID, @SlotDate, @SlotStart, @SlotEnd, DATEADD(SECOND, @HoldSeconds, SYSUTCDATETIME()), @IdempotencyKey);
+
+    COMMIT TRANSACTION;
+END;
+GO
 /****** Object:  StoredProcedure [dbo].[CreateServiceSchedule]    Script Date: 16-12-2024 09:58:46 ******/
 SET ANSI_NULLS ON
 GO
 SET QUOTED_IDENTIFIER ON
 GO
-CREATE PROCEDURE [dbo].[CreateServiceSchedule]
+CREATE OR ALTER PROCEDURE [dbo].[CreateServiceSchedule]
     @SelectedSlotStart DATETIME,
     @VehicleID INT,
-    @ServiceTypeID INT
+    @ServiceTypeID INT,
+    @IdempotencyKey NVARCHAR(100) = NULL, -- Retried calls with the same key return the original booking
+    @HoldID UNIQUEIDENTIFIER = NULL       -- Optional hold from HoldServiceSlot to convert into the booking
 AS
 BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
     DECLARE @NewScheduleID INT;
     DECLARE @NewAppointmentID INT;
     DECLARE @AvailableTechnicianID INT;
     DECLARE @ServiceDuration INT;
     DECLARE @SelectedSlotEnd DATETIME;
+    DECLARE @IsReplay BIT = 0;
 
     -- Calculate the end time of the selected slot based on the service duration
     -- Retrieve the duration of the selected service type
@@ -24,30 +158,71 @@ BEGIN
     -- Calculate the end time of the service slot
     SET @SelectedSlotEnd = DATEADD(MINUTE, @ServiceDuration, @SelectedSlotStart);
 
-    -- Retrieve the current maximum schedule_id and compute the new ID
-    SELECT @NewScheduleID = ISNULL(MAX(schedule_id), 0) + 1 FROM Service_Schedules;
+    DECLARE @SlotDate DATE = CAST(@SelectedSlotStart AS DATE);
+    DECLARE @SlotStart TIME = CAST(@SelectedSlotStart AS TIME);
+    DECLARE @SlotEnd TIME = CAST(@SelectedSlotEnd AS TIME);
+    DECLARE @LockResource NVARCHAR(255) = N'ServiceSlots:' + CONVERT(NVARCHAR(10), @SlotDate, 120);
 
-    -- Retrieve the current maximum appointment_id and compute the new ID
-    SELECT @NewAppointmentID = ISNULL(MAX(appointment_id), 0) + 1 FROM Appointments;
+    SET TRANSACTION ISOLATION LEVEL SERIALIZABLE;
+    BEGIN TRANSACTION;
 
-    -- Find an available technician who does not have an appointment during the selected slot
-    SELECT TOP 1 @AvailableTechnicianID = t.technician_id
-    FROM Technicians t
-    WHERE NOT EXISTS (
-        SELECT 1
-        FROM Appointments a
-        INNER JOIN Service_Schedules ss ON a.schedule_id = ss.schedule_id
-        WHERE a.technician_id = t.technician_id
-          AND ss.service_date = CAST(@SelectedSlotStart AS DATE)
-          AND (
-              (ss.start_time <= CAST(@SelectedSlotStart AS TIME) AND ss.end_time > CAST(@SelectedSlotStart AS TIME)) OR
-              (ss.start_time < CAST(@SelectedSlotEnd AS TIME) AND ss.end_time >= CAST(@SelectedSlotEnd AS TIME))
-          )
-    );
-
-    -- Check if an available technician was found
-    IF @AvailableTechnicianID IS NOT NULL
+    -- Serialize everything that books or holds time on this date, so the availability
+    -- check below and the inserts that follow are atomic with respect to other bookings
+    EXEC sp_getapplock @Resource = @LockResource, @LockMode = 'Exclusive', @LockOwner = 'Transaction';
+
+    IF @IdempotencyKey IS NOT NULL
+        SELECT @NewScheduleID = schedule_id FROM Booking_Requests WHERE idempotency_key = @IdempotencyKey;
+
+    IF @NewScheduleID IS NOT NULL
     BEGIN
+        SET @IsReplay = 1;
+    END
+    ELSE
+    BEGIN
+        DELETE FROM Slot_Holds WHERE expires_at <= SYSUTCDATETIME();
+
+        -- Use the technician reserved by a live hold for this vehicle and slot, if any
+        IF @HoldID IS NOT NULL
+            SELECT @AvailableTechnicianID = technician_id
+            FROM Slot_Holds
+            WHERE hold_id = @HoldID
+              AND vehicle_id = @VehicleID
+              AND service_date = @SlotDate
+              AND start_time = @SlotStart;
+
+        -- Otherwise find a technician with no overlapping appointment or someone else's hold
+        IF @AvailableTechnicianID IS NULL
+            SELECT TOP 1 @AvailableTechnicianID = t.technician_id
+            FROM Technicians t
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM Appointments a
+                INNER JOIN Service_Schedules ss ON a.schedule_id = ss.schedule_id
+                WHERE a.technician_id = t.technician_id
+                  AND ss.service_date = @SlotDate
+                  AND ss.status = 'Scheduled'
+                  AND ss.start_time < @SlotEnd AND ss.end_time > @SlotStart
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM Slot_Holds h
+                WHERE h.technician_id = t.technician_id
+                  AND h.service_date = @SlotDate
+                  AND h.start_time < @SlotEnd AND h.end_time > @SlotStart
+                  AND (@HoldID IS NULL OR h.hold_id <> @HoldID)
+            )
+            ORDER BY t.technician_id;
+
+        -- Check if an available technician was found
+        IF @AvailableTechnicianID IS NULL
+        BEGIN
+            ROLLBACK TRANSACTION;
+            THROW 50010, 'No available technician found for the selected time slot.', 1;
+        END
+
+        SET @NewScheduleID = NEXT VALUE FOR dbo.Service_Schedule_Seq;
+        SET @NewAppointmentID = NEXT VALUE FOR dbo.Appointment_Seq;
+
         -- Insert the new service schedule into the Service_Schedules table and return the inserted record
         INSERT INTO Service_Schedules (schedule_id, vehicle_id, service_type_id, service_date, start_time, end_time, status)
         OUTPUT INSERTED.schedule_id, INSERTED.vehicle_id, INSERTED.service_type_id, INSERTED.service_date, INSERTED.start_time, INSERTED.end_time, INSERTED.status
@@ -55,9 +230,9 @@ BEGIN
             @NewScheduleID,
             @VehicleID,
             @ServiceTypeID,
-            CAST(@SelectedSlotStart AS DATE),
-            CAST(@SelectedSlotStart AS TIME),
-            CAST(@SelectedSlotEnd AS TIME),
+            @SlotDate,
+            @SlotStart,
+            @SlotEnd,
             'Scheduled'
         );
 
@@ -71,29 +246,37 @@ BEGIN
             'Assigned'
         );
 
-        -- Retrieve and display the details of the scheduled service along with the assigned technician
-        SELECT
-            ss.schedule_id AS ScheduleID,
-            ss.service_date AS ServiceDate,
-            ss.start_time AS StartTime,
-            ss.end_time AS EndTime,
-            ss.status AS ScheduleStatus,
-            st.service_name AS ServiceType,
-            t.technician_id AS TechnicianID,
-            t.name AS TechnicianName,
-            t.specialization AS TechnicianSpecialization
-        FROM
-            Service_Schedules ss
-            INNER JOIN Service_Types st ON ss.service_type_id = st.service_type_id
-            INNER JOIN Appointments a ON ss.schedule_id = a.schedule_id
-            INNER JOIN Technicians t ON a.technician_id = t.technician_id
-        WHERE
-            ss.schedule_id = @NewScheduleID;
+        IF @IdempotencyKey IS NOT NULL
+            INSERT INTO Booking_Requests (idempotency_key, schedule_id) VALUES (@IdempotencyKey, @NewScheduleID);
 
-        PRINT 'Appointment and service schedule successfully created.';
+        IF @HoldID IS NOT NULL
+            DELETE FROM Slot_Holds WHERE hold_id = @HoldID;
     END
+
+    COMMIT TRANSACTION;
+
+    -- Retrieve and display the details of the scheduled service along with the assigned technician
+    SELECT
+        ss.schedule_id AS ScheduleID,
+        ss.service_date AS ServiceDate,
+        ss.start_time AS StartTime,
+        ss.end_time AS EndTime,
+        ss.status AS ScheduleStatus,
+        st.service_name AS ServiceType,
+        t.technician_id AS TechnicianID,
+        t.name AS TechnicianName,
+        t.specialization AS TechnicianSpecialization,
+        @IsReplay AS IsReplay
+    FROM
+        Service_Schedules ss
+        INNER JOIN Service_Types st ON ss.service_type_id = st.service_type_id
+        INNER JOIN Appointments a ON ss.schedule_id = a.schedule_id
+        INNER JOIN Technicians t ON a.technician_id = t.technician_id
+    WHERE
+        ss.schedule_id = @NewScheduleID;
+
+    IF @IsReplay = 1
+        PRINT 'Appointment and service schedule already exist for this request.';
     ELSE
-    BEGIN
-        PRINT 'No available technician found for the selected time slot.';
-    END
-END;
\ No newline at end of file
+        PRINT 'Appointment and service schedule successfully created.';
+END;
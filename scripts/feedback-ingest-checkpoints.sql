@@ -0,0 +1,16 @@
+-- =============================================
+-- Checkpoints for feedback_ingest.py
+-- =============================================
+-- The bulk ingest / re-embed pipeline advances its checkpoint in the same
+-- transaction as each chunk of rows it writes, so a crashed run resumes exactly
+-- after the last committed chunk without duplicating or skipping rows.
+--   load:<job>     position = number of source records consumed
+--   reembed:<job>  position = highest feedback_id re-embedded
+
+IF OBJECT_ID(N'dbo.Feedback_Ingest_Checkpoints', N'U') IS NULL
+CREATE TABLE Feedback_Ingest_Checkpoints (
+    job_name NVARCHAR(200) PRIMARY KEY,
+    position BIGINT NOT NULL,
+    rows_written BIGINT NOT NULL,
+    updated_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+);
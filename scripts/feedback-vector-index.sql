@@ -0,0 +1,28 @@
+-- =============================================
+-- DiskANN vector index on Service_Feedback.feedback_vector
+-- =============================================
+-- Used by the approximate search path of the Feedback Explorer
+-- (FEEDBACK_SEARCH_MODE=approximate, service_requests/feedback_search.py) and by
+-- AnalyzeFeedback with @approximate = 1. Both read candidates with
+-- VECTOR_SEARCH(...) and fall back to the exact vector_distance scan when the
+-- table is small or the filters are too selective for the candidates.
+--
+-- The index is built from the rows present when it is created. Approximate
+-- vector indexes are a preview feature: on SQL Server 2025 run
+--     ALTER DATABASE SCOPED CONFIGURATION SET PREVIEW_FEATURES = ON;
+-- first, and where the service version makes a table with a vector index
+-- read-only, drop the index before bulk loads (feedback_ingest.py) and create it
+-- again afterwards. `python -m benchmarks.feedback_ann_recall` reports recall@k
+-- of the index against the exact path.
+
+IF NOT EXISTS (
+    SELECT 1 FROM sys.indexes
+    WHERE name = N'IX_Service_Feedback_feedback_vector' AND object_id = OBJECT_ID(N'dbo.Service_Feedback')
+)
+CREATE VECTOR INDEX IX_Service_Feedback_feedback_vector
+ON dbo.Service_Feedback (feedback_vector)
+WITH (METRIC = 'cosine', TYPE = 'DiskANN');
+GO
+
+-- To remove it:
+-- DROP INDEX IX_Service_Feedback_feedback_vector ON dbo.Service_Feedback;
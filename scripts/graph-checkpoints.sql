@@ -0,0 +1,48 @@
+-- =============================================
+-- Conversation checkpoints for service_requests/checkpointer.py
+-- =============================================
+-- Used when CHECKPOINTER=azuresql. Channel values are stored once per channel
+-- version (Graph_Checkpoint_Blobs), so each checkpoint only adds the channels it
+-- changed; the checkpointer keeps the latest CHECKPOINT_KEEP_LATEST checkpoints
+-- per thread and deletes the values no remaining checkpoint references.
+
+IF OBJECT_ID(N'dbo.Graph_Checkpoints', N'U') IS NULL
+CREATE TABLE Graph_Checkpoints (
+    thread_id NVARCHAR(150) NOT NULL,
+    checkpoint_ns NVARCHAR(150) NOT NULL DEFAULT '',
+    checkpoint_id NVARCHAR(64) NOT NULL,
+    parent_checkpoint_id NVARCHAR(64) NULL,
+    type NVARCHAR(50) NOT NULL,
+    checkpoint VARBINARY(MAX) NOT NULL,
+    metadata_type NVARCHAR(50) NOT NULL,
+    metadata VARBINARY(MAX) NOT NULL,
+    CONSTRAINT PK_Graph_Checkpoints PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+GO
+
+IF OBJECT_ID(N'dbo.Graph_Checkpoint_Blobs', N'U') IS NULL
+CREATE TABLE Graph_Checkpoint_Blobs (
+    thread_id NVARCHAR(150) NOT NULL,
+    checkpoint_ns NVARCHAR(150) NOT NULL DEFAULT '',
+    channel NVARCHAR(150) NOT NULL,
+    version NVARCHAR(64) NOT NULL,
+    type NVARCHAR(50) NOT NULL,
+    blob VARBINARY(MAX) NULL,
+    CONSTRAINT PK_Graph_Checkpoint_Blobs PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+GO
+
+IF OBJECT_ID(N'dbo.Graph_Checkpoint_Writes', N'U') IS NULL
+CREATE TABLE Graph_Checkpoint_Writes (
+    thread_id NVARCHAR(150) NOT NULL,
+    checkpoint_ns NVARCHAR(150) NOT NULL DEFAULT '',
+    checkpoint_id NVARCHAR(64) NOT NULL,
+    task_id NVARCHAR(64) NOT NULL,
+    idx INT NOT NULL,
+    channel NVARCHAR(150) NOT NULL,
+    type NVARCHAR(50) NOT NULL,
+    blob VARBINARY(MAX) NULL,
+    task_path NVARCHAR(300) NOT NULL DEFAULT '',
+    CONSTRAINT PK_Graph_Checkpoint_Writes PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+GO
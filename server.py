@@ -0,0 +1,329 @@
+"""
+Multi-session conversation server for the customer-facing bot.
+
+Hosts the compiled `graph` from agent.py for many concurrent customers over
+WebSocket, with plain HTTP endpoints for health and metrics:
+
+    GET /healthz                                          liveness
+    GET /metrics                                          JSON: queue, turn and backend metrics
+    WS  /chat?customer_name=Ravi%20Kumar[&session_id=..][&stream=1]  one conversation per socket
+
+Each socket is a session with its own `thread_id` (the `session_id`, generated when
+absent, namespaced by `customer_name`, so a client can reconnect to its own
+conversation but never to another customer's).
+Clients send a text frame (or JSON {"message": "..."}) per turn and receive JSON
+{"type": "reply", "content": "..."}. With `stream=1` the reply is preceded by
+{"type": "token", "content": "..."} frames as the active assistant generates them and
+{"type": "node", "node": "..."} frames as the graph moves between nodes.
+
+Admission control: at most SERVER_MAX_CONCURRENT_TURNS turns run at once, at most
+SERVER_MAX_QUEUED_TURNS wait for a slot; beyond that a turn is rejected with
+{"type": "busy", "retry_after": seconds}. A session runs one turn at a time. When
+Azure OpenAI answers 429, new turns are turned away with the server's Retry-After
+until it has passed, instead of piling more requests onto the rate limit.
+
+Run with:
+    python server.py --host 0.0.0.0 --port 8765
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+import uuid
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+from openai import RateLimitError
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from agent import astream_turn, history_policy, intent_router, memory
+from service_requests.credentials import token_cache
+from service_requests.db_tools import customer_profiles, slot_engine, sql_pool
+from service_requests.llm_gateway import LLMOverloaded, llm_gateway
+from service_requests.local_search import local_index, search_backend
+from service_requests.search_cache import search_cache
+from service_requests.search_tools import search_metrics
+
+load_dotenv()
+
+server_max_concurrent_turns = int(os.getenv("SERVER_MAX_CONCURRENT_TURNS", "8"))
+server_max_queued_turns = int(os.getenv("SERVER_MAX_QUEUED_TURNS", "32"))
+server_max_sessions = int(os.getenv("SERVER_MAX_SESSIONS", "500"))
+server_queue_timeout_seconds = float(os.getenv("SERVER_QUEUE_TIMEOUT_SECONDS", "30"))
+server_rate_limit_backoff_seconds = float(os.getenv("SERVER_RATE_LIMIT_BACKOFF_SECONDS", "10"))
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(error: RateLimitError) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(float(value) * scale, 1.0)
+            except ValueError:
+                pass
+    return server_rate_limit_backoff_seconds
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Admission:
+    """Bounded concurrency with a bounded wait queue and a shared rate-limit backoff."""
+
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.queued = 0
+        self.backoff_until = 0.0
+        self._queue_waits = collections.deque(maxlen=1000)
+        self._turn_seconds = collections.deque(maxlen=1000)
+        self._stats = {
+            "turns_admitted": 0,
+            "turns_completed": 0,
+            "turns_failed": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_rate_limited": 0,
+            "rate_limit_events": 0,
+        }
+
+    def backoff_remaining(self) -> float:
+        return max(0.0, self.backoff_until - time.monotonic())
+
+    def rate_limited(self, retry_after: float):
+        self._stats["rate_limit_events"] += 1
+        self.backoff_until = max(self.backoff_until, time.monotonic() + retry_after)
+
+    async def acquire(self):
+        remaining = self.backoff_remaining()
+        if remaining:
+            self._stats["rejected_rate_limited"] += 1
+            raise Overloaded("rate_limited", remaining)
+        started = time.monotonic()
+        if not self._slots.locked():
+            # A slot is free: take it without queueing (no await between check and acquire)
+            await self._slots.acquire()
+        else:
+            if self.queued >= self.max_queued:
+                self._stats["rejected_queue_full"] += 1
+                raise Overloaded("queue_full", 1.0)
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._stats["rejected_queue_timeout"] += 1
+                raise Overloaded("queue_timeout", 1.0)
+            finally:
+                self.queued -= 1
+        self._queue_waits.append(time.monotonic() - started)
+        self.active += 1
+        self._stats["turns_admitted"] += 1
+
+    def release(self, seconds: float, ok: bool):
+        self.active -= 1
+        self._slots.release()
+        self._turn_seconds.append(seconds)
+        self._stats["turns_completed" if ok else "turns_failed"] += 1
+
+    def metrics(self) -> dict:
+        return {
+            **self._stats,
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "backoff_remaining_seconds": self.backoff_remaining(),
+            "queue_wait_p50_seconds": _percentile(self._queue_waits, 50),
+            "queue_wait_p95_seconds": _percentile(self._queue_waits, 95),
+            "turn_p50_seconds": _percentile(self._turn_seconds, 50),
+            "turn_p95_seconds": _percentile(self._turn_seconds, 95),
+        }
+
+
+def session_thread_id(session_id: str, customer_name: str) -> str:
+    """Checkpointer thread for a session: namespaced by customer, so a session_id sent
+    with another customer's name never resumes that customer's conversation."""
+    return f"{' '.join(customer_name.casefold().split())}:{session_id}"
+
+
+class Session:
+    def __init__(self, session_id: str, customer_name: str, stream: bool = False):
+        self.session_id = session_id
+        self.customer_name = customer_name
+        self.thread_id = session_thread_id(session_id, customer_name)
+        self.stream = stream
+        self.lock = asyncio.Lock()  # one turn at a time per conversation
+        self.sockets = 0
+        self.turns = 0
+        self.config = {
+            "configurable": {
+                "customer_name": customer_name,
+                "thread_id": self.thread_id,
+            }
+        }
+
+
+class ConversationServer:
+    def __init__(self, admission: Admission, max_sessions: int = server_max_sessions):
+        self.admission = admission
+        self.max_sessions = max_sessions
+        self.sessions: dict[str, Session] = {}
+        self.started = time.time()
+        self._first_token_seconds = collections.deque(maxlen=1000)
+
+    # ── HTTP ────────────────────────────────────────────────────
+
+    def metrics(self) -> dict:
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "sessions_open": len(self.sessions),
+            "turns": self.admission.metrics(),
+            "first_token_p50_seconds": _percentile(self._first_token_seconds, 50),
+            "first_token_p95_seconds": _percentile(self._first_token_seconds, 95),
+            "sql_pool": sql_pool.metrics(),
+            "slot_engine": slot_engine.metrics(),
+            "customer_profiles": customer_profiles.metrics(),
+            "tokens": token_cache.metrics(),
+            "checkpointer": memory.metrics() if hasattr(memory, "metrics") else None,
+            "llm": llm_gateway.metrics(),
+            "search": search_metrics(),
+            "search_cache": search_cache.metrics(),
+            "local_search": local_index.metrics() if search_backend == "local" else None,
+            "history": history_policy.metrics(),
+            "intent_router": intent_router.metrics() if intent_router else None,
+        }
+
+    def process_request(self, connection, request):
+        url = urlsplit(request.path)
+        if url.path == "/healthz":
+            return connection.respond(HTTPStatus.OK, "ok\n")
+        if url.path == "/metrics":
+            response = connection.respond(HTTPStatus.OK, json.dumps(self.metrics(), default=str))
+            del response.headers["Content-Type"]
+            response.headers["Content-Type"] = "application/json"
+            return response
+        if url.path != "/chat":
+            return connection.respond(HTTPStatus.NOT_FOUND, "not found\n")
+        query = parse_qs(url.query)
+        if not query.get("customer_name", [""])[0].strip():
+            return connection.respond(HTTPStatus.BAD_REQUEST, "customer_name is required\n")
+        if len(self.sessions) >= self.max_sessions:
+            response = connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "too many sessions\n")
+            response.headers["Retry-After"] = "5"
+            return response
+        return None
+
+    # ── WebSocket sessions ──────────────────────────────────────
+
+    def _open_session(self, request_path: str) -> Session:
+        query = parse_qs(urlsplit(request_path).query)
+        customer_name = query["customer_name"][0].strip()
+        session_id = query.get("session_id", [""])[0] or str(uuid.uuid4())
+        stream = query.get("stream", ["0"])[0].lower() in ("1", "true", "yes")
+        thread_id = session_thread_id(session_id, customer_name)
+        session = self.sessions.get(thread_id)
+        if session is None:
+            session = self.sessions[thread_id] = Session(session_id, customer_name)
+        session.stream = stream
+        session.sockets += 1
+        return session
+
+    def _close_session(self, session: Session):
+        session.sockets -= 1
+        if session.sockets <= 0 and not session.lock.locked():
+            # The conversation stays in the checkpointer; reconnecting with the session_id resumes it
+            self.sessions.pop(session.thread_id, None)
+
+    async def run_turn(self, session: Session, text: str, send=None) -> dict:
+        """Run one turn; token and node events are passed to `send` when the session streams."""
+        async with session.lock:
+            await self.admission.acquire()
+            started = time.monotonic()
+            ok = False
+            try:
+                async for event in astream_turn(text, session.config):
+                    if event["type"] == "done":
+                        break
+                    if send is not None and session.stream:
+                        await send(json.dumps(event, default=str))
+                ok = True
+                session.turns += 1
+                if event["ttft_seconds"] is not None:
+                    self._first_token_seconds.append(event["ttft_seconds"])
+                return {"type": "reply", "content": event["content"], "ttft_seconds": event["ttft_seconds"]}
+            except RateLimitError as e:
+                retry_after = _retry_after_seconds(e)
+                self.admission.rate_limited(retry_after)
+                return {"type": "busy", "reason": "rate_limited", "retry_after": retry_after}
+            except LLMOverloaded as e:
+                return {"type": "busy", "reason": e.reason, "retry_after": e.retry_after}
+            finally:
+                self.admission.release(time.monotonic() - started, ok)
+
+    async def handle(self, connection):
+        session = self._open_session(connection.request.path)
+        try:
+            await connection.send(json.dumps({"type": "session", "session_id": session.session_id}))
+            async for frame in connection:
+                text = frame
+                if isinstance(frame, str) and frame.lstrip().startswith("{"):
+                    try:
+                        text = json.loads(frame).get("message", "")
+                    except json.JSONDecodeError:
+                        pass
+                if not isinstance(text, str) or not text.strip():
+                    await connection.send(json.dumps({"type": "error", "message": "empty message"}))
+                    continue
+                try:
+                    result = await self.run_turn(session, text, connection.send)
+                except Overloaded as e:
+                    result = {"type": "busy", "reason": e.reason, "retry_after": e.retry_after}
+                except Exception as e:
+                    print(f"Error in session {session.session_id}: {e}")
+                    result = {"type": "error", "message": "The assistant could not complete this turn."}
+                await connection.send(json.dumps(result, default=str))
+        except ConnectionClosed:
+            pass
+        finally:
+            self._close_session(session)
+
+
+async def run_server(host: str, port: int):
+    server = ConversationServer(
+        Admission(server_max_concurrent_turns, server_max_queued_turns, server_queue_timeout_seconds)
+    )
+    async with serve(server.handle, host, port, process_request=server.process_request) as ws_server:
+        print(f"Contoso Motocorp conversation server listening on ws://{host}:{port}/chat")
+        await ws_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8765")))
+    args = parser.parse_args()
+    asyncio.run(run_server(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
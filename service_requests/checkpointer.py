@@ -0,0 +1,672 @@
+"""
+Durable, compacting LangGraph checkpointer.
+
+`MemorySaver` keeps every checkpoint of every thread in process memory forever.
+`CompactingCheckpointer` stores checkpoints in SQLite (local) or Azure SQL
+(production) instead:
+
+* delta checkpoints: channel values are stored once per channel version, so a
+  checkpoint only writes the channels that changed since its parent;
+* compact state: values are serialized with the graph's serializer, zlib-compressed
+  when large, and the bulky per-step "writes" are dropped from the metadata;
+* retention: only the latest `CHECKPOINT_KEEP_LATEST` checkpoints per thread are
+  kept, together with the channel values they reference;
+* a bounded in-memory cache holds the latest checkpoint of recently active threads
+  (still serialized); threads idle for `CHECKPOINT_IDLE_SECONDS` are evicted and
+  resumed from the database by thread ID with three indexed queries.
+
+Select the backend with `CHECKPOINTER` = sqlite (default) | azuresql | memory.
+The Azure SQL tables are created by scripts/graph-checkpoints.sql.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_serializable_checkpoint_metadata,
+)
+
+load_dotenv()
+
+checkpointer_backend = os.getenv("CHECKPOINTER", "sqlite").lower()
+checkpoint_sqlite_path = os.getenv("CHECKPOINT_SQLITE_PATH", os.path.join(".cache", "checkpoints.sqlite"))
+checkpoint_keep_latest = int(os.getenv("CHECKPOINT_KEEP_LATEST", "20"))
+checkpoint_prune_every = int(os.getenv("CHECKPOINT_PRUNE_EVERY", "5"))
+checkpoint_idle_seconds = float(os.getenv("CHECKPOINT_IDLE_SECONDS", "900"))
+checkpoint_max_hot_threads = int(os.getenv("CHECKPOINT_MAX_HOT_THREADS", "1000"))
+
+COMPRESS_MIN_BYTES = 512
+COMPRESSED_SUFFIX = "+zlib"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Graph_Checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS Graph_Checkpoint_Blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS Graph_Checkpoint_Writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+# ── compact serialization ───────────────────────────────────────
+
+
+def _compress(typed: tuple[str, bytes]) -> tuple[str, bytes]:
+    type_, data = typed
+    if data is not None and len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return type_ + COMPRESSED_SUFFIX, packed
+    return type_, data
+
+
+def _decompress(typed: tuple[str, bytes]) -> tuple[str, bytes]:
+    type_, data = typed
+    if type_.endswith(COMPRESSED_SUFFIX):
+        return type_[: -len(COMPRESSED_SUFFIX)], zlib.decompress(data)
+    return type_, data
+
+
+# ── storage backends ────────────────────────────────────────────
+
+
+class _SqlStore:
+    """Checkpoint tables behind a DB-API connection with qmark parameters (sqlite3, pyodbc)."""
+
+    dialect = "sqlite"
+
+    @contextmanager
+    def connection(self):
+        raise NotImplementedError
+
+    def _top(self, sql: str, limit: int | None) -> str:
+        """Apply a row limit to a `SELECT ...` statement."""
+        if limit is None:
+            return sql
+        if self.dialect == "mssql":
+            return sql.replace("SELECT", f"SELECT TOP ({int(limit)})", 1)
+        return f"{sql} LIMIT {int(limit)}"
+
+    def _upsert_checkpoint_sql(self) -> str:
+        if self.dialect == "mssql":
+            return """
+            MERGE Graph_Checkpoints WITH (HOLDLOCK) AS t
+            USING (SELECT ? AS thread_id, ? AS checkpoint_ns, ? AS checkpoint_id) AS s
+                ON t.thread_id = s.thread_id AND t.checkpoint_ns = s.checkpoint_ns AND t.checkpoint_id = s.checkpoint_id
+            WHEN MATCHED THEN UPDATE SET parent_checkpoint_id = ?, type = ?, checkpoint = ?, metadata_type = ?, metadata = ?
+            WHEN NOT MATCHED THEN INSERT (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata)
+                VALUES (s.thread_id, s.checkpoint_ns, s.checkpoint_id, ?, ?, ?, ?, ?);
+            """
+        return """
+        INSERT OR REPLACE INTO Graph_Checkpoints
+            (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """
+
+    def _insert_ignore_sql(self, table: str, columns: tuple[str, ...], key: tuple[str, ...], replace: bool) -> str:
+        placeholders = ", ".join("?" for _ in columns)
+        if self.dialect == "mssql":
+            on = " AND ".join(f"t.{c} = s.{c}" for c in key)
+            source = ", ".join(f"? AS {c}" for c in columns)
+            insert = f"INSERT ({', '.join(columns)}) VALUES ({', '.join('s.' + c for c in columns)})"
+            update = ""
+            if replace:
+                update = "WHEN MATCHED THEN UPDATE SET " + ", ".join(
+                    f"{c} = s.{c}" for c in columns if c not in key
+                )
+            return (
+                f"MERGE {table} WITH (HOLDLOCK) AS t USING (SELECT {source}) AS s ON {on} "
+                f"{update} WHEN NOT MATCHED THEN {insert};"
+            )
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    # ── writes ──────────────────────────────────────────────────
+
+    def put_checkpoint(self, row: tuple, blobs: list[tuple]):
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, md_type, metadata = row
+        blob_sql = self._insert_ignore_sql(
+            "Graph_Checkpoint_Blobs",
+            ("thread_id", "checkpoint_ns", "channel", "version", "type", "blob"),
+            ("thread_id", "checkpoint_ns", "channel", "version"),
+            replace=False,
+        )
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            if blobs:
+                cursor.executemany(blob_sql, blobs)
+            if self.dialect == "mssql":
+                tail = (parent_id, type_, checkpoint, md_type, metadata)
+                cursor.execute(self._upsert_checkpoint_sql(), (thread_id, checkpoint_ns, checkpoint_id, *tail, *tail))
+            else:
+                cursor.execute(self._upsert_checkpoint_sql(), row)
+            connection.commit()
+            cursor.close()
+
+    def put_writes(self, rows: list[tuple], replace: bool):
+        sql = self._insert_ignore_sql(
+            "Graph_Checkpoint_Writes",
+            ("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx", "channel", "type", "blob", "task_path"),
+            ("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"),
+            replace=replace,
+        )
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.executemany(sql, rows)
+            connection.commit()
+            cursor.close()
+
+    # ── reads ───────────────────────────────────────────────────
+
+    def checkpoints(self, thread_id, checkpoint_ns, checkpoint_id=None, before=None, limit=None) -> list[tuple]:
+        """(thread_id, ns, id, parent_id, type, checkpoint, metadata_type, metadata), newest first."""
+        sql = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+            "metadata_type, metadata FROM Graph_Checkpoints WHERE 1 = 1"
+        )
+        params = []
+        if thread_id is not None:
+            sql += " AND thread_id = ?"
+            params.append(thread_id)
+        if checkpoint_ns is not None:
+            sql += " AND checkpoint_ns = ?"
+            params.append(checkpoint_ns)
+        if checkpoint_id is not None:
+            sql += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        if before is not None:
+            sql += " AND checkpoint_id < ?"
+            params.append(before)
+        sql = self._top(sql + " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC", limit)
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            rows = [tuple(row) for row in cursor.fetchall()]
+            cursor.close()
+        return rows
+
+    def blobs(self, thread_id, checkpoint_ns, versions: dict) -> dict[str, tuple[str, bytes]]:
+        if not versions:
+            return {}
+        items = list(versions.items())
+        sql = (
+            "SELECT channel, type, blob FROM Graph_Checkpoint_Blobs WHERE thread_id = ? AND checkpoint_ns = ? AND ("
+            + " OR ".join("(channel = ? AND version = ?)" for _ in items)
+            + ")"
+        )
+        params = [thread_id, checkpoint_ns]
+        for channel, version in items:
+            params += [channel, str(version)]
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        return {channel: (type_, blob) for channel, type_, blob in rows}
+
+    def writes(self, thread_id, checkpoint_ns, checkpoint_id) -> list[tuple]:
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT task_id, idx, channel, type, blob, task_path FROM Graph_Checkpoint_Writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+            rows = [tuple(row) for row in cursor.fetchall()]
+            cursor.close()
+        return rows
+
+    # ── retention ───────────────────────────────────────────────
+
+    def prune(self, thread_id, checkpoint_ns, keep: int, referenced_versions) -> tuple[int, int]:
+        """
+        Delete all but the newest `keep` checkpoints of a thread, their writes, and the
+        channel values no remaining checkpoint references. Returns (checkpoints, blobs) deleted.
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT checkpoint_id, type, checkpoint FROM Graph_Checkpoints "
+                "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+                (thread_id, checkpoint_ns),
+            )
+            rows = cursor.fetchall()
+            if len(rows) <= keep:
+                cursor.close()
+                return 0, 0
+            kept, dropped = rows[:keep], [row[0] for row in rows[keep:]]
+            oldest_kept = kept[-1][0]
+            cursor.execute(
+                "DELETE FROM Graph_Checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                (thread_id, checkpoint_ns, oldest_kept),
+            )
+            cursor.execute(
+                "DELETE FROM Graph_Checkpoint_Writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+                (thread_id, checkpoint_ns, oldest_kept),
+            )
+            referenced = set()
+            for _, type_, checkpoint in kept:
+                referenced.update(referenced_versions((type_, checkpoint)))
+            cursor.execute(
+                "SELECT channel, version FROM Graph_Checkpoint_Blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            )
+            orphans = [(c, v) for c, v in cursor.fetchall() if (c, v) not in referenced]
+            if orphans:
+                cursor.executemany(
+                    "DELETE FROM Graph_Checkpoint_Blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    [(thread_id, checkpoint_ns, c, v) for c, v in orphans],
+                )
+            connection.commit()
+            cursor.close()
+        return len(dropped), len(orphans)
+
+    def delete_thread(self, thread_id):
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            for table in ("Graph_Checkpoints", "Graph_Checkpoint_Blobs", "Graph_Checkpoint_Writes"):
+                cursor.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            connection.commit()
+            cursor.close()
+
+    def size_bytes(self) -> int | None:
+        return None
+
+
+class SqliteStore(_SqlStore):
+    dialect = "sqlite"
+
+    def __init__(self, path: str = checkpoint_sqlite_path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            try:
+                yield self._connection
+            except Exception:
+                self._connection.rollback()
+                raise
+
+    def size_bytes(self) -> int | None:
+        if self.path == ":memory:":
+            return None
+        return sum(
+            os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)
+        )
+
+
+class AzureSqlStore(_SqlStore):
+    dialect = "mssql"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @contextmanager
+    def connection(self):
+        with self.pool.connection() as connection:
+            yield connection
+
+
+# ── checkpointer ────────────────────────────────────────────────
+
+
+class _HotThread:
+    """Latest checkpoint of one (thread, namespace), kept serialized."""
+
+    __slots__ = ("row", "blobs", "writes", "last_used", "puts", "resumed")
+
+    def __init__(self, row: tuple, blobs: dict, writes: dict, resumed: bool = False):
+        self.row = row  # (thread_id, ns, id, parent_id, type, checkpoint, metadata_type, metadata)
+        self.blobs = blobs  # channel -> (version, type, blob)
+        self.writes = writes  # (task_id, idx) -> (task_id, channel, type, blob, task_path)
+        self.last_used = time.monotonic()
+        self.puts = 0
+        self.resumed = resumed  # loaded from the store: prune its history on the next put
+
+
+class CompactingCheckpointer(BaseCheckpointSaver[str]):
+    def __init__(
+        self,
+        store: _SqlStore,
+        *,
+        keep_latest: int = checkpoint_keep_latest,
+        prune_every: int = checkpoint_prune_every,
+        idle_seconds: float = checkpoint_idle_seconds,
+        max_hot_threads: int = checkpoint_max_hot_threads,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.store = store
+        self.keep_latest = keep_latest
+        self.prune_every = max(1, prune_every)
+        self.idle_seconds = idle_seconds
+        self.max_hot_threads = max_hot_threads
+        self._hot: OrderedDict[tuple[str, str], _HotThread] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "puts": 0,
+            "hot_hits": 0,
+            "resumes": 0,
+            "blobs_written": 0,
+            "bytes_written": 0,
+            "checkpoints_pruned": 0,
+            "blobs_pruned": 0,
+            "evictions": 0,
+        }
+
+    # ── serialization helpers ───────────────────────────────────
+
+    def _dumps(self, value) -> tuple[str, bytes]:
+        return _compress(self.serde.dumps_typed(value))
+
+    def _loads(self, typed: tuple[str, bytes]):
+        return self.serde.loads_typed(_decompress(typed))
+
+    def _referenced_versions(self, typed_checkpoint) -> set[tuple[str, str]]:
+        checkpoint = self._loads(typed_checkpoint)
+        return {(c, str(v)) for c, v in checkpoint["channel_versions"].items()}
+
+    def _tuple(self, row: tuple, blobs: dict, writes) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, md_type, metadata = row
+        checkpoint = self._loads((type_, checkpoint))
+        channel_values = {}
+        for channel in checkpoint["channel_versions"]:
+            typed = blobs.get(channel)
+            if typed is not None and typed[0] != "empty":
+                channel_values[channel] = self._loads(typed)
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self._loads((md_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self._loads((type_, blob)))
+                for task_id, channel, type_, blob, _ in writes
+            ],
+        )
+
+    # ── hot thread cache ────────────────────────────────────────
+
+    def _evict_locked(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._hot:
+            key, hot = next(iter(self._hot.items()))
+            if len(self._hot) <= self.max_hot_threads and hot.last_used >= cutoff:
+                break
+            del self._hot[key]
+            self._stats["evictions"] += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _touch_locked(self, key, hot: _HotThread):
+        hot.last_used = time.monotonic()
+        self._hot[key] = hot
+        self._hot.move_to_end(key)
+        self._evict_locked()
+
+    # ── BaseCheckpointSaver ─────────────────────────────────────
+
+    def get_tuple(self, config) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        key = (thread_id, checkpoint_ns)
+        with self._lock:
+            hot = self._hot.get(key)
+            if hot is not None and checkpoint_id in (None, hot.row[2]):
+                self._touch_locked(key, hot)
+                self._stats["hot_hits"] += 1
+                row = hot.row
+                blobs = {c: (t, b) for c, (_, t, b) in hot.blobs.items()}
+                writes = list(hot.writes.values())
+                return self._tuple(row, blobs, writes)
+
+        # Resume from the store: latest (or requested) checkpoint, its channel values, its pending writes
+        rows = self.store.checkpoints(thread_id, checkpoint_ns, checkpoint_id, limit=1)
+        if not rows:
+            return None
+        row = rows[0]
+        versions = self._loads((row[4], row[5]))["channel_versions"]
+        blobs = self.store.blobs(thread_id, checkpoint_ns, versions)
+        stored_writes = self.store.writes(thread_id, checkpoint_ns, row[2])
+        writes = [(t, c, ty, b, p) for t, _, c, ty, b, p in stored_writes]
+        with self._lock:
+            self._stats["resumes"] += 1
+            current = self._hot.get(key)
+            if checkpoint_id is None and (current is None or current.row[2] <= row[2]):
+                self._touch_locked(
+                    key,
+                    _HotThread(
+                        row,
+                        {c: (str(versions[c]), t, b) for c, (t, b) in blobs.items()},
+                        # Keyed by the stored idx, as put_writes keys them, so a re-put write replaces its copy
+                        {(t, idx): (t, c, ty, b, p) for t, idx, c, ty, b, p in stored_writes},
+                        resumed=True,
+                    ),
+                )
+        return self._tuple(row, blobs, writes)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        thread_id = config["configurable"]["thread_id"] if config else None
+        checkpoint_ns = config["configurable"].get("checkpoint_ns") if config else None
+        checkpoint_id = get_checkpoint_id(config) if config else None
+        before_id = get_checkpoint_id(before) if before else None
+        rows = self.store.checkpoints(
+            thread_id, checkpoint_ns, checkpoint_id, before_id, None if filter else limit
+        )
+        for row in rows:
+            if filter:
+                metadata = self._loads((row[6], row[7]))
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        break
+                    limit -= 1
+            versions = self._loads((row[4], row[5]))["channel_versions"]
+            blobs = self.store.blobs(row[0], row[1], versions)
+            writes = [(t, c, ty, b, p) for t, _, c, ty, b, p in self.store.writes(row[0], row[1], row[2])]
+            yield self._tuple(row, blobs, writes)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        key = (thread_id, checkpoint_ns)
+
+        stored = dict(checkpoint)
+        values = stored.pop("channel_values")
+        # Delta: only channels whose version changed get a new blob
+        blobs = {}
+        for channel, version in new_versions.items():
+            type_, blob = self._dumps(values[channel]) if channel in values else ("empty", b"")
+            blobs[channel] = (str(version), type_, blob)
+        type_, data = self._dumps(stored)
+        md_type, md_data = self._dumps(get_serializable_checkpoint_metadata(config, metadata))
+        row = (thread_id, checkpoint_ns, checkpoint["id"], parent_id, type_, data, md_type, md_data)
+
+        self.store.put_checkpoint(
+            row, [(thread_id, checkpoint_ns, c, v, t, b) for c, (v, t, b) in blobs.items()]
+        )
+
+        prune = False
+        with self._lock:
+            self._stats["puts"] += 1
+            self._stats["blobs_written"] += len(blobs)
+            self._stats["bytes_written"] += len(data) + len(md_data) + sum(len(b or b"") for _, _, b in blobs.values())
+            hot = self._hot.get(key)
+            versions = {c: str(v) for c, v in checkpoint["channel_versions"].items()}
+            carried = {}
+            if hot is not None:
+                carried = {c: hot.blobs[c] for c, v in versions.items() if c in hot.blobs and hot.blobs[c][0] == v}
+            merged = {**carried, **{c: blobs[c] for c in blobs if c in versions}}
+            if set(merged) >= set(versions):
+                new_hot = _HotThread(row, merged, {})
+                new_hot.puts = (hot.puts if hot else 0) + 1
+                self._touch_locked(key, new_hot)
+                # Threads are pruned when they become active again and every `prune_every` puts
+                prune = (hot is not None and hot.resumed) or new_hot.puts % self.prune_every == 0
+            else:
+                # Parent not cached: resume from the store on the next read
+                self._hot.pop(key, None)
+                prune = True
+
+        if prune:
+            dropped, orphans = self.store.prune(
+                thread_id, checkpoint_ns, self.keep_latest, self._referenced_versions
+            )
+            with self._lock:
+                self._stats["checkpoints_pruned"] += dropped
+                self._stats["blobs_pruned"] += orphans
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self._dumps(value)
+            rows.append(
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, type_, blob, task_path)
+            )
+        # Special writes (errors, interrupts) overwrite; regular writes are idempotent
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        self.store.put_writes(rows, replace)
+        with self._lock:
+            hot = self._hot.get((thread_id, checkpoint_ns))
+            if hot is not None and hot.row[2] == checkpoint_id:
+                for row in rows:
+                    write_key = (row[3], row[4])
+                    if replace or write_key not in hot.writes:
+                        hot.writes[write_key] = (row[3], row[5], row[6], row[7], row[8])
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            for key in [k for k in self._hot if k[0] == thread_id]:
+                del self._hot[key]
+        self.store.delete_thread(thread_id)
+
+    def get_next_version(self, current, channel) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ── async: the stores are blocking, keep them off the event loop ──
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["hot_threads"] = len(self._hot)
+        snapshot["store_bytes"] = self.store.size_bytes()
+        return snapshot
+
+
+def create_checkpointer(backend: str = checkpointer_backend):
+    """Checkpointer for the configured backend: sqlite (default), azuresql or memory."""
+    if backend == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+
+        return MemorySaver()
+    if backend == "azuresql":
+        from service_requests.credentials import token_cache
+        from service_requests.sql_pool import get_pool
+
+        return CompactingCheckpointer(AzureSqlStore(get_pool(token_cache.get_token)))
+    if backend == "sqlite":
+        return CompactingCheckpointer(SqliteStore())
+    raise ValueError(f"Unknown CHECKPOINTER backend: {backend}")
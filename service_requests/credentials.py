@@ -0,0 +1,237 @@
+"""
+Process-wide Entra ID credential with a per-scope token cache.
+
+`DefaultAzureCredential()` probes the whole credential chain the first time it is
+asked for a token, and every `get_token` call goes back to the identity endpoint.
+This module creates the credential once, caches one token per scope, and refreshes
+each token on a background thread well before it expires, so tool calls only ever
+read a cached token.
+
+`token_cache` implements the `TokenCredential` protocol, so it can be passed to
+Azure SDK clients (e.g. `SearchClient`) wherever a credential is expected;
+`async_token_cache` is the same cache behind the `AsyncTokenCredential` protocol,
+for the `.aio` clients.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from azure.core.credentials import AccessToken
+from azure.identity import DefaultAzureCredential
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SQL_SCOPE = "https://database.windows.net/.default"
+OPENAI_SCOPE = "https://cognitiveservices.azure.com/.default"
+SEARCH_SCOPE = "https://search.azure.com/.default"
+
+DEFAULT_SCOPES = (SQL_SCOPE, OPENAI_SCOPE, SEARCH_SCOPE)
+
+az_token_refresh_margin_seconds = float(
+    os.getenv("az_token_refresh_margin_seconds", "600")
+)
+az_token_retry_seconds = float(os.getenv("az_token_retry_seconds", "10"))
+az_token_retry_max_seconds = float(os.getenv("az_token_retry_max_seconds", "300"))
+
+
+class _ScopeEntry:
+    __slots__ = ("token", "lock", "refreshes", "failures", "last_seconds", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.token: AccessToken | None = None
+        self.lock = threading.Lock()
+        self.refreshes = 0
+        self.failures = 0
+        self.last_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class TokenCache:
+    """Caches one access token per scope and refreshes it before expiry."""
+
+    def __init__(
+        self,
+        credential,
+        scopes=DEFAULT_SCOPES,
+        refresh_margin_seconds: float = az_token_refresh_margin_seconds,
+        retry_seconds: float = az_token_retry_seconds,
+    ):
+        self.credential = credential
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.retry_seconds = retry_seconds
+        self._consecutive_failures = 0
+        self._entries: dict[str, _ScopeEntry] = {}
+        self._entries_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        for scope in scopes:
+            self._entry(scope)
+
+    def _entry(self, scope: str) -> _ScopeEntry:
+        with self._entries_lock:
+            entry = self._entries.get(scope)
+            if entry is None:
+                entry = self._entries[scope] = _ScopeEntry()
+                self._wakeup.set()
+            return entry
+
+    def _refresh(self, scope: str, entry: _ScopeEntry) -> AccessToken:
+        """Fetch a new token for `scope`. Caller holds `entry.lock`."""
+        started = time.perf_counter()
+        try:
+            token = self.credential.get_token(scope)
+        except Exception:
+            entry.failures += 1
+            raise
+        elapsed = time.perf_counter() - started
+        entry.token = token
+        entry.refreshes += 1
+        entry.last_seconds = elapsed
+        entry.total_seconds += elapsed
+        entry.max_seconds = max(entry.max_seconds, elapsed)
+        print(f"refreshed token for {scope} in {elapsed * 1000:.0f} ms")
+        return token
+
+    def _needs_refresh(self, entry: _ScopeEntry, now: float) -> bool:
+        return (
+            entry.token is None
+            or entry.token.expires_on - now <= self.refresh_margin_seconds
+        )
+
+    # ── TokenCredential protocol ────────────────────────────────
+
+    def get_token(self, *scopes: str, claims=None, tenant_id=None, **kwargs) -> AccessToken:
+        if claims or tenant_id or len(scopes) != 1:
+            # Claims challenges and multi-scope requests are rare; don't cache them
+            return self.credential.get_token(*scopes, claims=claims, tenant_id=tenant_id, **kwargs)
+        scope = scopes[0]
+        entry = self._entry(scope)
+        token = entry.token
+        if token is not None and token.expires_on - time.time() > 60:
+            return token
+        # Cold start or the background refresh fell behind: fetch once, other callers wait
+        with entry.lock:
+            token = entry.token
+            if token is None or token.expires_on - time.time() <= 60:
+                token = self._refresh(scope, entry)
+        self._wakeup.set()
+        return token
+
+    def bearer_token_provider(self, scope: str):
+        """Callable returning a bearer token string, as expected by `azure_ad_token_provider`."""
+        self._entry(scope)
+
+        def provider() -> str:
+            return self.get_token(scope).token
+
+        return provider
+
+    # ── background refresh ──────────────────────────────────────
+
+    def _refresh_due(self) -> float:
+        """Refresh every scope that is close to expiry; return seconds until the next one is due."""
+        with self._entries_lock:
+            items = list(self._entries.items())
+        next_due = 3600.0
+        failed = False
+        for scope, entry in items:
+            if self._needs_refresh(entry, time.time()):
+                try:
+                    with entry.lock:
+                        if self._needs_refresh(entry, time.time()):
+                            self._refresh(scope, entry)
+                except Exception as e:
+                    failed = True
+                    first_line = str(e).splitlines()[0] if str(e) else repr(e)
+                    print(f"Error refreshing token for {scope}: {first_line}")
+                    continue
+            due = entry.token.expires_on - self.refresh_margin_seconds - time.time()
+            next_due = min(next_due, max(due, 1.0))
+        if failed:
+            # Back off exponentially while the credential chain keeps failing
+            self._consecutive_failures += 1
+            retry = min(
+                self.retry_seconds * 2 ** (self._consecutive_failures - 1),
+                az_token_retry_max_seconds,
+            )
+            next_due = min(next_due, retry)
+        else:
+            self._consecutive_failures = 0
+        return next_due
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            wait = self._refresh_due()
+            self._wakeup.wait(wait)
+
+    def start(self):
+        """Start the background refresh thread; it also pre-fetches every known scope."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="token-cache-refresh", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def metrics(self) -> dict:
+        """Per-scope refresh timings, so the cost of the credential chain is visible."""
+        now = time.time()
+        with self._entries_lock:
+            items = list(self._entries.items())
+        report = {}
+        for scope, entry in items:
+            report[scope] = {
+                "refreshes": entry.refreshes,
+                "failures": entry.failures,
+                "last_refresh_seconds": entry.last_seconds,
+                "avg_refresh_seconds": (
+                    entry.total_seconds / entry.refreshes if entry.refreshes else 0.0
+                ),
+                "max_refresh_seconds": entry.max_seconds,
+                "expires_in_seconds": (
+                    entry.token.expires_on - now if entry.token else None
+                ),
+            }
+        return report
+
+
+class AsyncTokenCache:
+    """`AsyncTokenCredential` view of a `TokenCache`, for Azure SDK `.aio` clients."""
+
+    def __init__(self, cache: TokenCache):
+        self.cache = cache
+
+    async def get_token(self, *scopes: str, claims=None, tenant_id=None, **kwargs) -> AccessToken:
+        if not claims and not tenant_id and len(scopes) == 1:
+            token = self.cache._entry(scopes[0]).token
+            if token is not None and token.expires_on - time.time() > 60:
+                return token
+        # A refresh goes through the synchronous credential chain; keep it off the event loop
+        return await asyncio.to_thread(
+            self.cache.get_token, *scopes, claims=claims, tenant_id=tenant_id, **kwargs
+        )
+
+    async def close(self):
+        # The underlying cache is process-wide and outlives any one client
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+credential = DefaultAzureCredential()
+token_cache = TokenCache(credential).start()
+async_token_cache = AsyncTokenCache(token_cache)
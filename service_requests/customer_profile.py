@@ -0,0 +1,376 @@
+"""
+Cross-session cache of customer profiles (customer, vehicles and service schedules).
+
+The profile join runs once per customer and is shared by every conversation in the
+process until it is older than `CUSTOMER_PROFILE_TTL_SECONDS`. Tools that write to
+the database patch the cached rows from what the write already returned (the
+`OUTPUT INSERTED` row of a new schedule, the schedule a feedback was stored for),
+so the join is not run again after a booking or a feedback.
+
+The rows are folded into a `CustomerProfile` (customer -> vehicles -> schedules) and
+rendered compactly within `CUSTOMER_PROFILE_TOKEN_BUDGET` tokens: upcoming and recent
+schedules are listed, older ones are summarized per vehicle.
+"""
+
+import datetime
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+
+from service_requests.token_count import count_tokens
+
+load_dotenv()
+
+customer_profile_ttl_seconds = float(os.getenv("CUSTOMER_PROFILE_TTL_SECONDS", "300"))
+customer_profile_token_budget = int(os.getenv("CUSTOMER_PROFILE_TOKEN_BUDGET", "400"))
+
+PROFILE_QUERY = """
+SELECT
+    c.customer_id AS CustomerID,
+    c.name AS CustomerName,
+    v.vehicle_id AS VehicleID,
+    v.model AS Model,
+    v.year AS YearOfManufacture,
+    v.registration_number AS RegistrationNumber,
+    ss.schedule_id AS ScheduleID,
+    ss.service_date AS ServiceDate,
+    ss.start_time AS StartTime,
+    ss.end_time AS EndTime,
+    ss.status AS ScheduleStatus,
+    CASE WHEN EXISTS (SELECT 1 FROM Service_Feedback f WHERE f.schedule_id = ss.schedule_id)
+        THEN 1 ELSE 0 END AS FeedbackCaptured
+FROM
+    Customers c
+    INNER JOIN Vehicles v ON c.customer_id = v.customer_id
+    LEFT JOIN Service_Schedules ss ON v.vehicle_id = ss.vehicle_id
+WHERE
+    c.name = ?;
+"""
+
+# ── structured profile ──────────────────────────────────────────
+
+
+@dataclass
+class ScheduleInfo:
+    schedule_id: int
+    service_date: datetime.date | None
+    start_time: datetime.time | None
+    end_time: datetime.time | None
+    status: str | None
+    feedback_captured: bool = False
+
+
+@dataclass
+class VehicleInfo:
+    vehicle_id: int
+    model: str
+    year: int | None
+    registration_number: str
+    schedules: list[ScheduleInfo] = field(default_factory=list)
+
+
+@dataclass
+class CustomerProfile:
+    customer_id: int
+    name: str
+    vehicles: list[VehicleInfo] = field(default_factory=list)
+
+    @property
+    def schedule_count(self) -> int:
+        return sum(len(vehicle.schedules) for vehicle in self.vehicles)
+
+
+def _as_date(value) -> datetime.date | None:
+    if value is None or isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def _as_time(value) -> datetime.time | None:
+    if value is None or isinstance(value, datetime.time):
+        return value
+    return datetime.time.fromisoformat(str(value))
+
+
+def build_profile(rows: list[dict]) -> CustomerProfile | None:
+    """Fold the flat join rows into customer -> vehicles -> schedules, without repeated fields."""
+    if not rows:
+        return None
+    first = rows[0]
+    profile = CustomerProfile(first["CustomerID"], first["CustomerName"])
+    vehicles: dict[int, VehicleInfo] = {}
+    for row in rows:
+        vehicle = vehicles.get(row["VehicleID"])
+        if vehicle is None:
+            vehicle = vehicles[row["VehicleID"]] = VehicleInfo(
+                row["VehicleID"], row["Model"], row["YearOfManufacture"], row["RegistrationNumber"]
+            )
+            profile.vehicles.append(vehicle)
+        if row["ScheduleID"] is None:
+            continue
+        vehicle.schedules.append(
+            ScheduleInfo(
+                row["ScheduleID"],
+                _as_date(row["ServiceDate"]),
+                _as_time(row["StartTime"]),
+                _as_time(row["EndTime"]),
+                row["ScheduleStatus"],
+                bool(row.get("FeedbackCaptured")),
+            )
+        )
+    return profile
+
+
+# ── compact rendering ───────────────────────────────────────────
+
+
+def _schedule_line(label: str, schedule: ScheduleInfo) -> str:
+    line = f"  {label}: Schedule ID {schedule.schedule_id}, {schedule.service_date}"
+    if schedule.start_time and schedule.end_time:
+        line += f" {schedule.start_time:%H:%M}-{schedule.end_time:%H:%M}"
+    line += f", {schedule.status}"
+    if schedule.status == "Completed":
+        line += ", feedback captured" if schedule.feedback_captured else ", no feedback yet"
+    return line
+
+
+def _summary_line(schedules: list[ScheduleInfo]) -> str:
+    dates = sorted(s.service_date for s in schedules if s.service_date)
+    statuses = {}
+    for schedule in schedules:
+        statuses[schedule.status] = statuses.get(schedule.status, 0) + 1
+    line = f"  Other: {len(schedules)} more schedules"
+    if dates:
+        line += f" from {dates[0]} to {dates[-1]}"
+    line += " (" + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items(), key=str)) + ")"
+    return line
+
+
+def render_profile(
+    profile: CustomerProfile | None,
+    token_budget: int | None = None,
+    today: datetime.date | None = None,
+) -> tuple[str, dict]:
+    """
+    Compact profile text for the system prompts, within `token_budget` tokens.
+
+    Each vehicle's next upcoming and most recent schedule are listed first, then the
+    remaining upcoming ones, then older ones by recency; whatever does not fit is
+    summarized in one line per vehicle. Returns the text and render statistics.
+    """
+    if profile is None:
+        return "No customer records found.", {"tokens": 0, "listed": 0, "summarized": 0}
+    token_budget = customer_profile_token_budget if token_budget is None else token_budget
+    today = today or datetime.date.today()
+
+    upcoming, past = {}, {}
+    for vehicle in profile.vehicles:
+        ahead = [s for s in vehicle.schedules if s.service_date and s.service_date >= today]
+        upcoming[vehicle.vehicle_id] = sorted(
+            ahead, key=lambda s: (s.service_date, s.start_time or datetime.time())
+        )
+        ahead_ids = {id(s) for s in ahead}
+        past[vehicle.vehicle_id] = sorted(
+            (s for s in vehicle.schedules if id(s) not in ahead_ids),
+            key=lambda s: (s.service_date or datetime.date.min, s.start_time or datetime.time()),
+            reverse=True,
+        )
+
+    # Priority: one upcoming and one recent per vehicle, then the rest of upcoming, then older by recency
+    priority = [u[0] for u in upcoming.values() if u] + [p[0] for p in past.values() if p]
+    priority += sorted(
+        (s for u in upcoming.values() for s in u[1:]), key=lambda s: (s.service_date, s.start_time or datetime.time())
+    )
+    priority += sorted(
+        (s for p in past.values() for s in p[1:]),
+        key=lambda s: (s.service_date or datetime.date.min, s.start_time or datetime.time()),
+        reverse=True,
+    )
+
+    def render(listed: set[int]) -> str:
+        lines = [f"Customer: {profile.name} (Customer ID {profile.customer_id})"]
+        for vehicle in profile.vehicles:
+            lines.append(
+                f"Vehicle ID {vehicle.vehicle_id}: {vehicle.model} ({vehicle.year}), registration {vehicle.registration_number}"
+            )
+            if not vehicle.schedules:
+                lines.append("  No service schedules")
+                continue
+            lines += [_schedule_line("Upcoming", s) for s in upcoming[vehicle.vehicle_id] if id(s) in listed]
+            lines += [_schedule_line("Past", s) for s in past[vehicle.vehicle_id] if id(s) in listed]
+            omitted = [s for s in vehicle.schedules if id(s) not in listed]
+            if omitted:
+                lines.append(_summary_line(omitted))
+        return "\n".join(lines)
+
+    listed: set[int] = set()
+    text = render(listed)
+    for schedule in priority:
+        candidate = render(listed | {id(schedule)})
+        if count_tokens(candidate) > token_budget:
+            break
+        listed.add(id(schedule))
+        text = candidate
+
+    return text, {
+        "tokens": count_tokens(text),
+        "listed": len(listed),
+        "summarized": profile.schedule_count - len(listed),
+    }
+
+
+class _Profile:
+    __slots__ = ("rows", "loaded_at", "lock", "rendered")
+
+    def __init__(self):
+        self.rows: list[dict] | None = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+        # (token budget, date) -> rendered text; cleared whenever the rows change
+        self.rendered: dict[tuple, str] = {}
+
+
+class CustomerProfileCache:
+    def __init__(self, pool, ttl_seconds: float = customer_profile_ttl_seconds):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self._profiles: dict[str, _Profile] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "patches": 0, "invalidations": 0, "renders": 0}
+        self._last_render: dict = {}
+
+    def _profile(self, customer_name: str) -> _Profile:
+        with self._lock:
+            profile = self._profiles.get(customer_name)
+            if profile is None:
+                profile = self._profiles[customer_name] = _Profile()
+            return profile
+
+    def _fresh(self, profile: _Profile) -> bool:
+        return profile.rows is not None and time.monotonic() - profile.loaded_at <= self.ttl_seconds
+
+    def _load(self, customer_name: str) -> list[dict]:
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(PROFILE_QUERY, (customer_name,))
+            rows = cursor.fetchall()
+            column_names = [column[0] for column in cursor.description]
+            cursor.close()
+        return [dict(zip(column_names, row)) for row in rows]
+
+    # ── reads ───────────────────────────────────────────────────
+
+    def get(self, customer_name: str) -> list[dict]:
+        """Profile rows for a customer, loading them once per TTL across all sessions."""
+        profile = self._profile(customer_name)
+        if self._fresh(profile):
+            with self._lock:
+                self._stats["hits"] += 1
+            return list(profile.rows)
+        # Only one caller runs the join for a given customer; the others wait for it
+        with profile.lock:
+            if not self._fresh(profile):
+                profile.rows = self._load(customer_name)
+                profile.loaded_at = time.monotonic()
+                profile.rendered = {}
+                with self._lock:
+                    self._stats["loads"] += 1
+            else:
+                with self._lock:
+                    self._stats["hits"] += 1
+            return list(profile.rows)
+
+    def render(self, customer_name: str, token_budget: int | None = None) -> str:
+        """Compact, token-budgeted profile text; re-rendered only when the rows change."""
+        token_budget = customer_profile_token_budget if token_budget is None else token_budget
+        rows = self.get(customer_name)
+        profile = self._profile(customer_name)
+        key = (token_budget, datetime.date.today())
+        text = profile.rendered.get(key)
+        if text is None:
+            text, stats = render_profile(build_profile(rows), token_budget)
+            profile.rendered = {key: text}
+            with self._lock:
+                self._stats["renders"] += 1
+                self._last_render = {"customer": customer_name, "rows": len(rows), **stats}
+            print(
+                f"customer profile for {customer_name}: {stats['tokens']} prompt tokens "
+                f"({stats['listed']} schedules listed, {stats['summarized']} summarized)"
+            )
+        return text
+
+    def vehicle_models(self, customer_name: str) -> list[str]:
+        """Distinct models of the customer's vehicles, e.g. for scoping manual searches."""
+        return sorted({row["Model"] for row in self.get(customer_name) if row.get("Model")})
+
+    # ── write-through patches ───────────────────────────────────
+
+    def _patch(self, match, update) -> list[str]:
+        """Apply `update(rows)` to every cached profile for which `match(rows)` holds."""
+        with self._lock:
+            items = list(self._profiles.items())
+        patched = []
+        for customer_name, profile in items:
+            with profile.lock:
+                if profile.rows is None or not match(profile.rows):
+                    continue
+                profile.rows = update([dict(row) for row in profile.rows])
+                profile.rendered = {}
+                patched.append(customer_name)
+        if patched:
+            with self._lock:
+                self._stats["patches"] += len(patched)
+        return patched
+
+    def apply_schedule(self, vehicle_id: int, schedule: dict) -> list[str]:
+        """
+        Add or update a schedule of `vehicle_id` in the cached profiles that hold that vehicle.
+        `schedule` uses the profile column names (ScheduleID, ServiceDate, ...).
+        """
+
+        def update(rows):
+            vehicle_rows = [row for row in rows if row["VehicleID"] == vehicle_id]
+            for row in vehicle_rows:
+                if row["ScheduleID"] == schedule["ScheduleID"]:
+                    row.update(schedule)
+                    return rows
+            # A vehicle with no schedules comes back from the LEFT JOIN as one empty row
+            empty = next((row for row in vehicle_rows if row["ScheduleID"] is None), None)
+            if empty is not None:
+                empty.update({"FeedbackCaptured": 0, **schedule})
+                return rows
+            rows.append({**vehicle_rows[0], "FeedbackCaptured": 0, **schedule})
+            return rows
+
+        return self._patch(lambda rows: any(row["VehicleID"] == vehicle_id for row in rows), update)
+
+    def record_feedback(self, schedule_id: int) -> list[str]:
+        """Mark the schedule as having feedback in every cached profile that holds it."""
+
+        def update(rows):
+            for row in rows:
+                if row["ScheduleID"] == schedule_id:
+                    row["FeedbackCaptured"] = 1
+            return rows
+
+        return self._patch(lambda rows: any(row["ScheduleID"] == schedule_id for row in rows), update)
+
+    def invalidate(self, customer_name: str | None = None):
+        with self._lock:
+            if customer_name is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(customer_name, None)
+            self._stats["invalidations"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["profiles_cached"] = sum(1 for p in self._profiles.values() if p.rows is not None)
+            snapshot["last_render"] = dict(self._last_render)
+        return snapshot
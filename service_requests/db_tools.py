@@ -1,19 +1,22 @@
-import pyodbc
-import struct
 from dotenv import load_dotenv
+import functools
+import hashlib
 import os
-import requests
+from langchain_core.messages import ToolMessage
 from langchain_core.runnables import RunnableConfig
-from langchain_core.tools import tool
-import json
+from langchain_core.tools import InjectedToolCallId, StructuredTool
+from langgraph.types import Command
+from typing import Annotated
 import traceback
-from azure.identity import DefaultAzureCredential
+from service_requests.credentials import token_cache
+from service_requests.customer_profile import CustomerProfileCache
+from service_requests.embeddings import aget_embedding, get_embedding
+from service_requests.slot_engine import SlotEngine
+from service_requests.sql_pool import get_pool
+from service_requests.vector_codec import vector_to_tvp_rows
 
 load_dotenv()
 
-az_db_server = os.getenv("az_db_server")
-az_db_database = os.getenv("az_db_database")
-
 az_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 az_openai_deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 az_openai_embedding_deployment_name = os.getenv(
@@ -21,25 +24,39 @@ az_openai_embedding_deployment_name = os.getenv(
 )
 az_api_type = os.getenv("API_TYPE")
 az_openai_version = os.getenv("API_VERSION")
+slot_hold_seconds = int(os.getenv("SLOT_HOLD_SECONDS", "300"))
 
-credential = DefaultAzureCredential()
+# Shared, token-refreshing connection pool; see service_requests/sql_pool.py
+sql_pool = get_pool(token_cache.get_token)
 
+# Cached, capacity-aware slot availability; see service_requests/slot_engine.py
+slot_engine = SlotEngine(sql_pool)
 
-def get_sql_connection():
-    """Create a pyodbc connection to Azure SQL using DefaultAzureCredential."""
-    token = credential.get_token("https://database.windows.net/.default").token
-    token_bytes = token.encode("UTF-16-LE")
-    token_struct = struct.pack(f'<I{len(token_bytes)}s', len(token_bytes), token_bytes)
-    SQL_COPT_SS_ACCESS_TOKEN = 1256
-    conn_str = (
-        f"Driver={{ODBC Driver 18 for SQL Server}};"
-        f"SERVER={az_db_server};"
-        f"DATABASE={az_db_database}"
-    )
-    return pyodbc.connect(conn_str, attrs_before={SQL_COPT_SS_ACCESS_TOKEN: token_struct})
+# Customer profiles shared across conversations; see service_requests/customer_profile.py
+customer_profiles = CustomerProfileCache(sql_pool)
+
+
+def db_tool(func=None, *, coroutine=None):
+    """
+    Like `@tool`, but the tool also gets an async implementation so the graph can
+    run under `ainvoke`/`astream`. Unless `coroutine` is given, the async version
+    runs the blocking function on the connection pool's bounded executor.
+    """
+
+    def decorator(func):
+        async_func = coroutine
+        if async_func is None:
 
+            @functools.wraps(func)
+            async def async_func(*args, **kwargs):
+                return await sql_pool.arun(func, *args, **kwargs)
 
-@tool
+        return StructuredTool.from_function(func=func, coroutine=async_func)
+
+    return decorator(func) if func is not None else decorator
+
+
+@db_tool
 def fetch_customer_information(config: RunnableConfig) -> list[dict]:
     """
     For an input customer name, retrieves all information about a customer from the database, like the vehicle details and service schedules.
@@ -53,176 +70,282 @@ def fetch_customer_information(config: RunnableConfig) -> list[dict]:
     if not customer_name:
         raise ValueError("No customer Name configured.")
 
-    connection = get_sql_connection()
-    cursor = connection.cursor()
-    query = """
-    SELECT
-        c.customer_id AS CustomerID,
-        c.name AS CustomerName,
-        v.vehicle_id AS VehicleID,
-        v.model AS Model,
-        v.year AS YearOfManufacture,
-        v.registration_number AS RegistrationNumber,
-        ss.schedule_id AS ScheduleID,
-        ss.service_date AS ServiceDate,
-        ss.start_time AS StartTime,
-        ss.end_time AS EndTime,
-        ss.status AS ScheduleStatus
-    FROM
-        Customers c
-        INNER JOIN Vehicles v ON c.customer_id = v.customer_id
-        LEFT JOIN Service_Schedules ss ON v.vehicle_id = ss.vehicle_id
-    WHERE
-        c.name = ?;
+    # Served from the shared profile cache; the join only runs on a miss or after the TTL
+    return customer_profiles.render(customer_name)
+
+
+def fetch_vehicle_models(config: RunnableConfig) -> list[str]:
+    """Models of the configured customer's vehicles, from the shared profile cache."""
+    customer_name = ((config or {}).get("configurable") or {}).get("customer_name")
+    return customer_profiles.vehicle_models(customer_name) if customer_name else []
+
+
+def _with_profile_update(response_message: str, config: RunnableConfig | None, tool_call_id: str | None):
     """
-    cursor.execute(query, (customer_name,))
-    # print('database call completeed without errors')
-    rows = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    results = [dict(zip(column_names, row)) for row in rows]
-    response_message = ""
-    # print the results
-    for result in results:
-        response_message += f"Customer ID: {result['CustomerID']}\n"
-        response_message += f"Customer Name: {result['CustomerName']}\n"
-        response_message += f"Vehicle ID: {result['VehicleID']}\n"
-        response_message += f"Model: {result['Model']}\n"
-        response_message += f"Year of Manufacture: {result['YearOfManufacture']}\n"
-        response_message += f"Registration Number: {result['RegistrationNumber']}\n"
-        response_message += f"Schedule ID: {result['ScheduleID']}\n"
-        response_message += f"Service Date: {result['ServiceDate']}\n"
-        response_message += f"Start Time: {result['StartTime']}\n"
-        response_message += f"End Time: {result['EndTime']}\n"
-        response_message += f"Schedule Status: {result['ScheduleStatus']}\n\n"
-
-    # print('database call response has been parsed')
-    cursor.close()
-    connection.close()
-    return response_message
-
-
-@tool
-def get_available_service_slots(start_date):
+    Return the tool result together with the patched customer profile, so the
+    conversation state sees the write without re-running the profile query.
     """
-    For an input start date, retrieves all available service schedule slots.
+    customer_name = ((config or {}).get("configurable") or {}).get("customer_name")
+    if not tool_call_id or not customer_name:
+        return response_message
+    return Command(
+        update={
+            "customer_info": customer_profiles.render(customer_name),
+            "messages": [ToolMessage(response_message, tool_call_id=tool_call_id)],
+        }
+    )
+
 
+@db_tool
+def get_available_service_slots(start_date, end_date=None, service_type_id=1):
     """
-    response_message = ""
-    connection = get_sql_connection()
-    cursor = connection.cursor()
-    query = """
-    
-    WITH PotentialSlots AS (
-        SELECT
-            DATEADD(MINUTE, (t.N * 60 * 24) + s.SlotOffset, CAST(? AS DATETIME)) AS SlotStart,
-            DATEADD(MINUTE, (t.N * 60 * 24) + s.SlotOffset + 60, CAST(? AS DATETIME)) AS SlotEnd
-        FROM
-            (VALUES (0), (1), (2)) AS t(N) -- Days: 0 = Monday, 1 = Tuesday, 2 = Wednesday
-        CROSS JOIN
-            (VALUES
-                (9 * 60), (10 * 60), (11 * 60), (12 * 60), -- Morning slots
-                (14 * 60), (15 * 60), (16 * 60), (17 * 60) -- Afternoon slots
-            ) AS s(SlotOffset)
-    ),
-    BookedSlots AS (
-        SELECT
-            CAST(service_date AS DATETIME) + CAST(start_time AS DATETIME) AS SlotStart,
-            CAST(service_date AS DATETIME) + CAST(end_time AS DATETIME) AS SlotEnd
-        FROM
-            Service_Schedules
-        WHERE
-            service_date BETWEEN ? AND DATEADD(DAY, 2, ?)
-            AND status = 'Scheduled'
-    )
-    SELECT DISTINCT
-        ps.SlotStart AS AvailableStart,
-        ps.SlotEnd AS AvailableEnd
-    FROM
-        PotentialSlots ps
-    LEFT JOIN
-        BookedSlots bs ON ps.SlotStart < bs.SlotEnd AND ps.SlotEnd > bs.SlotStart
-    WHERE
-        bs.SlotStart IS NULL
-    ORDER BY
-        ps.SlotStart;
+    For an input start date, and optionally an end date (inclusive, defaults to two days after the start date) and service type id,
+    retrieves all available service schedule slots long enough for that service type.
+
     """
-    cursor.execute(query, (start_date, start_date, start_date, start_date))
-    rows = cursor.fetchall()
-    column_names = [column[0] for column in cursor.description]
-    results = [dict(zip(column_names, row)) for row in rows]
-    cursor.close()
-    connection.close()
-    return results
+    return slot_engine.free_slots(start_date, end_date, service_type_id)
 
 
-def create_service_appointment_slot(start_date_time, vehicle_id=1, service_type_id=1):
+# Raised by CreateServiceSchedule / HoldServiceSlot when every technician is busy
+NO_TECHNICIAN_ERROR = 50010
+
+
+def _is_no_technician_error(error: Exception) -> bool:
+    return f"({NO_TECHNICIAN_ERROR})" in str(error)
+
+
+def booking_idempotency_key(config: RunnableConfig | None, start_date_time, vehicle_id, service_type_id) -> str:
     """
-    For an input start date time, vehicle_id and service_type_id , register the service appointment slot for the Customer.
+    Stable key for one booking or hold request within a conversation, so a retried tool call
+    returns the original booking or hold instead of creating a duplicate.
+    """
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id", "")
+    raw = f"{thread_id}|{start_date_time}|{vehicle_id}|{service_type_id}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
+
+@db_tool
+def hold_service_slot(start_date_time, vehicle_id=1, service_type_id=1, config: RunnableConfig = None):
     """
-    response_message = ""
-    connection = get_sql_connection()
-    cursor = connection.cursor()
+    For an input start date time, vehicle_id and service_type_id, hold the service slot for a few minutes
+    while the customer confirms it. Pass the returned HoldID to create_service_appointment_slot.
+
+    """
+    idempotency_key = booking_idempotency_key(config, start_date_time, vehicle_id, service_type_id)
 
     try:
-        # Calling the stored procedure
-        cursor.execute(
-            """
-                EXEC CreateServiceSchedule @SelectedSlotStart = ?, @VehicleID = ?, @ServiceTypeID = ?
-            """,
-            (start_date_time, vehicle_id, service_type_id),
-        )
+        with sql_pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    EXEC HoldServiceSlot @SelectedSlotStart = ?, @VehicleID = ?, @ServiceTypeID = ?,
+                        @HoldSeconds = ?, @IdempotencyKey = ?
+                """,
+                (start_date_time, vehicle_id, service_type_id, slot_hold_seconds, idempotency_key),
+            )
+            columns = [column[0] for column in cursor.description]
+            hold = dict(zip(columns, cursor.fetchone()))
+            connection.commit()
+            cursor.close()
+    except Exception as e:
+        if _is_no_technician_error(e):
+            slot_engine.invalidate(start_date_time)
+            return "The selected slot is no longer available. Please choose another slot."
+        print(f"Error holding the Service slot: {e}")
+        return None
 
-        # Fetching the results
-        rows = cursor.fetchall()
-        if rows:
-            for row in rows:
-                print(row)
-        else:
-            print("No results returned.")
+    if not hold.get("IsReplay"):
+        slot_engine.record_booking(hold["ServiceDate"], hold["StartTime"], hold["EndTime"], hold["TechnicianID"])
+    return {
+        "HoldID": str(hold["HoldID"]),
+        "StartDateTime": start_date_time,
+        "ExpiresAtUtc": str(hold["ExpiresAt"]),
+    }
+
+
+@db_tool
+def create_service_appointment_slot(
+    start_date_time,
+    vehicle_id=1,
+    service_type_id=1,
+    hold_id: str | None = None,
+    config: RunnableConfig = None,
+    tool_call_id: Annotated[str | None, InjectedToolCallId] = None,
+):
+    """
+    For an input start date time, vehicle_id and service_type_id , register the service appointment slot for the Customer.
+    Pass the HoldID from hold_service_slot, if the slot was held.
 
-        # Commit the transaction if necessary
-        connection.commit()
+    """
+    response_message = ""
+    idempotency_key = booking_idempotency_key(config, start_date_time, vehicle_id, service_type_id)
 
-        response_message = (
-            "Service appointment slot created successfully for the slot start datetime: "
-            + start_date_time
-        )
-        return response_message
+    try:
+        with sql_pool.connection() as connection:
+            cursor = connection.cursor()
+            # Calling the stored procedure
+            cursor.execute(
+                """
+                    EXEC CreateServiceSchedule @SelectedSlotStart = ?, @VehicleID = ?, @ServiceTypeID = ?,
+                        @IdempotencyKey = ?, @HoldID = ?
+                """,
+                (start_date_time, vehicle_id, service_type_id, idempotency_key, hold_id),
+            )
+
+            # Fetching the results; the first result set is the OUTPUT INSERTED schedule row
+            # (absent on an idempotent replay), the last holds the booked schedule and technician
+            booking = None
+            inserted_schedule = None
+            while True:
+                if cursor.description:
+                    columns = [column[0] for column in cursor.description]
+                    rows = cursor.fetchall()
+                    for row in rows:
+                        print(row)
+                    if "TechnicianID" in columns and rows:
+                        booking = dict(zip(columns, rows[0]))
+                    elif "vehicle_id" in columns and rows:
+                        inserted_schedule = dict(zip(columns, rows[0]))
+                if not cursor.nextset():
+                    break
+            if booking is None:
+                print("No results returned.")
+
+            # Commit the transaction if necessary
+            connection.commit()
+            cursor.close()
     except Exception as e:
+        if _is_no_technician_error(e):
+            slot_engine.invalidate(start_date_time)
+            return (
+                "No technician is available for the slot start datetime: "
+                + str(start_date_time)
+                + ". The appointment was not created; please choose another slot."
+            )
         print(f"Error creating the Service appointment: {e}")
         return None
-    finally:
-        cursor.close()
-        connection.close()
-
-
-def get_embedding(text):
-    token = credential.get_token("https://cognitiveservices.azure.com/.default").token
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
-    url = f"{az_openai_endpoint}openai/deployments/{az_openai_embedding_deployment_name}/embeddings?api-version=2023-05-15"
-    print("the url is ", url)
-    payload = {"input": text}
-    response = requests.post(url, headers=headers, json=payload)
-
-    if response.status_code == 200:
-        embed_content = response.json()["data"][0]["embedding"]
-        # print("Embedding content\n", embed_content, "\n")
-        print("retrieved embedding content")
-        return embed_content
+
+    if booking is None:
+        slot_engine.invalidate(start_date_time)
+        return None
+
+    slot_engine.record_booking(
+        booking["ServiceDate"], booking["StartTime"], booking["EndTime"], booking["TechnicianID"]
+    )
+    if inserted_schedule is not None:
+        customer_profiles.apply_schedule(
+            inserted_schedule["vehicle_id"],
+            {
+                "ScheduleID": inserted_schedule["schedule_id"],
+                "ServiceDate": inserted_schedule["service_date"],
+                "StartTime": inserted_schedule["start_time"],
+                "EndTime": inserted_schedule["end_time"],
+                "ScheduleStatus": inserted_schedule["status"],
+            },
+        )
+    else:
+        # Replayed booking: the final result set has the same schedule columns
+        customer_profiles.apply_schedule(
+            vehicle_id, {column: booking[column] for column in ("ScheduleID", "ServiceDate", "StartTime", "EndTime", "ScheduleStatus")}
+        )
+    if booking.get("IsReplay"):
+        response_message = (
+            "Service appointment slot was already created for the slot start datetime: "
+            + str(start_date_time)
+            + f" (Schedule ID: {booking['ScheduleID']})"
+        )
     else:
-        print(f"Error fetching embedding: {response.status_code} - {response.text}")
-        raise Exception(
-            f"Error fetching embedding: {response.status_code} - {response.text}"
+        response_message = (
+            "Service appointment slot created successfully for the slot start datetime: "
+            + str(start_date_time)
+            + f" (Schedule ID: {booking['ScheduleID']}, Technician: {booking['TechnicianName']})"
         )
+    return _with_profile_update(response_message, config, tool_call_id)
+
 
+def _feedback_row(
+    embedding,
+    schedule_id,
+    customer_id,
+    feedback_text,
+    rating_quality_of_work,
+    rating_timeliness,
+    rating_politeness,
+    rating_cleanliness,
+    rating_overall_experience,
+    feedback_date,
+) -> tuple:
+    """InsertServiceFeedback parameters, with the embedding as dbo.FeedbackVector TVP rows."""
+    return (
+        schedule_id,
+        customer_id,
+        feedback_text,
+        rating_quality_of_work,
+        rating_timeliness,
+        rating_politeness,
+        rating_cleanliness,
+        rating_overall_experience,
+        feedback_date,
+        vector_to_tvp_rows(embedding),
+    )
+
+
+def _insert_service_feedback(row: tuple):
+    # The vector goes over as a dbo.FeedbackVector TVP rather than a JSON string.
+    stored_procedure = """
+    EXEC InsertServiceFeedback ?, ?, ?, NULL, ?, ?, ?, ?, ?, ?, ?
+    """
+    with sql_pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(stored_procedure, row)
+        connection.commit()
+        cursor.close()
+
+
+def _feedback_stored(schedule_id, config: RunnableConfig, tool_call_id: str):
+    response_message = (
+        "Service feedback captured successfully for the schedule_id: " + str(schedule_id)
+    )
+    customer_profiles.record_feedback(int(schedule_id))
+    return _with_profile_update(response_message, config, tool_call_id)
+
+
+async def _astore_service_feedback(
+    schedule_id,
+    customer_id,
+    feedback_text,
+    rating_quality_of_work,
+    rating_timeliness,
+    rating_politeness,
+    rating_cleanliness,
+    rating_overall_experience,
+    feedback_date,
+    config: RunnableConfig,
+    tool_call_id: Annotated[str, InjectedToolCallId],
+):
+    try:
+        row = _feedback_row(
+            await aget_embedding(feedback_text),
+            schedule_id,
+            customer_id,
+            feedback_text,
+            rating_quality_of_work,
+            rating_timeliness,
+            rating_politeness,
+            rating_cleanliness,
+            rating_overall_experience,
+            feedback_date,
+        )
+        await sql_pool.arun(_insert_service_feedback, row)
+    except Exception as e:
+        print(f"Error capturing the service feedback: {e}")
+        traceback.print_exc()
+        return "Error capturing the service feedback."
 
-# Function to convert a list of floats into a list of single-item tuples
-def convert_to_tvp_format(vector):
-    return [(value,) for value in vector]
+    return await sql_pool.arun(_feedback_stored, schedule_id, config, tool_call_id)
 
 
-@tool
+@db_tool(coroutine=_astore_service_feedback)
 def store_service_feedback(
     schedule_id,
     customer_id,
@@ -233,59 +356,31 @@ def store_service_feedback(
     rating_cleanliness,
     rating_overall_experience,
     feedback_date,
+    config: RunnableConfig,
+    tool_call_id: Annotated[str, InjectedToolCallId],
 ):
     """
     Capture the service feedback of the customer for the service appointment slot.
 
     """
-    print(
-        "capturing the service feedback of the customer for the service appointment slot."
-    )
-    print(
-        f"schedule_id: {schedule_id}, customer_id: {customer_id}, feedback_text: {feedback_text}, rating_quality_of_work: {rating_quality_of_work}, rating_timeliness: {rating_timeliness}, rating_politeness: {rating_politeness}, rating_cleanliness: {rating_cleanliness},  rating_overall_experience: {rating_overall_experience}, feedback_date: {feedback_date}"
-    )
-
     try:
-        # print('0')
-        # v_feedback_text = "'"+str(get_embedding(feedback_text))+"'"
-        # v_feedback_text = my_embeddingfv
-
-        connection = get_sql_connection()
-        cursor = connection.cursor()
-
-        # Call the stored procedure
-        stored_procedure = """
-        EXEC InsertServiceFeedback ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-        """
-        cursor.execute(
-            stored_procedure,
-            (
-                schedule_id,
-                customer_id,
-                feedback_text,
-                json.dumps(json.loads(str(get_embedding(feedback_text)))),
-                rating_quality_of_work,
-                rating_timeliness,
-                rating_politeness,
-                rating_cleanliness,
-                rating_overall_experience,
-                feedback_date,
-            ),
+        # Embed before checking out a connection so it is not held during the HTTP call.
+        row = _feedback_row(
+            get_embedding(feedback_text),
+            schedule_id,
+            customer_id,
+            feedback_text,
+            rating_quality_of_work,
+            rating_timeliness,
+            rating_politeness,
+            rating_cleanliness,
+            rating_overall_experience,
+            feedback_date,
         )
-        connection.commit()
-        print("Feedback inserted successfully.")
-        response_message = (
-            "Service feedback captured successfully for the schedule_id: " + str(schedule_id)
-        )
-
+        _insert_service_feedback(row)
     except Exception as e:
-        print(f"************************Error: {e}*********************************")
-        #print stack trace
-
+        print(f"Error capturing the service feedback: {e}")
         traceback.print_exc()
-        response_message = "Error capturing the service feedback."
+        return "Error capturing the service feedback."
 
-    finally:
-        cursor.close()
-        connection.close()
-        return response_message
+    return _feedback_stored(schedule_id, config, tool_call_id)
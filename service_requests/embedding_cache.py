@@ -0,0 +1,280 @@
+"""
+Two-tier cache for text embeddings.
+
+Keys are a SHA-256 of the embedding deployment name plus the normalized text
+(Unicode NFKC, case-folded, whitespace collapsed), so "Unhappy with  cleanliness"
+and "unhappy with cleanliness" share an entry.
+
+- Tier 1: a bounded in-memory LRU of float32 vectors.
+- Tier 2: an on-disk store made of a fixed-capacity, memory-mapped float32 matrix
+  (`vectors-<layout>.f32`, one row per slot) and a small SQLite index mapping
+  key -> slot. When the store is full the least recently used slot is reused.
+  Hits update last-used times in memory; they are written back in batches, together
+  with a flush of the matrix, instead of on every lookup.
+
+The disk store is named after its layout (model version - deployment, API version
+and dimensions - and capacity), so a deployment change opens a new store and can
+never serve stale vectors. Several processes (the bot and Streamlit) can share the
+directory: a store is created in a temporary file and published atomically, and an
+existing file is never truncated under another process that has it mapped.
+"""
+
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+embedding_cache_dir = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+embedding_cache_memory_entries = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "2048"))
+embedding_cache_disk_entries = int(os.getenv("EMBEDDING_CACHE_DISK_ENTRIES", "20000"))
+embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# Last-used times of disk hits are written back after this many hits or seconds
+embedding_cache_touch_batch = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", "256"))
+embedding_cache_touch_seconds = float(os.getenv("EMBEDDING_CACHE_TOUCH_SECONDS", "30"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def cache_key(deployment: str, text: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(deployment.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _DiskStore:
+    """Memory-mapped float32 slots plus a SQLite key index. Not thread-safe on its own."""
+
+    def __init__(self, directory: str, capacity: int, dimensions: int, model_version: str):
+        os.makedirs(directory, exist_ok=True)
+        self.capacity = capacity
+        self.dimensions = dimensions
+        layout = {"model_version": model_version, "capacity": str(capacity), "dimensions": str(dimensions)}
+        name = hashlib.sha256(repr(sorted(layout.items())).encode("utf-8")).hexdigest()[:16]
+        self._db = sqlite3.connect(
+            os.path.join(directory, f"index-{name}.sqlite"), check_same_thread=False, timeout=30
+        )
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            """
+        )
+        vectors_path = os.path.join(directory, f"vectors-{name}.f32")
+        expected_bytes = capacity * dimensions * 4
+        if not os.path.exists(vectors_path) or os.path.getsize(vectors_path) != expected_bytes:
+            # Entries without their vectors are useless; start this layout empty
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM meta")
+            self._db.executemany("INSERT INTO meta (k, v) VALUES (?, ?)", layout.items())
+            self._db.commit()
+            self._create_vectors(vectors_path, capacity, dimensions)
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dimensions))
+        self._touched: dict[str, float] = {}
+        self._synced = time.monotonic()
+
+    @staticmethod
+    def _create_vectors(vectors_path: str, capacity: int, dimensions: int):
+        """Build a zeroed matrix in a temporary file and publish it, unless another process already has."""
+        tmp = f"{vectors_path}.{os.getpid()}.tmp"
+        vectors = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(capacity, dimensions))
+        vectors.flush()
+        del vectors
+        try:
+            os.link(tmp, vectors_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # No hard links on this file system
+            if not os.path.exists(vectors_path):
+                os.replace(tmp, vectors_path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get(self, key: str) -> np.ndarray | None:
+        row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._touched[key] = time.time()
+        if (
+            len(self._touched) >= embedding_cache_touch_batch
+            or time.monotonic() - self._synced >= embedding_cache_touch_seconds
+        ):
+            self.sync()
+        return np.array(self._vectors[row[0]])
+
+    def _write_touched(self):
+        self._db.executemany(
+            "UPDATE entries SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def sync(self):
+        """Write back buffered last-used times and flush the vectors to disk."""
+        if self._touched:
+            self._write_touched()
+            self._db.commit()
+        self._vectors.flush()
+        self._synced = time.monotonic()
+
+    def put(self, key: str, vector: np.ndarray) -> bool:
+        """Store a vector; returns True if an older entry had to be evicted."""
+        evicted = False
+        if self._db.in_transaction:
+            self._db.commit()
+        # Other processes share the store: the slot is chosen and its row written under
+        # SQLite's write lock, so two writers can never claim the same slot
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                slot = row[0]
+            else:
+                (top,) = self._db.execute("SELECT COALESCE(MAX(slot), -1) FROM entries").fetchone()
+                if top + 1 < self.capacity:
+                    # Slots only free up all at once (clear), so in-use slots are always 0..top
+                    slot = top + 1
+                else:
+                    if self._touched:
+                        self._write_touched()  # evict by up-to-date last-used times
+                    old_key, slot = self._db.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT 1"
+                    ).fetchone()
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                    evicted = True
+            # The memmap is shared with the page cache, so other processes see the row at once;
+            # it reaches the disk on the next sync
+            self._vectors[slot] = vector
+            self._touched.pop(key, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                (key, slot, time.time()),
+            )
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+        return evicted
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        self._touched.clear()
+        self._db.execute("DELETE FROM entries")
+        self._db.commit()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        deployment: str,
+        model_version: str,
+        directory: str | None = embedding_cache_dir,
+        memory_entries: int = embedding_cache_memory_entries,
+        disk_entries: int = embedding_cache_disk_entries,
+        dimensions: int = embedding_dimensions,
+    ):
+        self.deployment = deployment
+        self.model_version = model_version
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = (
+            _DiskStore(directory, disk_entries, dimensions, model_version)
+            if directory and disk_entries > 0
+            else None
+        )
+        if self._disk is not None:
+            atexit.register(self.sync)
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    def key(self, text: str) -> str:
+        return cache_key(self.deployment, text)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert into the memory tier. Caller holds the lock."""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def get(self, text: str) -> np.ndarray | None:
+        key = self.key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return vector
+            if self._disk is not None:
+                vector = self._disk.get(key)
+                if vector is not None:
+                    self._stats["disk_hits"] += 1
+                    self._remember(key, vector)
+                    return vector
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, text: str, vector) -> np.ndarray:
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._disk is not None and self._disk.put(key, vector):
+                self._stats["disk_evictions"] += 1
+        return vector
+
+    def sync(self):
+        """Persist buffered disk-tier state; also runs at interpreter exit."""
+        with self._lock:
+            if self._disk is not None:
+                self._disk.sync()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["memory_entries"] = len(self._memory)
+            snapshot["disk_entries"] = len(self._disk) if self._disk is not None else 0
+        lookups = snapshot["memory_hits"] + snapshot["disk_hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = (
+            (snapshot["memory_hits"] + snapshot["disk_hits"]) / lookups if lookups else 0.0
+        )
+        snapshot["model_version"] = self.model_version
+        return snapshot
@@ -0,0 +1,271 @@
+"""
+Azure OpenAI embeddings client shared by the feedback tool and the Feedback Explorer.
+
+- One `requests.Session`, so the TCP/TLS connection to Azure OpenAI is kept alive.
+- `embed_many` sends up to `max_batch_size` inputs per request (the API accepts arrays).
+- `embed` micro-batches concurrent single-text callers: requests that arrive within
+  `batch_window_seconds` of each other share one HTTP call.
+- 429 and 5xx responses are retried with jittered exponential backoff, honouring
+  the `Retry-After` / `retry-after-ms` headers when the service sends them.
+- `aembed` / `aembed_many` are the async entry points; they await the same batcher
+  without blocking the event loop.
+
+The module-level `get_embedding` / `get_embeddings` helpers sit behind the
+two-tier `EmbeddingCache` (see embedding_cache.py); use them rather than the
+client directly unless you need uncached vectors.
+"""
+
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from service_requests.credentials import OPENAI_SCOPE, token_cache
+from service_requests.embedding_cache import EmbeddingCache, embedding_dimensions
+
+load_dotenv()
+
+az_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "")
+az_openai_embedding_deployment_name = os.getenv(
+    "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME", ""
+)
+az_openai_embedding_api_version = os.getenv(
+    "AZURE_OPENAI_EMBEDDINGS_API_VERSION", "2023-05-15"
+)
+embedding_max_batch_size = int(os.getenv("EMBEDDINGS_MAX_BATCH_SIZE", "256"))
+embedding_batch_window_ms = float(os.getenv("EMBEDDINGS_BATCH_WINDOW_MS", "10"))
+embedding_max_retries = int(os.getenv("EMBEDDINGS_MAX_RETRIES", "6"))
+embedding_max_in_flight = int(os.getenv("EMBEDDINGS_MAX_IN_FLIGHT", "4"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmbeddingError(Exception):
+    """Raised when the embeddings API returns a non-retryable error or retries run out."""
+
+
+def _retry_after_seconds(response: requests.Response) -> float | None:
+    """Parse the server's requested back-off, if any."""
+    retry_ms = response.headers.get("retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+class EmbeddingClient:
+    def __init__(
+        self,
+        endpoint: str = az_openai_endpoint,
+        deployment: str = az_openai_embedding_deployment_name,
+        api_version: str = az_openai_embedding_api_version,
+        max_batch_size: int = embedding_max_batch_size,
+        batch_window_seconds: float = embedding_batch_window_ms / 1000,
+        max_retries: int = embedding_max_retries,
+        max_in_flight: int = embedding_max_in_flight,
+        timeout: float = 60,
+    ):
+        self.deployment = deployment
+        self.url = (
+            f"{endpoint.rstrip('/')}/openai/deployments/{deployment}"
+            f"/embeddings?api-version={api_version}"
+        )
+        self.max_batch_size = max_batch_size
+        self.batch_window_seconds = batch_window_seconds
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._pending: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="embeddings"
+        )
+        self._dispatcher: threading.Thread | None = None
+        self._dispatcher_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "inputs": 0,
+            "retries": 0,
+            "throttled": 0,
+            "request_seconds_total": 0.0,
+        }
+
+    # ── HTTP ────────────────────────────────────────────────────
+
+    def _post(self, texts: list[str]) -> list[list[float]]:
+        attempt = 0
+        while True:
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token_cache.get_token(OPENAI_SCOPE).token}",
+            }
+            started = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.url, headers=headers, json={"input": texts}, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            else:
+                error = None
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self._stats["requests"] += 1
+                self._stats["request_seconds_total"] += elapsed
+
+            if response is not None and response.status_code == 200:
+                data = sorted(response.json()["data"], key=lambda d: d["index"])
+                with self._stats_lock:
+                    self._stats["inputs"] += len(texts)
+                return [d["embedding"] for d in data]
+
+            retryable = response is None or response.status_code in RETRYABLE_STATUS
+            if not retryable or attempt >= self.max_retries:
+                if response is None:
+                    raise EmbeddingError(f"Error fetching embedding: {error}")
+                raise EmbeddingError(
+                    f"Error fetching embedding: {response.status_code} - {response.text}"
+                )
+
+            delay = None
+            if response is not None:
+                if response.status_code == 429:
+                    with self._stats_lock:
+                        self._stats["throttled"] += 1
+                delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = min(2**attempt, 30) * (0.5 + random.random())
+            attempt += 1
+            with self._stats_lock:
+                self._stats["retries"] += 1
+            print(f"embedding request retry {attempt} in {delay:.2f}s")
+            time.sleep(delay)
+
+    # ── batched entry points ────────────────────────────────────
+
+    def embed_many(self, texts: list[str]) -> list[list[float]]:
+        """Embed a list of texts, `max_batch_size` inputs per HTTP request."""
+        vectors: list[list[float]] = []
+        for i in range(0, len(texts), self.max_batch_size):
+            vectors.extend(self._post(texts[i : i + self.max_batch_size]))
+        return vectors
+
+    def submit(self, text: str) -> Future:
+        """Queue a single text for the next micro-batch."""
+        self._ensure_dispatcher()
+        future: Future = Future()
+        self._pending.put((text, future))
+        return future
+
+    def embed(self, text: str) -> list[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> list[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def aembed_many(self, texts: list[str]) -> list[list[float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_many, texts)
+
+    # ── micro-batcher ───────────────────────────────────────────
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            with self._dispatcher_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(
+                        target=self._dispatch, name="embeddings-batcher", daemon=True
+                    )
+                    self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.batch_window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: list[tuple[str, Future]]):
+        try:
+            vectors = self._post([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        requests_made = snapshot["requests"]
+        snapshot["avg_request_seconds"] = (
+            snapshot["request_seconds_total"] / requests_made if requests_made else 0.0
+        )
+        snapshot["avg_inputs_per_request"] = (
+            snapshot["inputs"] / requests_made if requests_made else 0.0
+        )
+        return snapshot
+
+
+embedding_client = EmbeddingClient()
+embedding_cache = EmbeddingCache(
+    deployment=az_openai_embedding_deployment_name,
+    # Changing any of these invalidates the on-disk tier
+    model_version=os.getenv(
+        "EMBEDDING_MODEL_VERSION",
+        f"{az_openai_embedding_deployment_name}:{az_openai_embedding_api_version}:{embedding_dimensions}",
+    ),
+)
+
+
+def get_embedding(text: str) -> list[float]:
+    vector = embedding_cache.get(text)
+    if vector is None:
+        vector = embedding_cache.put(text, embedding_client.embed(text))
+    return vector.tolist()
+
+
+async def aget_embedding(text: str) -> list[float]:
+    vector = embedding_cache.get(text)
+    if vector is None:
+        vector = embedding_cache.put(text, await embedding_client.aembed(text))
+    return vector.tolist()
+
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Embed many texts, sending only the cache misses to Azure OpenAI."""
+    vectors = [embedding_cache.get(text) for text in texts]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = embedding_client.embed_many([texts[i] for i in missing])
+        for i, vector in zip(missing, fresh):
+            vectors[i] = embedding_cache.put(texts[i], vector)
+    return [vector.tolist() for vector in vectors]
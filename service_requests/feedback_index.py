@@ -0,0 +1,322 @@
+"""
+In-process vector index over Service_Feedback for the Feedback Explorer.
+
+With `FEEDBACK_INDEX_ENABLED=true` the explorer answers searches from this index
+instead of running `vector_distance` over the table in Azure SQL:
+
+- feedback vectors are kept unit-normalized in one contiguous float32 matrix,
+  memory-mapped from `FEEDBACK_INDEX_DIR` (vectors.f32), so a restart reopens the
+  snapshot instead of re-reading every vector from the database;
+- feedback_id, customer_id, schedule_id, the five ratings (int8) and
+  feedback_date are columnar arrays (columns.npz), so rating filters are one
+  vectorized mask;
+- a search is one matrix-vector product over the rows that pass the filters and
+  an argpartition for the top N; cosine distance is 1 - dot product, as in
+  `vector_distance('cosine', ...)`;
+- `sync` appends the rows with a feedback_id above the snapshot's watermark. When
+  the number of vectors at or below the watermark no longer matches (rows
+  deleted, or vectors added to older rows by `feedback_ingest.py reembed
+  --only-missing`) the index is rebuilt. Vectors re-embedded in place are not
+  detected; rebuild after a re-embed with `rebuild`.
+
+feedback_text is not held in memory; callers fetch it for the returned ids with
+`feedback_texts`. `python -m benchmarks.feedback_index_bench` compares search
+latency and memory against the SQL path.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from dotenv import load_dotenv
+
+from service_requests.feedback_schema import FEEDBACK_VECTOR_DIMENSIONS, RATING_COLUMNS
+
+load_dotenv()
+
+feedback_index_enabled = os.getenv("FEEDBACK_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+feedback_index_dir = os.getenv("FEEDBACK_INDEX_DIR", os.path.join(".cache", "feedback_index"))
+# Minimum seconds between two syncs with the table
+feedback_index_sync_seconds = float(os.getenv("FEEDBACK_INDEX_SYNC_SECONDS", "30"))
+feedback_index_page_rows = int(os.getenv("FEEDBACK_INDEX_PAGE_ROWS", "5000"))
+
+RATING_NAMES = list(RATING_COLUMNS)
+# Stored for a NULL rating (or id); greater than any rating, so `rating <= max` excludes it as SQL does
+RATING_NULL = 127
+ID_NULL = -1
+LATENCY_WINDOW = 1000
+# Below this fraction of passing rows, only the passing rows are multiplied
+SELECTIVE_FRACTION = 0.25
+
+SYNC_SQL = f"""
+SELECT TOP ({{rows}}) feedback_id, customer_id, schedule_id, {", ".join(RATING_NAMES)}, feedback_date,
+    CAST(feedback_vector AS nvarchar(max))
+FROM Service_Feedback
+WHERE feedback_id > ? AND feedback_vector IS NOT NULL
+ORDER BY feedback_id
+"""
+
+COUNT_SQL = "SELECT COUNT(*) FROM Service_Feedback WHERE feedback_id <= ? AND feedback_vector IS NOT NULL"
+
+
+def _empty_columns() -> dict[str, np.ndarray]:
+    return {
+        "feedback_id": np.zeros(0, dtype=np.int64),
+        "customer_id": np.zeros(0, dtype=np.int64),
+        "schedule_id": np.zeros(0, dtype=np.int64),
+        "ratings": np.zeros((0, len(RATING_NAMES)), dtype=np.int8),
+        "feedback_date": np.zeros(0, dtype="datetime64[D]"),
+    }
+
+
+def columns_from_rows(rows: list[tuple]) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """Columns and the vector matrix for rows in SYNC_SQL order."""
+    null_id = lambda value: ID_NULL if value is None else value  # noqa: E731
+    n = len(RATING_NAMES)
+    columns = {
+        "feedback_id": np.array([r[0] for r in rows], dtype=np.int64),
+        "customer_id": np.array([null_id(r[1]) for r in rows], dtype=np.int64),
+        "schedule_id": np.array([null_id(r[2]) for r in rows], dtype=np.int64),
+        "ratings": np.array(
+            [[RATING_NULL if v is None else v for v in r[3 : 3 + n]] for r in rows], dtype=np.int8
+        ).reshape(len(rows), n),
+        "feedback_date": np.array([r[3 + n] for r in rows], dtype="datetime64[D]"),
+    }
+    vectors = np.array([json.loads(r[4 + n]) for r in rows], dtype=np.float32)
+    return columns, vectors
+
+
+def feedback_texts(pool, feedback_ids: list[int]) -> dict[int, str]:
+    """feedback_text of the given rows, by feedback_id."""
+    if not feedback_ids:
+        return {}
+    placeholders = ", ".join("?" for _ in feedback_ids)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT feedback_id, feedback_text FROM Service_Feedback WHERE feedback_id IN ({placeholders})",
+            feedback_ids,
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return {feedback_id: text for feedback_id, text in rows}
+
+
+class FeedbackIndex:
+    def __init__(self, index_dir: str = feedback_index_dir, dimensions: int = FEEDBACK_VECTOR_DIMENSIONS):
+        self.index_dir = index_dir
+        self.dimensions = dimensions
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+        self.columns_path = os.path.join(index_dir, "columns.npz")
+        self.meta_path = os.path.join(index_dir, "meta.json")
+        # (vectors, columns) as one attribute: replaced together, read together by `search`
+        self._snapshot = (np.zeros((0, dimensions), dtype=np.float32), _empty_columns())
+        self.watermark = 0
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._searches = 0
+        self._syncs = 0
+        self._rebuilds = 0
+        self._last_sync_rows = 0
+        self._last_sync_seconds = 0.0
+        self.load()
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._snapshot[0]
+
+    @property
+    def columns(self) -> dict[str, np.ndarray]:
+        return self._snapshot[1]
+
+    @property
+    def count(self) -> int:
+        return len(self.columns["feedback_id"])
+
+    # ── snapshot ────────────────────────────────────────────────
+
+    def load(self) -> bool:
+        """Open the snapshot in index_dir; False (and an empty index) when there is none."""
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with np.load(self.columns_path) as data:
+                columns = {name: data[name] for name in data.files}
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+        if meta.get("dimensions") != self.dimensions or len(columns["feedback_id"]) != meta["count"]:
+            return False
+        self._snapshot = (self._map(meta["count"]), columns)
+        self.watermark = meta["watermark"]
+        return True
+
+    def _map(self, count: int) -> np.ndarray:
+        if not count:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dimensions))
+
+    def _write_meta(self):
+        tmp = self.columns_path + ".tmp.npz"
+        np.savez(tmp, **self.columns)
+        os.replace(tmp, self.columns_path)
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"count": self.count, "dimensions": self.dimensions, "watermark": self.watermark}, f)
+        os.replace(tmp, self.meta_path)
+
+    def append(self, columns: dict[str, np.ndarray], vectors) -> int:
+        """Add rows (ascending feedback_id above the watermark) and persist the snapshot."""
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        if not len(matrix):
+            return 0
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        os.makedirs(self.index_dir, exist_ok=True)
+        count = self.count
+        # Rows past the recorded count (an interrupted append) are overwritten
+        with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+            f.truncate(count * self.dimensions * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(matrix.tobytes())
+        merged = {name: np.concatenate([self.columns[name], columns[name]]) for name in self.columns}
+        vectors = self._map(count + len(matrix))
+        # Searches read the snapshot once, so they see either the old or the new rows
+        self._snapshot = (vectors, merged)
+        self.watermark = int(merged["feedback_id"][-1])
+        self._write_meta()
+        return len(matrix)
+
+    def clear(self):
+        self._snapshot = (np.zeros((0, self.dimensions), dtype=np.float32), _empty_columns())
+        self.watermark = 0
+        for path in (self.vectors_path, self.columns_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.vectors_path, self.columns_path) if os.path.exists(p))
+
+    # ── sync with Service_Feedback ──────────────────────────────
+
+    def sync(self, pool, page_rows: int = feedback_index_page_rows) -> dict:
+        """Append rows added since the watermark; rebuild when older rows changed."""
+        started = time.perf_counter()
+        with self._lock:
+            rebuilt = False
+            if self.count:
+                with pool.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.execute(COUNT_SQL, (self.watermark,))
+                    (indexed,) = cursor.fetchone()
+                    cursor.close()
+                if indexed != self.count:
+                    print(f"feedback index: {indexed} vectors in the table up to {self.watermark}, {self.count} indexed; rebuilding")
+                    self.clear()
+                    self._rebuilds += 1
+                    rebuilt = True
+            added = 0
+            while True:
+                with pool.connection() as connection:
+                    cursor = connection.cursor()
+                    cursor.execute(SYNC_SQL.format(rows=int(page_rows)), (self.watermark,))
+                    rows = cursor.fetchall()
+                    cursor.close()
+                if not rows:
+                    break
+                added += self.append(*columns_from_rows(rows))
+            self._syncs += 1
+            self._last_sync = time.monotonic()
+            self._last_sync_rows = added
+            self._last_sync_seconds = time.perf_counter() - started
+        return {"added": added, "rebuilt": rebuilt, "rows": self.count, "seconds": self._last_sync_seconds}
+
+    def sync_if_due(self, pool, max_age: float = feedback_index_sync_seconds) -> dict | None:
+        if self._last_sync and time.monotonic() - self._last_sync < max_age:
+            return None
+        return self.sync(pool)
+
+    def rebuild(self, pool) -> dict:
+        with self._lock:
+            self.clear()
+            self._rebuilds += 1
+        return self.sync(pool)
+
+    # ── search ──────────────────────────────────────────────────
+
+    def search(
+        self,
+        embedding,
+        rating_filters: dict[str, int | None],
+        distance_threshold: float | None,
+        top_n: int,
+    ) -> list[dict]:
+        """Nearest rows first, with the explorer's SQL columns except feedback_text, plus `distance`."""
+        started = time.perf_counter()
+        vectors, columns = self._snapshot
+        count = len(columns["feedback_id"])
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        mask = None
+        for col, max_val in rating_filters.items():
+            if max_val is not None:
+                passing = columns["ratings"][:count, RATING_NAMES.index(col)] <= max_val
+                mask = passing if mask is None else mask & passing
+        if mask is None:
+            rows = np.arange(count)
+            distances = 1.0 - vectors[:count] @ query
+        else:
+            rows = np.flatnonzero(mask)
+            if len(rows) < SELECTIVE_FRACTION * count:
+                distances = 1.0 - vectors[rows] @ query
+            else:
+                distances = (1.0 - vectors[:count] @ query)[rows]
+        if distance_threshold is not None:
+            keep = distances <= distance_threshold
+            rows, distances = rows[keep], distances[keep]
+        if len(rows) > top_n:
+            nearest = np.argpartition(distances, top_n - 1)[:top_n]
+            rows, distances = rows[nearest], distances[nearest]
+        order = np.argsort(distances, kind="stable")
+        rows, distances = rows[order], distances[order]
+
+        results = []
+        for row, distance in zip(rows.tolist(), distances.tolist()):
+            record = {
+                "feedback_id": int(columns["feedback_id"][row]),
+                "customer_id": None if columns["customer_id"][row] == ID_NULL else int(columns["customer_id"][row]),
+                "schedule_id": None if columns["schedule_id"][row] == ID_NULL else int(columns["schedule_id"][row]),
+            }
+            for name, value in zip(RATING_NAMES, columns["ratings"][row].tolist()):
+                record[name] = None if value == RATING_NULL else value
+            date = columns["feedback_date"][row]
+            record["feedback_date"] = None if np.isnat(date) else date.item()
+            record["distance"] = distance
+            results.append(record)
+        self._searches += 1
+        self._latencies.append(time.perf_counter() - started)
+        return results
+
+    def metrics(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            "rows": self.count,
+            "dimensions": self.dimensions,
+            "watermark": self.watermark,
+            "index_bytes": self.size_bytes(),
+            "syncs": self._syncs,
+            "rebuilds": self._rebuilds,
+            "last_sync_rows": self._last_sync_rows,
+            "last_sync_seconds": self._last_sync_seconds,
+            "searches": self._searches,
+            "search_ms_p50": percentile(0.50),
+            "search_ms_p95": percentile(0.95),
+            "search_ms_p99": percentile(0.99),
+        }
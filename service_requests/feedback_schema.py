@@ -0,0 +1,19 @@
+"""
+Column layout of the Service_Feedback table (see scripts/db-create.sql), shared by
+the feedback tool, the Feedback Explorer and the bulk ingest pipeline.
+"""
+
+# Rating columns in Service_Feedback, each constrained to 1..5
+RATING_COLUMNS = {
+    "rating_overall_experience": "Overall Experience",
+    "rating_quality_of_work": "Quality of Work",
+    "rating_timeliness": "Timeliness",
+    "rating_politeness": "Politeness",
+    "rating_cleanliness": "Cleanliness",
+}
+
+RATING_MIN = 1
+RATING_MAX = 5
+
+# Dimensions of the feedback_vector VECTOR column
+FEEDBACK_VECTOR_DIMENSIONS = 1536
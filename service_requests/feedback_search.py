@@ -0,0 +1,300 @@
+"""
+Exact and approximate (DiskANN) vector search over Service_Feedback.
+
+`exact` is the Feedback Explorer's original query: `vector_distance` over every
+row that passes the rating filters, ordered by distance.
+
+`approximate` reads the nearest rows from the DiskANN index created by
+scripts/feedback-vector-index.sql through `VECTOR_SEARCH`, which ranks the whole
+table, so rating filters and the distance threshold are applied to its
+candidates after retrieval:
+
+- the first request asks for top_n * `FEEDBACK_ANN_OVERFETCH` candidates divided
+  by the share of rows passing the rating filters (from a histogram of the rating
+  columns cached for `FEEDBACK_STATS_TTL_SECONDS`);
+- while fewer than top_n candidates pass and the farthest one is still within
+  the distance threshold, the candidates are doubled, up to
+  `FEEDBACK_ANN_MAX_CANDIDATES`;
+- the exact query is used instead when the table holds fewer than
+  `FEEDBACK_ANN_MIN_ROWS` vectors, when less than `FEEDBACK_ANN_MIN_SELECTIVITY`
+  of the rows pass the filters, or when the candidates run out first.
+
+`search` follows `FEEDBACK_SEARCH_MODE` (exact | approximate). With
+`FEEDBACK_ANN_RECALL_SAMPLE` > 0 that share of approximate searches is repeated
+exactly in the background, and recall@k against the exact result is reported by
+`metrics()`; `python -m benchmarks.feedback_ann_recall` measures it over a batch
+of queries.
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from service_requests.feedback_index import RATING_NAMES, RATING_NULL, feedback_texts
+from service_requests.feedback_schema import FEEDBACK_VECTOR_DIMENSIONS
+from service_requests.vector_codec import vector_to_json
+
+load_dotenv()
+
+feedback_search_mode = os.getenv("FEEDBACK_SEARCH_MODE", "exact").lower()
+feedback_ann_min_rows = int(os.getenv("FEEDBACK_ANN_MIN_ROWS", "20000"))
+feedback_ann_overfetch = float(os.getenv("FEEDBACK_ANN_OVERFETCH", "2"))
+feedback_ann_max_candidates = int(os.getenv("FEEDBACK_ANN_MAX_CANDIDATES", "2000"))
+feedback_ann_min_selectivity = float(os.getenv("FEEDBACK_ANN_MIN_SELECTIVITY", "0.02"))
+feedback_ann_recall_sample = float(os.getenv("FEEDBACK_ANN_RECALL_SAMPLE", "0"))
+feedback_stats_ttl_seconds = float(os.getenv("FEEDBACK_STATS_TTL_SECONDS", "300"))
+
+# Columns of a search result, in the order of the explorer's SQL query
+RESULT_COLUMNS = [
+    "feedback_id",
+    "customer_id",
+    "schedule_id",
+    "feedback_text",
+    "rating_quality_of_work",
+    "rating_timeliness",
+    "rating_politeness",
+    "rating_cleanliness",
+    "rating_overall_experience",
+    "feedback_date",
+    "distance",
+]
+RECALL_WINDOW = 200
+
+EXACT_SQL = f"""
+DECLARE @embedding_json nvarchar(max) = ?;
+DECLARE @e vector({FEEDBACK_VECTOR_DIMENSIONS}) = CAST(@embedding_json AS vector({FEEDBACK_VECTOR_DIMENSIONS}));
+
+SELECT TOP ({{top_n}})
+    {", ".join("sf." + name for name in RESULT_COLUMNS[:-1])},
+    vector_distance('cosine', @e, sf.feedback_vector) AS distance
+FROM Service_Feedback sf
+WHERE
+    {{where}}
+ORDER BY distance;
+"""
+
+ANN_SQL = f"""
+DECLARE @embedding_json nvarchar(max) = ?;
+DECLARE @e vector({FEEDBACK_VECTOR_DIMENSIONS}) = CAST(@embedding_json AS vector({FEEDBACK_VECTOR_DIMENSIONS}));
+
+SELECT t.feedback_id, t.customer_id, t.schedule_id, {", ".join("t." + name for name in RATING_NAMES)},
+    t.feedback_date, s.distance
+FROM VECTOR_SEARCH(
+    TABLE = Service_Feedback AS t,
+    COLUMN = feedback_vector,
+    SIMILAR_TO = @e,
+    METRIC = 'cosine',
+    TOP_N = {{candidates}}
+) AS s
+ORDER BY s.distance;
+"""
+
+STATS_SQL = f"""
+SELECT {", ".join(RATING_NAMES)}, COUNT(*)
+FROM Service_Feedback
+WHERE feedback_vector IS NOT NULL
+GROUP BY {", ".join(RATING_NAMES)}
+"""
+
+
+def passes(record: dict, rating_filters: dict[str, int | None], distance_threshold: float | None) -> bool:
+    """The exact query's WHERE clause for one candidate (a NULL rating never passes a filter)."""
+    if distance_threshold is not None and record["distance"] > distance_threshold:
+        return False
+    for col, max_val in rating_filters.items():
+        if max_val is not None and (record[col] is None or record[col] > max_val):
+            return False
+    return True
+
+
+def recall_at_k(found: list[dict], expected: list[dict]) -> float:
+    if not expected:
+        return 1.0
+    return len({r["feedback_id"] for r in found} & {r["feedback_id"] for r in expected}) / len(expected)
+
+
+class FeedbackSearch:
+    def __init__(
+        self,
+        pool,
+        mode: str = feedback_search_mode,
+        min_rows: int = feedback_ann_min_rows,
+        overfetch: float = feedback_ann_overfetch,
+        max_candidates: int = feedback_ann_max_candidates,
+        min_selectivity: float = feedback_ann_min_selectivity,
+        recall_sample: float = feedback_ann_recall_sample,
+    ):
+        self.pool = pool
+        self.mode = mode
+        self.min_rows = min_rows
+        self.overfetch = overfetch
+        self.max_candidates = max_candidates
+        self.min_selectivity = min_selectivity
+        self.recall_sample = recall_sample
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stats_loaded = 0.0
+        self._paths = Counter()
+        self._candidates = deque(maxlen=RECALL_WINDOW)
+        self._recalls = deque(maxlen=RECALL_WINDOW)
+        self._recall_executor = None
+
+    # ── rating statistics ───────────────────────────────────────
+
+    def rating_stats(self) -> tuple[np.ndarray, np.ndarray]:
+        """(rating combinations, row counts) of the rows with a vector, cached."""
+        with self._lock:
+            if self._stats is not None and time.monotonic() - self._stats_loaded < feedback_stats_ttl_seconds:
+                return self._stats
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(STATS_SQL)
+            rows = cursor.fetchall()
+            cursor.close()
+        ratings = np.array(
+            [[RATING_NULL if v is None else v for v in row[:-1]] for row in rows], dtype=np.int8
+        ).reshape(len(rows), len(RATING_NAMES))
+        counts = np.array([row[-1] for row in rows], dtype=np.int64)
+        with self._lock:
+            self._stats = (ratings, counts)
+            self._stats_loaded = time.monotonic()
+        return self._stats
+
+    def selectivity(self, rating_filters: dict[str, int | None]) -> tuple[int, float]:
+        """Rows with a vector, and the share of them passing the rating filters."""
+        ratings, counts = self.rating_stats()
+        total = int(counts.sum())
+        mask = np.ones(len(counts), dtype=bool)
+        for col, max_val in rating_filters.items():
+            if max_val is not None:
+                mask &= ratings[:, RATING_NAMES.index(col)] <= max_val
+        return total, (int(counts[mask].sum()) / total if total else 0.0)
+
+    # ── search paths ────────────────────────────────────────────
+
+    def exact(
+        self,
+        embedding,
+        rating_filters: dict[str, int | None],
+        distance_threshold: float | None,
+        top_n: int,
+    ) -> list[dict]:
+        """The explorer's vector_distance query over every matching row."""
+        params = [vector_to_json(embedding)]
+        where_clauses = ["sf.feedback_vector IS NOT NULL"]
+        if distance_threshold is not None:
+            where_clauses.append(f"vector_distance('cosine', @e, sf.feedback_vector) <= {float(distance_threshold)}")
+        for col, max_val in rating_filters.items():
+            if max_val is not None:
+                where_clauses.append(f"sf.{col} <= ?")
+                params.append(max_val)
+        sql = EXACT_SQL.format(top_n=int(top_n), where="\n    AND ".join(where_clauses))
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = [desc[0] for desc in cursor.description]
+            cursor.close()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _candidates_query(self, embedding, candidates: int) -> list[dict]:
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(ANN_SQL.format(candidates=int(candidates)), (vector_to_json(embedding),))
+            rows = cursor.fetchall()
+            columns = [desc[0] for desc in cursor.description]
+            cursor.close()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def approximate(
+        self,
+        embedding,
+        rating_filters: dict[str, int | None],
+        distance_threshold: float | None,
+        top_n: int,
+        fallback: bool = True,
+    ) -> tuple[list[dict], dict]:
+        """Top rows from the DiskANN index, filtered after retrieval; (results, how they were found)."""
+        total, share = self.selectivity(rating_filters)
+        info = {"path": "approximate", "rows": total, "selectivity": share, "candidates": 0, "rounds": 0}
+        if fallback and total < self.min_rows:
+            return self.exact(embedding, rating_filters, distance_threshold, top_n), {**info, "path": "exact", "reason": "small table"}
+        if fallback and share < self.min_selectivity:
+            return self.exact(embedding, rating_filters, distance_threshold, top_n), {**info, "path": "exact", "reason": "selective filters"}
+
+        candidates = min(self.max_candidates, math.ceil(top_n * self.overfetch / max(share, 1e-6)))
+        while True:
+            info["rounds"] += 1
+            info["candidates"] = candidates
+            rows = self._candidates_query(embedding, candidates)
+            matches = [r for r in rows if passes(r, rating_filters, distance_threshold)][:top_n]
+            exhausted = len(rows) < candidates
+            beyond_threshold = distance_threshold is not None and bool(rows) and rows[-1]["distance"] > distance_threshold
+            if len(matches) >= top_n or exhausted or beyond_threshold:
+                break
+            if candidates >= self.max_candidates:
+                if fallback:
+                    return self.exact(embedding, rating_filters, distance_threshold, top_n), {
+                        **info,
+                        "path": "exact",
+                        "reason": "candidates exhausted",
+                    }
+                break
+            candidates = min(self.max_candidates, candidates * 2)
+
+        texts = feedback_texts(self.pool, [r["feedback_id"] for r in matches])
+        results = [{**r, "feedback_text": texts.get(r["feedback_id"])} for r in matches]
+        return [{name: r[name] for name in RESULT_COLUMNS} for r in results], info
+
+    def search(
+        self,
+        embedding,
+        rating_filters: dict[str, int | None],
+        distance_threshold: float | None,
+        top_n: int,
+        mode: str | None = None,
+    ) -> tuple[list[dict], dict]:
+        mode = mode or self.mode
+        if mode != "approximate":
+            results, info = self.exact(embedding, rating_filters, distance_threshold, top_n), {"path": "exact", "reason": "requested"}
+        else:
+            results, info = self.approximate(embedding, rating_filters, distance_threshold, top_n)
+        with self._lock:
+            self._paths[f"{info['path']}:{info.get('reason', 'index')}"] += 1
+            if info["path"] == "approximate":
+                self._candidates.append(info["candidates"])
+        if info["path"] == "approximate" and self.recall_sample > 0 and random.random() < self.recall_sample:
+            if self._recall_executor is None:
+                self._recall_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feedback-recall")
+            self._recall_executor.submit(self._check_recall, embedding, rating_filters, distance_threshold, top_n, results)
+        return results, info
+
+    def _check_recall(self, embedding, rating_filters, distance_threshold, top_n, results):
+        try:
+            expected = self.exact(embedding, rating_filters, distance_threshold, top_n)
+        except Exception as e:
+            print(f"feedback recall check failed: {e}")
+            return
+        with self._lock:
+            self._recalls.append(recall_at_k(results, expected))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            recalls = list(self._recalls)
+            candidates = list(self._candidates)
+            paths = dict(self._paths)
+        return {
+            "mode": self.mode,
+            "paths": paths,
+            "mean_candidates": sum(candidates) / len(candidates) if candidates else 0.0,
+            "recall_checks": len(recalls),
+            "recall_at_k": sum(recalls) / len(recalls) if recalls else None,
+            "recall_at_k_min": min(recalls) if recalls else None,
+        }
@@ -0,0 +1,227 @@
+"""
+History policy for the messages sent to the LLM.
+
+`State.messages` keeps the full conversation (it is what the checkpointer stores),
+but each assistant call only needs a bounded view of it. `HistoryPolicy.apply`
+builds that view:
+
+* the last `HISTORY_KEEP_TURNS` customer turns are kept verbatim, except that tool
+  outputs from earlier turns (already answered) are cut to
+  `HISTORY_TOOL_PAYLOAD_CHARS` characters;
+* everything older is replaced by one rolling summary message: completed
+  sub-agent episodes (from the delegation to `CompleteOrEscalate`) become one line
+  with the request, the tool outcomes and the closing reason, other turns become
+  the customer's message and the assistant's reply, shortened. The summary keeps
+  its newest lines within `HISTORY_SUMMARY_TOKEN_BUDGET` tokens.
+
+The view never separates an assistant tool call from its tool results, so it is
+always a valid chat sequence. The summary is extractive, no extra LLM call is made.
+"""
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+from service_requests.token_count import count_tokens
+
+load_dotenv()
+
+history_keep_turns = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+history_tool_payload_chars = int(os.getenv("HISTORY_TOOL_PAYLOAD_CHARS", "300"))
+history_summary_token_budget = int(os.getenv("HISTORY_SUMMARY_TOKEN_BUDGET", "300"))
+
+SUMMARY_LINE_CHARS = 160
+SUMMARY_HEADER = "Summary of the earlier conversation (older messages are not shown):"
+
+
+def _text(message: AnyMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+def _shorten(text: str, limit: int = SUMMARY_LINE_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def message_tokens(messages: list[AnyMessage]) -> int:
+    """Approximate prompt tokens of a message list (content plus tool call arguments)."""
+    total = 0
+    for message in messages:
+        total += 4 + count_tokens(_text(message))
+        for call in getattr(message, "tool_calls", None) or []:
+            total += count_tokens(call["name"]) + count_tokens(json.dumps(call["args"], default=str))
+    return total
+
+
+@dataclass
+class _Episode:
+    """A delegation to a specialist assistant, from its entry tool call to CompleteOrEscalate."""
+
+    start: int
+    end: int | None
+    assistant: str
+    request: str
+
+
+class HistoryPolicy:
+    def __init__(
+        self,
+        entry_tools: dict[str, str],
+        exit_tool: str = "CompleteOrEscalate",
+        keep_turns: int = history_keep_turns,
+        tool_payload_chars: int = history_tool_payload_chars,
+        summary_token_budget: int = history_summary_token_budget,
+    ):
+        """`entry_tools` maps each delegation tool name (e.g. ToServiceScheduler) to the specialist's name."""
+        self.entry_tools = entry_tools
+        self.exit_tool = exit_tool
+        self.keep_turns = keep_turns
+        self.tool_payload_chars = tool_payload_chars
+        self.summary_token_budget = summary_token_budget
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "tokens_before": 0, "tokens_after": 0}
+
+    # ── structure ───────────────────────────────────────────────
+
+    def _episodes(self, messages: list[AnyMessage]) -> list[_Episode]:
+        episodes = []
+        current = None
+        for index, message in enumerate(messages):
+            if not isinstance(message, AIMessage):
+                continue
+            for call in message.tool_calls or []:
+                if call["name"] in self.entry_tools and current is None:
+                    args = call.get("args") or {}
+                    request = args.get("request") or args.get("query") or ""
+                    current = _Episode(index, None, self.entry_tools[call["name"]], str(request))
+                    episodes.append(current)
+                elif call["name"] == self.exit_tool and current is not None:
+                    # The episode ends with the ToolMessage answering this call (from leave_skill)
+                    end = index
+                    while end + 1 < len(messages) and isinstance(messages[end + 1], ToolMessage):
+                        end += 1
+                    current.end = end
+                    current = None
+        return episodes
+
+    def _episode_line(self, messages: list[AnyMessage], episode: _Episode) -> str:
+        calls = {}
+        outcomes = []
+        customer_messages = 0
+        reason = ""
+        for message in messages[episode.start : episode.end + 1]:
+            if isinstance(message, HumanMessage):
+                customer_messages += 1
+            elif isinstance(message, AIMessage):
+                for call in message.tool_calls or []:
+                    calls[call["id"]] = call["name"]
+                    if call["name"] == self.exit_tool:
+                        reason = str((call.get("args") or {}).get("reason", ""))
+            elif isinstance(message, ToolMessage):
+                name = calls.get(message.tool_call_id)
+                if name and name not in self.entry_tools and name != self.exit_tool:
+                    first_line = _text(message).strip().splitlines()[0] if _text(message).strip() else ""
+                    outcomes.append(f"{name}: {_shorten(first_line, 100)}")
+        parts = [f"{episode.assistant} handled '{_shorten(episode.request, 100)}'"]
+        if customer_messages:
+            parts.append(f"{customer_messages} customer message(s)")
+        if outcomes:
+            parts.append("results: " + "; ".join(outcomes[-3:]))
+        if reason:
+            parts.append(f"closed: {_shorten(reason, 80)}")
+        return " | ".join(parts)
+
+    def _summary_lines(self, messages: list[AnyMessage], episodes: list[_Episode]) -> list[str]:
+        by_start = {e.start: e for e in episodes}
+        lines = []
+        index = 0
+        while index < len(messages):
+            episode = by_start.get(index)
+            if episode is not None and episode.end is not None and episode.end < len(messages):
+                lines.append(self._episode_line(messages, episode))
+                index = episode.end + 1
+                continue
+            message = messages[index]
+            if episode is not None:
+                lines.append(f"{episode.assistant} is handling '{_shorten(episode.request, 100)}'")
+            elif isinstance(message, HumanMessage):
+                lines.append(f"Customer: {_shorten(_text(message))}")
+            elif isinstance(message, AIMessage) and _text(message).strip():
+                lines.append(f"Assistant: {_shorten(_text(message))}")
+            index += 1
+        return lines
+
+    def _budget(self, lines: list[str]) -> list[str]:
+        """Keep the newest lines within the summary token budget."""
+        kept = []
+        used = count_tokens(SUMMARY_HEADER)
+        for line in reversed(lines):
+            tokens = count_tokens(line) + 1
+            if used + tokens > self.summary_token_budget:
+                break
+            kept.append(line)
+            used += tokens
+        kept.reverse()
+        omitted = len(lines) - len(kept)
+        if omitted:
+            kept.insert(0, f"({omitted} earlier item(s) omitted)")
+        return kept
+
+    # ── view ────────────────────────────────────────────────────
+
+    def apply(self, messages: list[AnyMessage]) -> list[AnyMessage]:
+        """Bounded view of `messages` for one LLM call."""
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if not turn_starts:
+            return list(messages)
+        keep = max(1, self.keep_turns)
+        cutoff = turn_starts[-keep] if len(turn_starts) >= keep else 0
+        current_turn = turn_starts[-1]
+
+        view = []
+        if cutoff > 0:
+            older = messages[:cutoff]
+            lines = self._budget(self._summary_lines(older, self._episodes(older)))
+            if lines:
+                view.append(SystemMessage(content=SUMMARY_HEADER + "\n" + "\n".join(lines)))
+
+        for index in range(cutoff, len(messages)):
+            message = messages[index]
+            if (
+                index < current_turn
+                and isinstance(message, ToolMessage)
+                and len(_text(message)) > self.tool_payload_chars
+            ):
+                text = _text(message)
+                message = message.model_copy(
+                    update={
+                        "content": text[: self.tool_payload_chars]
+                        + f" … [{len(text) - self.tool_payload_chars} characters of an earlier tool result omitted]"
+                    }
+                )
+            view.append(message)
+        return view
+
+    def apply_and_log(self, messages: list[AnyMessage], label: str = "") -> list[AnyMessage]:
+        view = self.apply(messages)
+        before, after = message_tokens(messages), message_tokens(view)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["tokens_before"] += before
+            self._stats["tokens_after"] += after
+        print(
+            f"history{' for ' + label if label else ''}: {len(messages)} messages / {before} tokens"
+            f" -> {len(view)} messages / {after} tokens"
+        )
+        return view
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,138 @@
+"""
+Local intent router for the first message of a task.
+
+Every turn that starts in the primary assistant costs a GPT-4o call whose only job is
+to pick ToServiceScheduler, ToSearchQnA or ToServiceFeedback. `IntentRouter` is a
+nearest-centroid classifier over TF-IDF features (words, word pairs and character
+4-grams, so small typos still match) trained from the labelled utterances in
+documents/intents/train.jsonl. It classifies in well under a millisecond without
+any network call.
+
+A message is routed directly only when the best centroid scores at least
+`INTENT_ROUTER_MIN_SCORE` and beats the runner-up by `INTENT_ROUTER_MIN_MARGIN`;
+greetings, out-of-scope requests ("other") and anything uncertain fall back to the
+primary assistant. `python -m benchmarks.intent_router_eval` reports accuracy,
+coverage and latency on documents/intents/eval.jsonl.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+intent_router_enabled = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+intent_router_min_score = float(os.getenv("INTENT_ROUTER_MIN_SCORE", "0.2"))
+intent_router_min_margin = float(os.getenv("INTENT_ROUTER_MIN_MARGIN", "0.1"))
+intent_train_path = os.getenv(
+    "INTENT_TRAIN_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "documents", "intents", "train.jsonl"),
+)
+
+FALLBACK_INTENT = "other"
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def load_utterances(path: str) -> list[tuple[str, str]]:
+    """(text, intent) pairs from a JSON-lines file of {"text": ..., "intent": ...}."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(record["text"], record["intent"]) for record in records]
+
+
+def features(text: str) -> Counter:
+    words = _WORD.findall(text.lower())
+    grams = Counter(words)
+    grams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f" {word} "
+        if len(padded) > 4:
+            grams.update(f"#{padded[i:i + 4]}" for i in range(len(padded) - 3))
+    return grams
+
+
+@dataclass
+class Prediction:
+    intent: str
+    score: float
+    margin: float
+    confident: bool
+
+
+class IntentRouter:
+    def __init__(
+        self,
+        utterances: list[tuple[str, str]],
+        min_score: float = intent_router_min_score,
+        min_margin: float = intent_router_min_margin,
+    ):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.intents = sorted({intent for _, intent in utterances})
+
+        documents = [features(text) for text, _ in utterances]
+        document_frequency = Counter(gram for document in documents for gram in document)
+        self.vocabulary = {gram: i for i, gram in enumerate(sorted(document_frequency))}
+        self.idf = np.array(
+            [math.log((1 + len(documents)) / (1 + document_frequency[g])) + 1 for g in sorted(document_frequency)],
+            dtype=np.float32,
+        )
+
+        centroids = np.zeros((len(self.intents), len(self.vocabulary)), dtype=np.float32)
+        for document, (_, intent) in zip(documents, utterances):
+            centroids[self.intents.index(intent)] += self._vector(document)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = centroids / np.maximum(norms, 1e-12)
+
+        self._lock = threading.Lock()
+        self._stats = {"classified": 0, "routed": 0, **{f"routed_{i}": 0 for i in self.intents}}
+
+    def _vector(self, document: Counter) -> np.ndarray:
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for gram, count in document.items():
+            index = self.vocabulary.get(gram)
+            if index is not None:
+                vector[index] = (1 + math.log(count)) * self.idf[index]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def predict(self, text: str) -> Prediction:
+        scores = self.centroids @ self._vector(features(text))
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        intent = self.intents[order[0]]
+        confident = intent != FALLBACK_INTENT and best >= self.min_score and margin >= self.min_margin
+        return Prediction(intent, best, margin, confident)
+
+    def route(self, text: str) -> str | None:
+        """The intent to route `text` to directly, or None to ask the primary assistant."""
+        prediction = self.predict(text)
+        with self._lock:
+            self._stats["classified"] += 1
+            if prediction.confident:
+                self._stats["routed"] += 1
+                self._stats[f"routed_{prediction.intent}"] += 1
+        return prediction.intent if prediction.confident else None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+def load_router(path: str = intent_train_path) -> IntentRouter | None:
+    """Router trained from `path`; None when routing is disabled or the data is missing."""
+    if not intent_router_enabled:
+        return None
+    if not os.path.exists(path):
+        print(f"Intent training data not found at {path}; every turn goes to the primary assistant")
+        return None
+    return IntentRouter(load_utterances(path))
@@ -0,0 +1,334 @@
+"""
+Gateway for the chat model calls made by the assistant nodes.
+
+All four assistants share one Azure OpenAI deployment, and therefore one
+requests-per-minute / tokens-per-minute quota. `LLMGateway` sits in front of every
+assistant call:
+
+- at most `LLM_MAX_CONCURRENT` calls run at once, and when `LLM_TOKENS_PER_MINUTE`
+  is set, calls wait until the estimated prompt plus `LLM_OUTPUT_TOKENS_ESTIMATE`
+  fits in the rolling one-minute budget (actual usage replaces the estimate when the
+  response reports it). Callers that cannot start within `LLM_QUEUE_TIMEOUT_SECONDS`
+  get `LLMOverloaded`;
+- 429, timeout, connection and 5xx errors are retried up to `LLM_MAX_RETRIES`
+  times with jittered exponential backoff, honouring `retry-after-ms` /
+  `Retry-After`. A 429 also pauses new calls from every agent until its
+  Retry-After has passed;
+- an empty response is re-asked at most `LLM_MAX_EMPTY_REASKS` times, then a short
+  apology is returned instead of looping;
+- `metrics()` reports queue depth, in-flight calls, retries and token usage per agent.
+
+The chat model should be created with `max_retries=0` so retries are not hidden
+inside the client.
+"""
+
+import asyncio
+import collections
+import os
+import random
+import threading
+import time
+
+import openai
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage
+
+from service_requests.history_policy import message_tokens
+from service_requests.token_count import count_tokens
+
+load_dotenv()
+
+llm_max_concurrent = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+llm_tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 0 = no client-side TPM budget
+llm_output_tokens_estimate = int(os.getenv("LLM_OUTPUT_TOKENS_ESTIMATE", "400"))
+llm_queue_timeout_seconds = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "60"))
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+llm_max_empty_reasks = int(os.getenv("LLM_MAX_EMPTY_REASKS", "2"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+EMPTY_REPLY_FALLBACK = "Sorry, I could not put together an answer just now. Could you rephrase your request?"
+POLL_SECONDS = 0.05
+
+
+class LLMOverloaded(Exception):
+    """No capacity within the queue timeout; retry the turn after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(error: Exception) -> float | None:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+def _is_empty(result) -> bool:
+    return not result.tool_calls and (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        max_concurrent: int = llm_max_concurrent,
+        tokens_per_minute: int = llm_tokens_per_minute,
+        output_tokens_estimate: int = llm_output_tokens_estimate,
+        queue_timeout: float = llm_queue_timeout_seconds,
+        max_retries: int = llm_max_retries,
+        max_empty_reasks: int = llm_max_empty_reasks,
+    ):
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.output_tokens_estimate = output_tokens_estimate
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.max_empty_reasks = max_empty_reasks
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._window = collections.deque()  # (timestamp, tokens) charged to the last minute
+        self._paused_until = 0.0
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "throttled": 0,
+            "empty_reasks": 0,
+            "empty_fallbacks": 0,
+            "failures": 0,
+            "rejected": 0,
+            "queue_seconds_total": 0.0,
+        }
+        self._agents = collections.defaultdict(
+            lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "retries": 0, "seconds_total": 0.0}
+        )
+
+    # ── budget ──────────────────────────────────────────────────
+
+    def _window_tokens(self, now: float) -> int:
+        while self._window and self._window[0][0] <= now - 60:
+            self._window.popleft()
+        return sum(tokens for _, tokens in self._window)
+
+    def _try_acquire(self, tokens: int):
+        """(entry, 0.0) when the call may start, else (None, seconds to wait before trying again)."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return None, self._paused_until - now
+            if self._in_flight >= self.max_concurrent:
+                return None, POLL_SECONDS
+            if self.tokens_per_minute:
+                used = self._window_tokens(now)
+                # A call larger than the whole budget still runs once the window is empty
+                if used and used + tokens > self.tokens_per_minute:
+                    return None, max(self._window[0][0] + 60 - now, POLL_SECONDS)
+            entry = [now, tokens]
+            self._window.append(entry)
+            self._in_flight += 1
+            return entry, 0.0
+
+    def _release(self, entry: list, actual_tokens: int | None):
+        with self._lock:
+            self._in_flight -= 1
+            if actual_tokens is not None:
+                entry[1] = actual_tokens  # replace the estimate in the window
+
+    def _pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _acquire(self, tokens: int) -> list:
+        started = time.monotonic()
+        with self._lock:
+            self._queued += 1
+        try:
+            while True:
+                entry, wait = self._try_acquire(tokens)
+                if entry is not None:
+                    return entry
+                if time.monotonic() - started + wait > self.queue_timeout:
+                    with self._lock:
+                        self._stats["rejected"] += 1
+                    raise LLMOverloaded("llm_budget", wait)
+                time.sleep(min(wait, 1.0))
+        finally:
+            with self._lock:
+                self._queued -= 1
+                self._stats["queue_seconds_total"] += time.monotonic() - started
+
+    async def _aacquire(self, tokens: int) -> list:
+        started = time.monotonic()
+        with self._lock:
+            self._queued += 1
+        try:
+            while True:
+                entry, wait = self._try_acquire(tokens)
+                if entry is not None:
+                    return entry
+                if time.monotonic() - started + wait > self.queue_timeout:
+                    with self._lock:
+                        self._stats["rejected"] += 1
+                    raise LLMOverloaded("llm_budget", wait)
+                await asyncio.sleep(min(wait, 1.0))
+        finally:
+            with self._lock:
+                self._queued -= 1
+                self._stats["queue_seconds_total"] += time.monotonic() - started
+
+    # ── accounting ──────────────────────────────────────────────
+
+    def _estimate(self, runnable, state) -> int:
+        try:
+            # The prompt template is the first step of each assistant runnable
+            messages = runnable.first.invoke(state).to_messages()
+        except Exception:
+            messages = state.get("messages", [])
+        return message_tokens(messages) + self.output_tokens_estimate
+
+    def _usage(self, agent: str, result, estimate: int, seconds: float) -> int:
+        usage = getattr(result, "usage_metadata", None) or {}
+        input_tokens = usage.get("input_tokens") or estimate - self.output_tokens_estimate
+        output_tokens = usage.get("output_tokens")
+        if output_tokens is None:
+            output_tokens = count_tokens(result.content if isinstance(result.content, str) else str(result.content))
+        with self._lock:
+            self._stats["calls"] += 1
+            stats = self._agents[agent]
+            stats["calls"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["seconds_total"] += seconds
+        return input_tokens + output_tokens
+
+    def _backoff(self, agent: str, error: Exception, attempt: int) -> float:
+        delay = _retry_after_seconds(error)
+        if isinstance(error, openai.RateLimitError):
+            delay = delay if delay is not None else min(2**attempt, 30) * (0.5 + random.random())
+            self._pause(delay)
+            with self._lock:
+                self._stats["throttled"] += 1
+        elif delay is None:
+            delay = min(2**attempt, 30) * (0.5 + random.random())
+        with self._lock:
+            self._stats["retries"] += 1
+            self._agents[agent]["retries"] += 1
+        print(f"LLM call for {agent} failed ({type(error).__name__}); retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+    # ── calls ───────────────────────────────────────────────────
+
+    def invoke(self, agent: str, runnable, state, config=None):
+        """One model call within the budget, retried on throttling and transient errors."""
+        estimate = self._estimate(runnable, state)
+        attempt = 0
+        while True:
+            entry = self._acquire(estimate)
+            started = time.perf_counter()
+            actual = None
+            try:
+                result = runnable.invoke(state, config)
+                actual = self._usage(agent, result, estimate, time.perf_counter() - started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                actual = 0  # a rejected call does not use the token budget
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats["failures"] += 1
+                    raise
+                delay = self._backoff(agent, e, attempt)
+            finally:
+                self._release(entry, actual)
+            attempt += 1
+            time.sleep(delay)
+
+    async def ainvoke(self, agent: str, runnable, state, config=None):
+        estimate = self._estimate(runnable, state)
+        attempt = 0
+        while True:
+            entry = await self._aacquire(estimate)
+            started = time.perf_counter()
+            actual = None
+            try:
+                result = await runnable.ainvoke(state, config)
+                actual = self._usage(agent, result, estimate, time.perf_counter() - started)
+                return result
+            except RETRYABLE_ERRORS as e:
+                actual = 0  # a rejected call does not use the token budget
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats["failures"] += 1
+                    raise
+                delay = self._backoff(agent, e, attempt)
+            finally:
+                self._release(entry, actual)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _reask(self, agent: str, state, reasks: int):
+        """Next state to try after an empty response, or None once the re-ask cap is reached."""
+        if reasks >= self.max_empty_reasks:
+            with self._lock:
+                self._stats["empty_fallbacks"] += 1
+            print(f"{agent} returned no output after {reasks} re-asks; replying with a fallback")
+            return None
+        with self._lock:
+            self._stats["empty_reasks"] += 1
+        return {**state, "messages": state["messages"] + [HumanMessage(content="Respond with a real output.")]}
+
+    def respond(self, agent: str, runnable, state, config=None):
+        """Assistant reply, re-asking a bounded number of times when the model returns nothing."""
+        reasks = 0
+        while True:
+            result = self.invoke(agent, runnable, state, config)
+            if not _is_empty(result):
+                return result
+            state = self._reask(agent, state, reasks)
+            if state is None:
+                return AIMessage(content=EMPTY_REPLY_FALLBACK)
+            reasks += 1
+
+    async def arespond(self, agent: str, runnable, state, config=None):
+        reasks = 0
+        while True:
+            result = await self.ainvoke(agent, runnable, state, config)
+            if not _is_empty(result):
+                return result
+            state = self._reask(agent, state, reasks)
+            if state is None:
+                return AIMessage(content=EMPTY_REPLY_FALLBACK)
+            reasks += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "max_concurrent": self.max_concurrent,
+                "tokens_per_minute_budget": self.tokens_per_minute,
+                "tokens_last_minute": self._window_tokens(now),
+                "paused_seconds": max(0.0, self._paused_until - now),
+                "agents": {agent: dict(stats) for agent, stats in self._agents.items()},
+            }
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,431 @@
+"""
+Local retrieval over the owner's manual, usable in place of Azure AI Search.
+
+With `SEARCH_BACKEND=local`, `perform_search_based_qna` searches an index built
+from `LOCAL_SEARCH_SOURCE` (documents/heromotocorp-sample-understood.md) on this
+machine instead of calling Azure AI Search:
+
+- the manual is chunked by service_requests/manual_chunks.py (headings, page
+  breaks, figure descriptions as separate low-weight chunks);
+- BM25 over the chunks always works offline (rebuilt from chunks.json in
+  milliseconds); each chunk's score is multiplied by its weight;
+- in hybrid mode the BM25 and vector rankings are fused with reciprocal rank
+  fusion, and hits far below the best fused score are dropped;
+- `vehicle_models` limits a search to the chunks of those models (and chunks not
+  tied to a model);
+- with `LOCAL_SEARCH_DENSE=true` the chunks are also embedded and stored as a
+  memory-mapped float32 matrix (vectors.f32), so only the query needs an
+  embedding call. `sync` keeps the vectors of chunks whose id did not change, so
+  re-indexing an edited manual only embeds the edited chunks;
+- the index is written by `python manual_ingest.py --target local` or, when missing
+  or out of date, on first use. Processes reload it when the search index version
+  (search_cache.bump_index_version) changes.
+
+Results have the same shape as Azure AI Search results (`title`, `content`,
+`@search.score`), so the tool shapes them the same way.
+`python -m benchmarks.local_search_bench` reports build time, index size and query
+latency percentiles.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+from dotenv import load_dotenv
+
+from service_requests.manual_chunks import (
+    CHUNKER_VERSION,
+    chunk_manual,
+    manual_chunk_chars,
+    manual_figure_weight,
+    manual_min_chunk_chars,
+    model_key,
+)
+from service_requests.search_cache import VERSION_CHECK_SECONDS, read_index_version
+
+load_dotenv()
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+search_backend = os.getenv("SEARCH_BACKEND", "azure").lower()
+local_search_source = os.getenv(
+    "LOCAL_SEARCH_SOURCE", os.path.join(_PROJECT_ROOT, "documents", "heromotocorp-sample-understood.md")
+)
+local_search_index_dir = os.getenv("LOCAL_SEARCH_INDEX_DIR", os.path.join(".cache", "local_search"))
+local_search_dense = os.getenv("LOCAL_SEARCH_DENSE", "false").lower() in ("1", "true", "yes")
+local_search_rrf_k = int(os.getenv("LOCAL_SEARCH_RRF_K", "60"))
+# Hybrid hits fused below this share of the best fused score are dropped
+local_search_hybrid_min_relative = float(os.getenv("LOCAL_SEARCH_HYBRID_MIN_RELATIVE", "0.5"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+LATENCY_WINDOW = 1000
+# Changing the chunking changes every chunk, so an index built with other settings is rebuilt
+CHUNKING = {
+    "version": CHUNKER_VERSION,
+    "chunk_chars": manual_chunk_chars,
+    "min_chunk_chars": manual_min_chunk_chars,
+    "figure_weight": manual_figure_weight,
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its my of on or should the this to "
+    "what when which with you your "
+    "amp br table td th tr".split()  # markup of the manual's HTML tables
+)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]  # plural folding: tyres -> tyre
+        tokens.append(token)
+    return tokens
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def top_k(scores: np.ndarray, top: int) -> list[tuple[int, float]]:
+    """(row, score) of the `top` highest positive scores, best first."""
+    top = min(top, len(scores))
+    if top <= 0:
+        return []
+    best = np.argpartition(-scores, top - 1)[:top]
+    best = best[np.argsort(-scores[best])]
+    return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[tuple[int, float]]], k: int = local_search_rrf_k
+) -> list[tuple[int, float]]:
+    """Fuse ranked (row, score) lists: each row scores sum(1 / (k + rank)) over the lists it appears in."""
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+# ── BM25 ────────────────────────────────────────────────────────
+
+
+class BM25Index:
+    def __init__(self, documents: list[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        tokenized = [tokenize(document) for document in documents]
+        self.size = len(tokenized)
+        lengths = np.array([len(tokens) for tokens in tokenized], dtype=np.float32)
+        average = float(lengths.mean()) if self.size else 0.0
+        self._norm = k1 * (1 - b + b * lengths / (average or 1.0))
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for doc_id, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+        self._postings = {
+            term: (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32)) for term, (ids, tfs) in postings.items()
+        }
+        self._idf = {
+            term: math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5)) for term, (ids, _) in self._postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            scores[ids] += self._idf[term] * tfs * (self.k1 + 1) / (tfs + self._norm[ids])
+        return scores
+
+
+# ── dense vectors (memory-mapped) ───────────────────────────────
+
+
+class DenseIndex:
+    """Unit-normalized chunk vectors in a memory-mapped float32 matrix."""
+
+    def __init__(self, vectors_path: str, count: int, dimensions: int):
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(count, dimensions))
+
+    @staticmethod
+    def write(vectors_path: str, vectors) -> tuple[int, int]:
+        matrix = np.array(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        out = np.memmap(vectors_path + ".tmp", dtype=np.float32, mode="w+", shape=matrix.shape)
+        out[:] = matrix
+        out.flush()
+        del out
+        os.replace(vectors_path + ".tmp", vectors_path)
+        return matrix.shape
+
+    def scores(self, query_vector) -> np.ndarray:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        return self.vectors @ query
+
+
+# ── index on disk ───────────────────────────────────────────────
+
+
+class LoadedIndex:
+    """One consistent, read-only generation of the index: replaced as a whole on reload."""
+
+    def __init__(self, chunks: list[dict], dense: DenseIndex | None = None):
+        self.chunks = chunks
+        self.weights = np.array([c.get("weight", 1.0) for c in chunks], dtype=np.float32)
+        self.generic = np.array([not c.get("vehicle_models") for c in chunks], dtype=bool)  # chunks for every model
+        self.model_rows: dict[str, np.ndarray] = {}
+        for row, chunk in enumerate(chunks):
+            for model in chunk.get("vehicle_models") or ():
+                self.model_rows.setdefault(model, np.zeros(len(chunks), dtype=bool))[row] = True
+        self.bm25 = BM25Index([f"{c['title']}\n{c['content']}" for c in chunks])
+        self.dense = dense
+
+
+class LocalSearchIndex:
+    def __init__(
+        self,
+        index_dir: str = local_search_index_dir,
+        source: str = local_search_source,
+        dense: bool = local_search_dense,
+    ):
+        self.index_dir = index_dir
+        self.source = source
+        self.dense_enabled = dense
+        self._loaded: LoadedIndex | None = None
+        self._stale = False  # re-ingested elsewhere; the current generation serves until reloaded
+        self.build_seconds = 0.0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._queries = 0
+        self._index_version = read_index_version()
+        self._version_checked = time.monotonic()
+
+    @property
+    def chunks(self) -> list[dict]:
+        loaded = self._loaded
+        return loaded.chunks if loaded is not None else []
+
+    @property
+    def dense(self) -> DenseIndex | None:
+        loaded = self._loaded
+        return loaded.dense if loaded is not None else None
+
+    @property
+    def chunks_path(self) -> str:
+        return os.path.join(self.index_dir, "chunks.json")
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.index_dir, "vectors.f32")
+
+    def _read(self) -> dict | None:
+        try:
+            with open(self.chunks_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _old_vectors(self, previous: dict | None):
+        dense = previous and previous["meta"].get("dense")
+        if not dense or not os.path.exists(self.vectors_path):
+            return None
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(dense["count"], dense["dimensions"]))
+
+    def sync(self, chunks: list[dict], embed_many=None, source_hash: str | None = None) -> dict:
+        """Make `chunks` the index; only chunks whose id is not indexed yet are embedded."""
+        started = time.perf_counter()
+        chunks = list({c["id"]: c for c in chunks}.values())
+        previous = self._read()
+        old_ids = [c["id"] for c in previous["chunks"]] if previous else []
+        new_ids = {c["id"] for c in chunks}
+        stats = {
+            "chunks": len(chunks),
+            "added": len(new_ids - set(old_ids)),
+            "deleted": len(set(old_ids) - new_ids),
+            "unchanged": len(new_ids & set(old_ids)),
+            "embedded": 0,
+        }
+        os.makedirs(self.index_dir, exist_ok=True)
+        meta = {"source_hash": source_hash, "chunking": CHUNKING, "dense": None}
+        if self.dense_enabled:
+            old_vectors = self._old_vectors(previous)
+            old_rows = {chunk_id: row for row, chunk_id in enumerate(old_ids)} if old_vectors is not None else {}
+            missing = [c for c in chunks if c["id"] not in old_rows]
+            fresh = {}
+            if missing:
+                if embed_many is None:
+                    from service_requests.embeddings import get_embeddings as embed_many
+                texts = [f"{c['title']}\n{c['content']}" for c in missing]
+                fresh = dict(zip((c["id"] for c in missing), embed_many(texts)))
+            vectors = [fresh[c["id"]] if c["id"] in fresh else old_vectors[old_rows[c["id"]]] for c in chunks]
+            count, dimensions = DenseIndex.write(self.vectors_path, vectors)
+            del old_vectors
+            meta["dense"] = {"count": int(count), "dimensions": int(dimensions)}
+            stats["embedded"] = len(missing)
+        tmp = self.chunks_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "chunks": chunks}, f, ensure_ascii=False)
+        os.replace(tmp, self.chunks_path)
+        self.build_seconds = time.perf_counter() - started
+        self._publish(self._load())
+        stats["seconds"] = self.build_seconds
+        stats["bytes"] = self.size_bytes()
+        return stats
+
+    def build(self, embed_many=None) -> dict:
+        """Chunk the source manual and sync the index with it."""
+        with open(self.source, encoding="utf-8") as f:
+            chunks = chunk_manual(f.read())
+        return self.sync(chunks, embed_many, file_hash(self.source))
+
+    def _load(self, source_hash: str | None = None) -> LoadedIndex | None:
+        """The index on disk, or None when it is missing or out of date."""
+        data = self._read()
+        if data is None:
+            return None
+        meta = data["meta"]
+        if meta.get("chunking") != CHUNKING:
+            return None
+        if source_hash is not None and meta.get("source_hash") != source_hash:
+            return None
+        if self.dense_enabled and not meta.get("dense"):
+            return None
+        dense = None
+        if self.dense_enabled:
+            dense = DenseIndex(self.vectors_path, meta["dense"]["count"], meta["dense"]["dimensions"])
+        return LoadedIndex(data["chunks"], dense)
+
+    def _publish(self, loaded: LoadedIndex | None):
+        with self._lock:
+            self._loaded = loaded
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._version_checked < VERSION_CHECK_SECONDS:
+            return
+        self._version_checked = now
+        version = read_index_version()
+        if version != self._index_version:
+            self._index_version = version
+            self._stale = True  # re-ingested; reload on the next search
+            print("search index re-ingested; reloading the local search index")
+
+    def ensure_loaded(self) -> LoadedIndex:
+        """The current index, loaded from disk and rebuilt when missing or out of date."""
+        self._check_version()
+        loaded = self._loaded
+        if loaded is not None and not self._stale:
+            return loaded
+        with self._build_lock:
+            if self._loaded is None or self._stale:
+                self._stale = False
+                loaded = self._load(file_hash(self.source))
+                if loaded is not None:
+                    self._publish(loaded)
+                else:
+                    stats = self.build()
+                    print(
+                        f"local search index built: {stats['chunks']} chunks, "
+                        f"{stats['bytes'] / 1024:.0f} KiB in {stats['seconds']:.2f}s"
+                    )
+            return self._loaded
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.chunks_path, self.vectors_path) if os.path.exists(p))
+
+    def indexed_models(self) -> set[str]:
+        """Model keys that have chunks of their own in the index."""
+        return set(self.ensure_loaded().model_rows)
+
+    @staticmethod
+    def _results(index: LoadedIndex, ranked: list[tuple[int, float]]) -> list[dict]:
+        return [
+            {"title": index.chunks[i]["title"], "content": index.chunks[i]["content"], "@search.score": score}
+            for i, score in ranked
+        ]
+
+    def search(
+        self,
+        query: str,
+        top: int = 5,
+        query_vector=None,
+        mode: str | None = None,
+        candidates: int = 20,
+        vehicle_models: list[str] | None = None,
+    ) -> list[dict]:
+        """
+        `mode` "keyword" (BM25), "vector" or "hybrid" (both fused with reciprocal rank fusion);
+        by default vector when a query vector is given and the dense index exists, else keyword.
+        With `vehicle_models`, only chunks for those models (or for no model in particular) match.
+        """
+        # One generation for the whole query, even if a reload swaps in another meanwhile
+        index = self.ensure_loaded()
+        started = time.perf_counter()
+        weights = index.weights
+        if vehicle_models:
+            allowed = index.generic.copy()
+            for model in vehicle_models:
+                rows = index.model_rows.get(model_key(model))
+                if rows is not None:
+                    allowed |= rows
+            weights = weights * allowed
+        if query_vector is None or index.dense is None:
+            mode = "keyword"
+        elif mode is None:
+            mode = "vector"
+        if mode == "hybrid":
+            keyword = top_k(index.bm25.scores(query) * weights, candidates)
+            vector = top_k(index.dense.scores(query_vector) * weights, candidates)
+            fused = reciprocal_rank_fusion([keyword, vector])
+            # A hit ranked well by only one of the two lists after the top ones is noise, not context
+            cutoff = fused[0][1] * local_search_hybrid_min_relative if fused else 0.0
+            ranked = [(row, score) for row, score in fused if score >= cutoff][:top]
+        elif mode == "vector":
+            ranked = top_k(index.dense.scores(query_vector) * weights, top)
+        else:
+            ranked = top_k(index.bm25.scores(query) * weights, top)
+        with self._lock:
+            self._queries += 1
+            self._latencies.append(time.perf_counter() - started)
+        return self._results(index, ranked)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            "backend": search_backend,
+            "chunks": len(self.chunks),
+            "dense": self.dense is not None,
+            "index_bytes": self.size_bytes(),
+            "build_seconds": self.build_seconds,
+            "queries": self._queries,
+            "query_ms_p50": percentile(0.50),
+            "query_ms_p95": percentile(0.95),
+            "query_ms_p99": percentile(0.99),
+        }
+
+
+local_index = LocalSearchIndex()
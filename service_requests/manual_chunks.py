@@ -0,0 +1,188 @@
+"""
+Structure-aware chunking of the owner's manual (documents/*-understood.md).
+
+The manual is the Document Intelligence markdown of the PDF, enriched with figure
+descriptions. `chunk_manual` turns it into search chunks:
+
+- text is grouped under its heading path (`title` is "Section > Subsection");
+- `<!-- PageBreak -->` is a preferred split point (a section continuing on the next
+  page becomes a new chunk once the current one has `MANUAL_MIN_CHUNK_CHARS`), and
+  each chunk records the page it starts on;
+- sections longer than `MANUAL_CHUNK_CHARS` are split on paragraph boundaries, and
+  paragraphs longer than that on sentence boundaries (then lines, then words), so
+  no chunk exceeds the limit;
+- every `<figure>` block becomes its own chunk (`kind` "figure") with weight
+  `MANUAL_FIGURE_WEIGHT`, so image descriptions can answer "where is the VIN?" but
+  do not outrank the manual's own text;
+- page number / header / footer comments are dropped;
+- every chunk carries `vehicle_models`, the models the manual covers (its title
+  heading, e.g. "HF 100", or `MANUAL_VEHICLE_MODELS`), as `model_key`s, so search
+  can be limited to the customer's vehicles.
+
+A chunk's `id` is the hash of its title, content and models, so re-chunking an
+unchanged manual yields the same ids and an edit only changes the ids of the
+chunks it touches; manual_ingest.py relies on this to re-embed and re-upload only
+those.
+"""
+
+import hashlib
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+manual_chunk_chars = int(os.getenv("MANUAL_CHUNK_CHARS", "1500"))
+manual_min_chunk_chars = int(os.getenv("MANUAL_MIN_CHUNK_CHARS", "300"))
+manual_figure_weight = float(os.getenv("MANUAL_FIGURE_WEIGHT", "0.5"))
+# Comma-separated models the manual covers; empty = the manual's first "# " heading
+manual_vehicle_models = [m.strip() for m in os.getenv("MANUAL_VEHICLE_MODELS", "").split(",") if m.strip()]
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+_PAGE_BREAK = "<!-- PageBreak -->"
+_COMMENT = re.compile(r"<!--.*?-->")
+_FIGCAPTION = re.compile(r"<figcaption>(.*?)</figcaption>", re.S)
+_TAG = re.compile(r"</?(figure|figcaption)>")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# Bumped when the chunking itself changes, so indexes chunked the old way are rebuilt
+CHUNKER_VERSION = 2
+
+
+def model_key(model: str) -> str:
+    """Comparable form of a vehicle model name: "HF-100", "hf 100" -> "hf100"."""
+    return re.sub(r"[^a-z0-9]", "", model.lower())
+
+
+def manual_models(text: str) -> list[str]:
+    """Models named by the manual's title heading."""
+    for line in text.splitlines():
+        if line.startswith("# "):
+            return [line[2:].strip()]
+    return []
+
+
+def chunk_id(title: str, content: str, vehicle_models: list[str] = ()) -> str:
+    key = f"{title}\n{content}\n{','.join(vehicle_models)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def _split_paragraph(paragraph: str, max_chars: int) -> list[str]:
+    """Pieces of an oversized paragraph, each within `max_chars`, cut between sentences when possible."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            cut = max(sentence.rfind("\n", 0, max_chars), sentence.rfind(" ", 0, max_chars))
+            if cut <= 0:
+                cut = max_chars
+            sentences.append(sentence[:cut].rstrip())
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            sentences.append(sentence)
+    pieces, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _split(body: str, max_chars: int) -> list[str]:
+    parts, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", body):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in _split_paragraph(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph]:
+            if current and len(current) + len(piece) + 2 > max_chars:
+                parts.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_manual(
+    text: str,
+    max_chars: int = manual_chunk_chars,
+    min_chars: int = manual_min_chunk_chars,
+    figure_weight: float = manual_figure_weight,
+    vehicle_models: list[str] | None = None,
+) -> list[dict]:
+    """Chunks {"id", "title", "content", "page", "kind", "weight", "vehicle_models"} in document order."""
+    models = sorted({model_key(m) for m in (vehicle_models or manual_vehicle_models or manual_models(text))})
+    chunks = []
+    path: list[str] = []
+    lines: list[str] = []
+    figure: list[str] | None = None
+    page = start_page = 1
+
+    def add(title: str, content: str, kind: str, weight: float, chunk_page: int):
+        chunks.append(
+            {
+                "id": chunk_id(title, content, models),
+                "title": title,
+                "content": content,
+                "page": chunk_page,
+                "kind": kind,
+                "weight": weight,
+                "vehicle_models": models,
+            }
+        )
+
+    def flush():
+        nonlocal start_page
+        body = _COMMENT.sub("", "\n".join(lines)).strip()
+        lines.clear()
+        if body:
+            for part in _split(body, max_chars):
+                add(" > ".join(path), part, "text", 1.0, start_page)
+        start_page = page
+
+    def flush_figure():
+        raw = "\n".join(figure)
+        caption = _FIGCAPTION.search(raw)
+        content = _COMMENT.sub("", _TAG.sub("", _FIGCAPTION.sub("", raw))).strip()
+        if content.startswith("Description:"):
+            content = content[len("Description:"):].strip()
+        if content:
+            title = " > ".join(path + [caption.group(1).strip() if caption else "Figure"])
+            for part in _split(content, max_chars):
+                add(title, part, "figure", figure_weight, page)
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if figure is not None:
+            figure.append(line)
+            if "</figure>" in stripped:
+                flush_figure()
+                figure = None
+            continue
+        if stripped.startswith("<figure"):
+            figure = [line]
+            if "</figure>" in stripped:
+                flush_figure()
+                figure = None
+            continue
+        if stripped == _PAGE_BREAK:
+            page += 1
+            if len("\n".join(lines).strip()) >= min_chars:
+                flush()
+            elif not "".join(lines).strip():
+                start_page = page
+            continue
+        match = _HEADING.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            path[:] = path[: level - 1] + [match.group(2).strip()]
+        else:
+            lines.append(line)
+    if figure is not None:
+        flush_figure()
+    flush()
+    return chunks
@@ -0,0 +1,198 @@
+"""
+Semantic cache for the Search Q&A tool.
+
+Product questions repeat across customers with small wording changes ("tyre
+pressure for HF 100?" / "what should the tyre pressure be on my HF 100"). The cache
+embeds each query (through the shared, cached embeddings client) and returns the
+stored search results of a previous query when the cosine similarity is at least
+`SEARCH_CACHE_MIN_SIMILARITY`, skipping the semantic search.
+
+- entries are scoped by vehicle model, so answers for one model are never served
+  for another;
+- entries expire after `SEARCH_CACHE_TTL_SECONDS` and the least recently used are
+  evicted beyond `SEARCH_CACHE_MAX_ENTRIES`;
+- the cache is cleared when the search index is re-ingested: the ingestion calls
+  `bump_index_version()`, which rewrites the version file every process checks
+  (`SEARCH_INDEX_VERSION_FILE`);
+- `metrics()` reports lookups, hits, hit rate, evictions and invalidations.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+search_cache_enabled = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+search_cache_min_similarity = float(os.getenv("SEARCH_CACHE_MIN_SIMILARITY", "0.92"))
+search_cache_ttl_seconds = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "86400"))
+search_cache_max_entries = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+search_index_version_file = os.getenv(
+    "SEARCH_INDEX_VERSION_FILE", os.path.join(".cache", "search_index_version")
+)
+
+VERSION_CHECK_SECONDS = 5
+
+
+def read_index_version(path: str = search_index_version_file) -> str:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_index_version(path: str = search_index_version_file) -> str:
+    """Mark the search index as changed; every process's cache drops its entries."""
+    version = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, path)
+    return version
+
+
+def _scope(vehicle_model: str | None) -> str:
+    return " ".join((vehicle_model or "").lower().split())
+
+
+@dataclass
+class _Entry:
+    query: str
+    scope: str
+    vector: np.ndarray
+    results: list
+    created_at: float
+    hits: int = 0
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        min_similarity: float = search_cache_min_similarity,
+        ttl_seconds: float = search_cache_ttl_seconds,
+        max_entries: int = search_cache_max_entries,
+        version_file: str = search_index_version_file,
+    ):
+        self.min_similarity = min_similarity
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.version_file = version_file
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_id = 0
+        self._matrices: dict[str, tuple[list[int], np.ndarray]] = {}  # scope -> (entry ids, unit vectors)
+        self._lock = threading.Lock()
+        self._index_version = read_index_version(version_file)
+        self._version_checked = time.monotonic()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    # ── maintenance ─────────────────────────────────────────────
+
+    def _check_version_locked(self):
+        now = time.monotonic()
+        if now - self._version_checked < VERSION_CHECK_SECONDS:
+            return
+        self._version_checked = now
+        version = read_index_version(self.version_file)
+        if version != self._index_version:
+            self._index_version = version
+            self._clear_locked()
+            print("search index re-ingested; semantic search cache cleared")
+
+    def _clear_locked(self):
+        if self._entries:
+            self._stats["invalidations"] += 1
+        self._entries.clear()
+        self._matrices.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._clear_locked()
+
+    def _remove_locked(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._matrices.pop(entry.scope, None)
+
+    def _matrix_locked(self, scope: str):
+        matrix = self._matrices.get(scope)
+        if matrix is None:
+            ids = [i for i, e in self._entries.items() if e.scope == scope]
+            vectors = (
+                np.stack([self._entries[i].vector for i in ids])
+                if ids
+                else np.zeros((0, 0), dtype=np.float32)
+            )
+            matrix = self._matrices[scope] = (ids, vectors)
+        return matrix
+
+    # ── lookup / store ──────────────────────────────────────────
+
+    def _expire_locked(self, scope: str):
+        cutoff = time.time() - self.ttl_seconds
+        for entry_id in [i for i, e in self._entries.items() if e.scope == scope and e.created_at < cutoff]:
+            self._remove_locked(entry_id)
+            self._stats["expirations"] += 1
+
+    def lookup(self, vector, vehicle_model: str | None = None) -> list | None:
+        """Results cached for a query similar to `vector` in the same vehicle-model scope."""
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scope = _scope(vehicle_model)
+        with self._lock:
+            self._check_version_locked()
+            self._stats["lookups"] += 1
+            self._expire_locked(scope)
+            ids, vectors = self._matrix_locked(scope)
+            if not ids or vectors.shape[1] != query.shape[0]:
+                return None
+            similarities = vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.min_similarity:
+                return None
+            entry = self._entries[ids[best]]
+            entry.hits += 1
+            self._entries.move_to_end(ids[best])
+            self._stats["hits"] += 1
+        print(f"semantic cache hit ({similarities[best]:.3f}) for '{entry.query}'")
+        return list(entry.results)
+
+    def store(self, query: str, vector, results: list, vehicle_model: str | None = None):
+        unit = np.asarray(vector, dtype=np.float32)
+        unit = unit / (np.linalg.norm(unit) or 1.0)
+        scope = _scope(vehicle_model)
+        with self._lock:
+            self._check_version_locked()
+            self._entries[self._next_id] = _Entry(query, scope, unit, list(results), time.time())
+            self._next_id += 1
+            self._matrices.pop(scope, None)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                entry_id = next(iter(self._entries))
+                self._remove_locked(entry_id)
+                self._stats["evictions"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["hit_rate"] = snapshot["hits"] / snapshot["lookups"] if snapshot["lookups"] else 0.0
+            snapshot["index_version"] = self._index_version
+        return snapshot
+
+
+search_cache = SemanticCache()
@@ -1,18 +1,52 @@
 
 from dotenv import load_dotenv
+import asyncio
+import json
 import os
+import threading
+import time
 import traceback
-from langchain_core.tools import tool
+from typing import Annotated
+from langchain_core.tools import StructuredTool
+from langgraph.prebuilt import InjectedState
 
-from azure.identity import DefaultAzureCredential
+from azure.core.exceptions import HttpResponseError
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from azure.search.documents.models import VectorizedQuery
+
+from service_requests.credentials import async_token_cache, token_cache
+from service_requests.embeddings import aget_embedding, get_embedding
+from service_requests.local_search import local_index, search_backend, tokenize
+from service_requests.manual_chunks import model_key
+from service_requests.search_cache import search_cache, search_cache_enabled
+from service_requests.token_count import count_tokens
 
 load_dotenv()
 ai_search_url = os.getenv("ai_search_url")
 ai_index_name = os.getenv("ai_index_name")
 ai_semantic_config = os.getenv("ai_semantic_config")
-
-credential = DefaultAzureCredential()
+# Fields requested from the index and passed to the prompt (the fields manual_ingest.py writes)
+search_select_fields = [
+    f.strip() for f in os.getenv("SEARCH_SELECT_FIELDS", "title,content,page").split(",") if f.strip()
+]
+search_max_top = int(os.getenv("SEARCH_MAX_TOP", "5"))
+search_min_reranker_score = float(os.getenv("SEARCH_MIN_RERANKER_SCORE", "1.5"))
+search_hit_char_budget = int(os.getenv("SEARCH_HIT_CHAR_BUDGET", "1200"))
+search_result_token_budget = int(os.getenv("SEARCH_RESULT_TOKEN_BUDGET", "1500"))
+search_answer_min_score = float(os.getenv("SEARCH_ANSWER_MIN_SCORE", "0.9"))
+# semantic: text query with semantic ranking; hybrid: keyword + vector queries fused with RRF
+search_mode = os.getenv("SEARCH_MODE", "semantic").lower()
+search_vector_field = os.getenv("SEARCH_VECTOR_FIELD", "content_vector")
+search_hybrid_candidates = int(os.getenv("SEARCH_HYBRID_CANDIDATES", "20"))
+# Hits sharing at least this share of their words with a better hit are dropped
+search_dedupe_overlap = float(os.getenv("SEARCH_DEDUPE_OVERLAP", "0.8"))
+# Limit results to the customer's vehicle models (filterable collection field set by manual_ingest.py);
+# indexes without the field are detected and searched unfiltered
+search_filter_by_model = os.getenv("SEARCH_FILTER_BY_MODEL", "true").lower() in ("1", "true", "yes")
+search_model_field = os.getenv("SEARCH_MODEL_FIELD", "vehicle_models")
+# How long the set of models known to be in the Azure index is trusted
+search_model_probe_seconds = float(os.getenv("SEARCH_MODEL_PROBE_SECONDS", "600"))
 
 
 sys_prompt= """
@@ -25,25 +59,409 @@ Be crisp in your responses to the user. If the information in the context is ver
 Empathise with the user when responding
 """
 
-@tool
-def perform_search_based_qna(query):
-    """
-    call this function to look up documentation and manuals to look for answers to the query posed by the Customer.
+# ── result shaping ──────────────────────────────────────────────
+
+_metrics_lock = threading.Lock()
+_search_metrics = {
+    "calls": 0,
+    "hits_returned": 0,
+    "hits_dropped": 0,
+    "hits_deduped": 0,
+    "filtered_searches": 0,
+    "filter_fallbacks": 0,
+    "raw_bytes": 0,
+    "payload_bytes": 0,
+    "raw_tokens": 0,
+    "payload_tokens": 0,
+    "search_seconds_total": 0.0,
+}
+_last_call = {}
+
+
+def _trim(text: str, limit: int) -> str:
+    """Cut `text` to `limit` characters, at a sentence or word boundary when possible."""
+    text = " ".join(str(text).split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary < limit // 2:
+        boundary = cut.rfind(" ")
+    return cut[: boundary + 1 if boundary > 0 else limit].rstrip() + " …"
+
+
+def _text_fields(result: dict) -> list[str]:
+    return [
+        key
+        for key, value in result.items()
+        if not key.startswith("@") and isinstance(value, str) and value.strip()
+    ]
+
 
+def _dedupe(raw_results: list) -> tuple[list, int]:
+    """Drop hits whose words largely repeat a better-ranked hit (overlapping chunks, repeated figures)."""
+    kept, seen = [], []
+    for result in raw_results:
+        words = set(tokenize(" ".join(result.get(f) or "" for f in _text_fields(result))))
+        if words and any(len(words & other) >= search_dedupe_overlap * min(len(words), len(other)) for other in seen):
+            continue
+        kept.append(result)
+        seen.append(words)
+    return kept, len(raw_results) - len(kept)
+
+
+def _shape_results(query: str, raw_results: list, answers: list, seconds: float) -> list[dict]:
+    """Compact hits for the tool message: selected fields, text trimmed, within the token budget."""
+    raw_results, deduped = _dedupe(raw_results)
+    payload = []
+    used = 0
+    for answer in answers or []:
+        if (answer.score or 0) >= search_answer_min_score and answer.text:
+            item = {"answer": _trim(answer.text, search_hit_char_budget)}
+            payload.append(item)
+            used += count_tokens(item["answer"])
+
+    best = max((r.get("@search.reranker_score") or 0 for r in raw_results), default=0)
+    dropped = 0
+    for rank, result in enumerate(raw_results):
+        score = result.get("@search.reranker_score")
+        # Adaptive top: weak hits after the first are dropped instead of filling the prompt
+        if rank and score is not None and (score < search_min_reranker_score or score < best * 0.6):
+            dropped += 1
+            continue
+        hit = {}
+        captions = result.get("@search.captions") or []
+        caption = " ".join(c.text for c in captions if getattr(c, "text", None))
+        if caption:
+            hit["caption"] = _trim(caption, search_hit_char_budget // 3)
+        for field in search_select_fields:
+            value = result.get(field)
+            if isinstance(value, str) and value.strip():
+                hit[field] = _trim(value, search_hit_char_budget)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                hit[field] = value
+        tokens = count_tokens(json.dumps(hit, ensure_ascii=False))
+        if payload and used + tokens > search_result_token_budget:
+            dropped += len(raw_results) - rank
+            break
+        payload.append(hit)
+        used += tokens
+
+    raw_json = json.dumps(raw_results, default=str, ensure_ascii=False)
+    payload_json = json.dumps(payload, ensure_ascii=False)
+    stats = {
+        "query": query,
+        "hits_returned": sum(1 for item in payload if "answer" not in item),
+        "hits_dropped": dropped,
+        "hits_deduped": deduped,
+        "raw_bytes": len(raw_json.encode()),
+        "payload_bytes": len(payload_json.encode()),
+        "raw_tokens": count_tokens(raw_json),
+        "payload_tokens": count_tokens(payload_json),
+        "search_seconds": seconds,
+    }
+    with _metrics_lock:
+        _search_metrics["calls"] += 1
+        for key in ("hits_returned", "hits_dropped", "hits_deduped", "raw_bytes", "payload_bytes", "raw_tokens", "payload_tokens"):
+            _search_metrics[key] += stats[key]
+        _search_metrics["search_seconds_total"] += seconds
+        _last_call.clear()
+        _last_call.update(stats)
+    print(
+        f"search: {stats['hits_returned']} hits, {stats['payload_bytes']} bytes / {stats['payload_tokens']} tokens "
+        f"(raw {stats['raw_bytes']} bytes / {stats['raw_tokens']} tokens) in {seconds * 1000:.0f} ms"
+    )
+    return payload
+
+
+def search_metrics() -> dict:
+    with _metrics_lock:
+        return {**_search_metrics, "last_call": dict(_last_call)}
+
+
+def _search_kwargs(query: str, vector=None, filter: str | None = None) -> dict:
     """
-    print("performing search based QnA")
-    
-    client = SearchClient(
-        endpoint=ai_search_url,
-        index_name=ai_index_name,
-        credential=credential,
+    Semantic query; in hybrid mode with a query vector, also a vector query over
+    `search_vector_field`. Azure AI Search runs both in one request, fuses them with
+    reciprocal rank fusion and applies the semantic ranker to the fused set, so unlike
+    the local backend nothing is fused on the client. `filter` applies to both.
+    """
+    kwargs = dict(
+        search_text=query,
+        query_type="semantic",
+        semantic_configuration_name=ai_semantic_config,
+        query_caption="extractive",
+        query_answer="extractive",
+        top=search_max_top,
     )
-    results = list(
-        client.search(
-            search_text=query,
-            query_type="semantic",
-            semantic_configuration_name=ai_semantic_config,
-            top=5,
+    if search_select_fields:
+        kwargs["select"] = list(search_select_fields)
+    if filter:
+        kwargs["filter"] = filter
+    if search_mode == "hybrid" and vector is not None:
+        kwargs["vector_queries"] = [
+            VectorizedQuery(vector=vector, k_nearest_neighbors=search_hybrid_candidates, fields=search_vector_field)
+        ]
+    return kwargs
+
+
+# ── clients ─────────────────────────────────────────────────────
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = {}
+
+
+def _search_client() -> SearchClient:
+    """One SearchClient for the process, so its HTTP connection pool is reused."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SearchClient(
+                    endpoint=ai_search_url,
+                    index_name=ai_index_name,
+                    credential=token_cache,
+                )
+    return _client
+
+
+def _async_search_client() -> AsyncSearchClient:
+    """One aiohttp-based SearchClient per event loop (its session is bound to the loop)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncSearchClient(
+            endpoint=ai_search_url,
+            index_name=ai_index_name,
+            credential=async_token_cache,
         )
+    return client
+
+
+def _needs_vector() -> bool:
+    if search_backend == "local":
+        return search_cache_enabled or local_index.dense_enabled
+    return search_cache_enabled or search_mode == "hybrid"
+
+
+def _query_vector(query, embed):
+    """Embedding of the query for the semantic cache and vector search; None when unused or unavailable."""
+    if not _needs_vector():
+        return None
+    try:
+        return embed(query)
+    except Exception as e:
+        print(f"Query not embedded, semantic cache and vector search skipped: {e}")
+        return None
+
+
+def _requested_models(vehicle_model, vehicle_models) -> list[str]:
+    """Model keys to filter on: the model asked about, else the customer's vehicles."""
+    if not search_filter_by_model:
+        return []
+    models = [vehicle_model] if vehicle_model else list(vehicle_models or [])
+    return sorted({model_key(m) for m in models if m and model_key(m)})
+
+
+def _models_match(models: list[str]) -> str:
+    return f"{search_model_field}/any(m: search.in(m, '{'|'.join(models)}', '|'))"
+
+
+def _model_filter(models: list[str]) -> str | None:
+    """OData filter: chunks for one of `models`, or chunks not tied to any model."""
+    if not models:
+        return None
+    return f"{_models_match(models)} or not {search_model_field}/any()"
+
+
+# Azure index: model keys -> (has chunks for them, checked at); None once the index rejects the filter
+_model_probes: dict | None = {}
+_model_probes_lock = threading.Lock()
+
+
+def _rejects_model_filter(error: HttpResponseError) -> bool:
+    """A 400 about the model field means the index cannot be filtered by model; anything else is a real failure."""
+    return error.status_code == 400 and search_model_field in str(error)
+
+
+def _filter_unsupported(error: HttpResponseError):
+    global _model_probes
+    with _model_probes_lock:
+        _model_probes = None
+    print(f"search: index rejected the {search_model_field} filter, searching every model: {str(error).splitlines()[0]}")
+
+
+def _azure_has_models(models: list[str]) -> bool:
+    """Whether the Azure index holds chunks tagged with any of `models` (one cached count query)."""
+    key = tuple(models)
+    with _model_probes_lock:
+        if _model_probes is None:
+            return False
+        probe = _model_probes.get(key)
+    if probe is not None and time.monotonic() - probe[1] < search_model_probe_seconds:
+        return probe[0]
+    try:
+        results = _search_client().search(
+            search_text="*", filter=_models_match(models), top=0, include_total_count=True
+        )
+        found = bool(results.get_count())
+    except HttpResponseError as e:
+        if not _rejects_model_filter(e):
+            raise
+        _filter_unsupported(e)
+        return False
+    with _model_probes_lock:
+        if _model_probes is not None:
+            _model_probes[key] = (found, time.monotonic())
+    return found
+
+
+def _search_models(vehicle_model, vehicle_models) -> list[str]:
+    """
+    Model keys to filter on, or [] to search every model: filtering only pays off when
+    the index has chunks for at least one of the models, otherwise every search would
+    run twice (filtered, then unfiltered).
+    """
+    models = _requested_models(vehicle_model, vehicle_models)
+    if not models:
+        return []
+    if search_backend == "local":
+        indexed = local_index.indexed_models()
+        return models if any(m in indexed for m in models) else []
+    return models if _azure_has_models(models) else []
+
+
+def _count_filtered(fallback: bool):
+    with _metrics_lock:
+        _search_metrics["filtered_searches"] += 1
+        _search_metrics["filter_fallbacks"] += fallback
+    if fallback:
+        print("search: nothing indexed for the customer's vehicle models; searched every model")
+
+
+def _local_search(query, vector, models) -> list:
+    mode = "hybrid" if search_mode == "hybrid" else None
+    results = local_index.search(
+        query, search_max_top, vector, mode=mode, candidates=search_hybrid_candidates, vehicle_models=models
     )
+    if models:
+        _count_filtered(not results)
+        if not results:
+            results = local_index.search(query, search_max_top, vector, mode=mode, candidates=search_hybrid_candidates)
+    return results
+
+
+def _azure_search(query, vector, models):
+    kwargs = _search_kwargs(query, vector, _model_filter(models))
+    try:
+        results = _search_client().search(**kwargs)
+        raw_results = list(results)
+    except HttpResponseError as e:
+        if not models or not _rejects_model_filter(e):
+            raise
+        _filter_unsupported(e)
+        kwargs.pop("filter")
+        results = _search_client().search(**kwargs)
+        return list(results), results.get_answers()
+    if models:
+        _count_filtered(not raw_results)
+        if not raw_results:
+            kwargs.pop("filter")
+            results = _search_client().search(**kwargs)
+            raw_results = list(results)
+    return raw_results, results.get_answers()
+
+
+async def _aazure_search(query, vector, models):
+    kwargs = _search_kwargs(query, vector, _model_filter(models))
+    try:
+        results = await _async_search_client().search(**kwargs)
+        raw_results = [result async for result in results]
+    except HttpResponseError as e:
+        if not models or not _rejects_model_filter(e):
+            raise
+        _filter_unsupported(e)
+        kwargs.pop("filter")
+        results = await _async_search_client().search(**kwargs)
+        return [result async for result in results], await results.get_answers()
+    if models:
+        _count_filtered(not raw_results)
+        if not raw_results:
+            kwargs.pop("filter")
+            results = await _async_search_client().search(**kwargs)
+            raw_results = [result async for result in results]
+    return raw_results, await results.get_answers()
+
+
+async def _aperform_search_based_qna(
+    query,
+    vehicle_model=None,
+    vehicle_models: Annotated[list[str] | None, InjectedState("vehicle_models")] = None,
+):
+    print("performing search based QnA")
+
+    models = await asyncio.to_thread(_search_models, vehicle_model, vehicle_models)
+    scope = ",".join(models)
+    vector = None
+    if _needs_vector():
+        try:
+            vector = await aget_embedding(query)
+        except Exception as e:
+            print(f"Query not embedded, semantic cache and vector search skipped: {e}")
+    if vector is not None and search_cache_enabled:
+        cached = search_cache.lookup(vector, scope)
+        if cached is not None:
+            return cached
+
+    started = time.perf_counter()
+    if search_backend == "local":
+        raw_results = await asyncio.to_thread(_local_search, query, vector, models)
+        answers = []
+    else:
+        raw_results, answers = await _aazure_search(query, vector, models)
+    results = _shape_results(query, raw_results, answers, time.perf_counter() - started)
+    if vector is not None and search_cache_enabled:
+        search_cache.store(query, vector, results, scope)
     return results
+
+
+def _perform_search_based_qna(
+    query,
+    vehicle_model=None,
+    vehicle_models: Annotated[list[str] | None, InjectedState("vehicle_models")] = None,
+):
+    """
+    call this function to look up documentation and manuals to look for answers to the query posed by the Customer.
+    Results are limited to the customer's vehicle models; pass vehicle_model only when the question is about one specific model.
+
+    """
+    print("performing search based QnA")
+
+    models = _search_models(vehicle_model, vehicle_models)
+    scope = ",".join(models)
+    vector = _query_vector(query, get_embedding)
+    if vector is not None and search_cache_enabled:
+        cached = search_cache.lookup(vector, scope)
+        if cached is not None:
+            return cached
+
+    started = time.perf_counter()
+    if search_backend == "local":
+        raw_results = _local_search(query, vector, models)
+        answers = []
+    else:
+        raw_results, answers = _azure_search(query, vector, models)
+    results = _shape_results(query, raw_results, answers, time.perf_counter() - started)
+    if vector is not None and search_cache_enabled:
+        search_cache.store(query, vector, results, scope)
+    return results
+
+
+# Sync for the CLI, async (aiohttp transport) for graph.ainvoke / graph.astream;
+# SEARCH_BACKEND=local answers from the offline index in service_requests/local_search.py
+perform_search_based_qna = StructuredTool.from_function(
+    func=_perform_search_based_qna,
+    coroutine=_aperform_search_based_qna,
+    name="perform_search_based_qna",
+)
@@ -0,0 +1,252 @@
+"""
+In-memory, capacity-aware service slot availability.
+
+The working day is divided into 15-minute ticks, and each technician's bookings on
+a day are held as one integer bitset (bit i set = tick i busy). A slot of a given
+service type is free when at least one technician has every tick it covers clear,
+after accounting for schedules that have no technician assigned yet.
+
+Schedules, appointments and technicians for a whole date range are loaded with a
+single query; days already loaded are answered from memory until they go stale.
+`record_booking` marks a new appointment (or slot hold) on the cached bitset, so a
+booking made through `CreateServiceSchedule` is reflected without reloading the day.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TICK_MINUTES = 15
+DAY_START_MINUTES = 9 * 60
+DAY_END_MINUTES = 18 * 60
+TICKS_PER_DAY = (DAY_END_MINUTES - DAY_START_MINUTES) // TICK_MINUTES
+
+# Candidate slot start times (minutes after midnight), as offered to customers
+SLOT_START_MINUTES = (
+    9 * 60, 10 * 60, 11 * 60, 12 * 60,  # Morning slots
+    14 * 60, 15 * 60, 16 * 60, 17 * 60,  # Afternoon slots
+)
+DEFAULT_DURATION_MINUTES = 60
+MAX_RANGE_DAYS = int(os.getenv("SLOT_MAX_RANGE_DAYS", "31"))
+slot_cache_ttl_seconds = float(os.getenv("SLOT_CACHE_TTL_SECONDS", "60"))
+
+RANGE_QUERY = """
+SELECT
+    t.technician_id,
+    ss.service_date,
+    ss.start_time,
+    ss.end_time
+FROM
+    Technicians t
+    -- Only the range's appointments are joined, so the cost does not grow with booking history
+    LEFT JOIN (
+        SELECT a.technician_id, s.service_date, s.start_time, s.end_time
+        FROM Service_Schedules s
+        INNER JOIN Appointments a ON a.schedule_id = s.schedule_id
+        WHERE s.service_date BETWEEN ? AND ?
+            AND s.status = 'Scheduled'
+    ) ss ON ss.technician_id = t.technician_id
+UNION ALL
+-- Scheduled work with no technician assigned still consumes capacity
+SELECT
+    NULL,
+    ss.service_date,
+    ss.start_time,
+    ss.end_time
+FROM
+    Service_Schedules ss
+WHERE
+    ss.service_date BETWEEN ? AND ?
+    AND ss.status = 'Scheduled'
+    AND NOT EXISTS (SELECT 1 FROM Appointments a WHERE a.schedule_id = ss.schedule_id)
+UNION ALL
+-- Live holds from HoldServiceSlot block their technician until they expire
+SELECT
+    h.technician_id,
+    h.service_date,
+    h.start_time,
+    h.end_time
+FROM
+    Slot_Holds h
+WHERE
+    h.service_date BETWEEN ? AND ?
+    AND h.expires_at > SYSUTCDATETIME();
+"""
+
+SERVICE_TYPES_QUERY = "SELECT service_type_id, duration_minutes FROM Service_Types;"
+
+
+def _minutes(value) -> int:
+    if isinstance(value, str):
+        value = datetime.time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def _as_date(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def tick_mask(start_minutes: int, end_minutes: int) -> int:
+    """Bitset of the ticks overlapping [start, end), clipped to the working day."""
+    start = max(start_minutes, DAY_START_MINUTES) - DAY_START_MINUTES
+    end = min(end_minutes, DAY_END_MINUTES) - DAY_START_MINUTES
+    if end <= start:
+        return 0
+    first = start // TICK_MINUTES
+    last = -(-end // TICK_MINUTES)  # ceil: a partial tick is busy
+    return ((1 << (last - first)) - 1) << first
+
+
+class _Day:
+    __slots__ = ("busy", "unassigned", "loaded_at")
+
+    def __init__(self, technicians):
+        self.busy: dict[int, int] = {technician_id: 0 for technician_id in technicians}
+        self.unassigned: list[int] = []
+        self.loaded_at = time.monotonic()
+
+    def free_count(self, mask: int) -> int:
+        free = sum(1 for busy in self.busy.values() if not busy & mask)
+        return free - sum(1 for busy in self.unassigned if busy & mask)
+
+
+class SlotEngine:
+    def __init__(self, pool, ttl_seconds: float = slot_cache_ttl_seconds):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self._days: dict[datetime.date, _Day] = {}
+        self._durations: dict[int, int] | None = None
+        self._lock = threading.Lock()
+        self._stats = {"range_loads": 0, "days_loaded": 0, "queries": 0, "bookings_recorded": 0}
+
+    # ── loading ─────────────────────────────────────────────────
+
+    def _duration(self, service_type_id: int) -> int:
+        if self._durations is None:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(SERVICE_TYPES_QUERY)
+                durations = {row[0]: row[1] for row in cursor.fetchall()}
+                cursor.close()
+            self._durations = durations
+        return self._durations.get(service_type_id) or DEFAULT_DURATION_MINUTES
+
+    def _load(self, first: datetime.date, last: datetime.date):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(RANGE_QUERY, (first, last) * 3)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        technicians = {row[0] for row in rows if row[0] is not None}
+        days = {}
+        day = first
+        while day <= last:
+            days[day] = _Day(technicians)
+            day += datetime.timedelta(days=1)
+        for technician_id, service_date, start_time, end_time in rows:
+            entry = days.get(_as_date(service_date)) if service_date else None
+            if entry is None:
+                continue
+            mask = tick_mask(_minutes(start_time), _minutes(end_time))
+            if technician_id is None:
+                entry.unassigned.append(mask)
+            else:
+                entry.busy[technician_id] |= mask
+
+        with self._lock:
+            # Stale days are reloaded on use anyway; dropping them keeps memory bounded by recent queries
+            now = time.monotonic()
+            for stale in [d for d, entry in self._days.items() if now - entry.loaded_at > self.ttl_seconds]:
+                del self._days[stale]
+            self._days.update(days)
+            self._stats["range_loads"] += 1
+            self._stats["days_loaded"] += len(days)
+        return days
+
+    def _days_in_range(self, first: datetime.date, last: datetime.date) -> list[_Day]:
+        """Cached days for [first, last], loading any missing or stale ones with one query."""
+        now = time.monotonic()
+        dates = [first + datetime.timedelta(days=i) for i in range((last - first).days + 1)]
+        with self._lock:
+            cached = {d: self._days.get(d) for d in dates}
+        missing = [
+            d for d, entry in cached.items()
+            if entry is None or now - entry.loaded_at > self.ttl_seconds
+        ]
+        if missing:
+            # One query covering the span of missing days
+            cached.update(self._load(missing[0], missing[-1]))
+        return [cached[d] for d in dates]
+
+    # ── queries ─────────────────────────────────────────────────
+
+    def free_slots(self, start_date, end_date=None, service_type_id: int = 1) -> list[dict]:
+        first = _as_date(start_date)
+        last = _as_date(end_date) if end_date else first + datetime.timedelta(days=2)
+        if last < first:
+            first, last = last, first
+        last = min(last, first + datetime.timedelta(days=MAX_RANGE_DAYS - 1))
+
+        duration = self._duration(service_type_id)
+        days = self._days_in_range(first, last)
+
+        results = []
+        with self._lock:
+            self._stats["queries"] += 1
+            for offset, entry in enumerate(days):
+                day = first + datetime.timedelta(days=offset)
+                midnight = datetime.datetime.combine(day, datetime.time())
+                for start in SLOT_START_MINUTES:
+                    end = start + duration
+                    if end > DAY_END_MINUTES:
+                        continue
+                    free = entry.free_count(tick_mask(start, end))
+                    if free > 0:
+                        results.append(
+                            {
+                                "AvailableStart": midnight + datetime.timedelta(minutes=start),
+                                "AvailableEnd": midnight + datetime.timedelta(minutes=end),
+                                "FreeTechnicians": free,
+                            }
+                        )
+        return results
+
+    # ── invalidation ────────────────────────────────────────────
+
+    def record_booking(self, service_date, start_time, end_time, technician_id=None):
+        """Mark a newly booked appointment or hold on the cached day, if that day is loaded."""
+        day = _as_date(service_date)
+        mask = tick_mask(_minutes(start_time), _minutes(end_time))
+        with self._lock:
+            entry = self._days.get(day)
+            if entry is None:
+                return
+            if technician_id is None or technician_id not in entry.busy:
+                # Unknown technician: safest is to reload the day on next use
+                del self._days[day]
+                return
+            entry.busy[technician_id] |= mask
+            self._stats["bookings_recorded"] += 1
+
+    def invalidate(self, service_date=None):
+        with self._lock:
+            if service_date is None:
+                self._days.clear()
+            else:
+                self._days.pop(_as_date(service_date), None)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["days_cached"] = len(self._days)
+        return snapshot
@@ -0,0 +1,307 @@
+"""
+Thread-safe pool of Azure SQL connections authenticated with Entra ID access tokens.
+
+Opening a pyodbc connection to Azure SQL costs a TLS handshake plus an Entra login,
+which dominates the latency of the short statements the tools run. The pool keeps
+a bounded set of open connections, health-checks connections that have been idle,
+evicts connections nobody has used for a while, and transparently reconnects
+connections whose access token is about to expire.
+
+Usage:
+    pool = get_pool(credential.get_token)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        ...
+"""
+
+import asyncio
+import functools
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pyodbc
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SQL_SCOPE = "https://database.windows.net/.default"
+SQL_COPT_SS_ACCESS_TOKEN = 1256
+
+az_db_server = os.getenv("az_db_server")
+az_db_database = os.getenv("az_db_database")
+
+# Pool tuning, all overridable from the environment
+az_db_pool_size = int(os.getenv("az_db_pool_size", "5"))
+az_db_pool_timeout = float(os.getenv("az_db_pool_timeout", "30"))
+az_db_pool_idle_seconds = float(os.getenv("az_db_pool_idle_seconds", "300"))
+az_db_pool_health_check_seconds = float(
+    os.getenv("az_db_pool_health_check_seconds", "30")
+)
+az_db_token_refresh_margin_seconds = float(
+    os.getenv("az_db_token_refresh_margin_seconds", "300")
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+def build_connection_string(server: str, database: str) -> str:
+    return (
+        "Driver={ODBC Driver 18 for SQL Server};"
+        f"SERVER={server};"
+        f"DATABASE={database};"
+        "Encrypt=yes;TrustServerCertificate=no;"
+    )
+
+
+def pack_access_token(token: str) -> bytes:
+    """Encode an Entra access token the way the ODBC driver expects it."""
+    token_bytes = token.encode("UTF-16-LE")
+    return struct.pack(f"<I{len(token_bytes)}s", len(token_bytes), token_bytes)
+
+
+class _PooledConnection:
+    __slots__ = ("connection", "token_expires_on", "created_at", "last_used", "last_checked")
+
+    def __init__(self, connection, token_expires_on: float):
+        now = time.monotonic()
+        self.connection = connection
+        self.token_expires_on = token_expires_on
+        self.created_at = now
+        self.last_used = now
+        self.last_checked = now
+
+    def close(self):
+        try:
+            self.connection.close()
+        except pyodbc.Error:
+            pass
+
+
+class SqlConnectionPool:
+    """A bounded LIFO pool of pyodbc connections.
+
+    `get_token` is any callable with the signature of `TokenCredential.get_token`,
+    returning an object with `token` and `expires_on` (epoch seconds).
+    """
+
+    def __init__(
+        self,
+        get_token,
+        server: str | None = None,
+        database: str | None = None,
+        size: int = az_db_pool_size,
+        timeout: float = az_db_pool_timeout,
+        idle_seconds: float = az_db_pool_idle_seconds,
+        health_check_seconds: float = az_db_pool_health_check_seconds,
+        refresh_margin_seconds: float = az_db_token_refresh_margin_seconds,
+    ):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self._get_token = get_token
+        self._conn_str = build_connection_string(
+            server or az_db_server, database or az_db_database
+        )
+        self.size = size
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+
+        self._cond = threading.Condition()
+        self._executor: ThreadPoolExecutor | None = None
+        self._idle: list[_PooledConnection] = []
+        self._open = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "evictions": 0,
+            "health_check_failures": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    # ── connection lifecycle ────────────────────────────────────
+
+    def _connect(self) -> _PooledConnection:
+        access_token = self._get_token(SQL_SCOPE)
+        connection = pyodbc.connect(
+            self._conn_str,
+            attrs_before={SQL_COPT_SS_ACCESS_TOKEN: pack_access_token(access_token.token)},
+        )
+        with self._cond:
+            self._stats["connects"] += 1
+        return _PooledConnection(connection, float(access_token.expires_on))
+
+    def _token_expiring(self, pooled: _PooledConnection) -> bool:
+        return pooled.token_expires_on - time.time() <= self.refresh_margin_seconds
+
+    def _healthy(self, pooled: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - pooled.last_checked < self.health_check_seconds:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        except pyodbc.Error:
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+            return False
+        pooled.last_checked = now
+        return True
+
+    def _evict_idle_locked(self) -> list[_PooledConnection]:
+        """Remove connections idle for longer than `idle_seconds`. Caller holds the lock."""
+        cutoff = time.monotonic() - self.idle_seconds
+        stale = [p for p in self._idle if p.last_used < cutoff]
+        if stale:
+            self._idle = [p for p in self._idle if p.last_used >= cutoff]
+            self._open -= len(stale)
+            self._stats["evictions"] += len(stale)
+            self._cond.notify(len(stale))
+        return stale
+
+    def acquire(self) -> _PooledConnection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        pooled = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed.")
+                stale = self._evict_idle_locked()
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No SQL connection available after {self.timeout} seconds."
+                    )
+                self._cond.wait(remaining)
+            waited = time.monotonic() - started
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        for p in stale:
+            p.close()
+
+        try:
+            if pooled is None:
+                pooled = self._connect()
+            elif self._token_expiring(pooled) or not self._healthy(pooled):
+                pooled.close()
+                pooled = self._connect()
+                with self._cond:
+                    self._stats["reconnects"] += 1
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        return pooled
+
+    def release(self, pooled: _PooledConnection, discard: bool = False):
+        if not discard:
+            try:
+                # Never hand the next caller a connection with an open transaction
+                pooled.connection.rollback()
+            except pyodbc.Error:
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._open -= 1
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+        if discard or self._closed:
+            pooled.close()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the `with` block."""
+        pooled = self.acquire()
+        discard = False
+        try:
+            yield pooled.connection
+        except pyodbc.OperationalError:
+            # The link itself is broken; do not put it back in the pool
+            discard = True
+            raise
+        finally:
+            self.release(pooled, discard=discard)
+
+    # ── async callers ───────────────────────────────────────────
+
+    async def arun(self, fn, *args, **kwargs):
+        """
+        Run blocking database work `fn(*args, **kwargs)` on the pool's executor.
+
+        The executor has one thread per pooled connection, so async callers queue in
+        the executor instead of blocking the event loop or waiting on `acquire`.
+        """
+        with self._cond:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sql-pool")
+            executor = self._executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+    def evict_idle(self):
+        with self._cond:
+            stale = self._evict_idle_locked()
+        for p in stale:
+            p.close()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for p in idle:
+            p.close()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["size"] = self.size
+            snapshot["open"] = self._open
+            snapshot["idle"] = len(self._idle)
+            snapshot["in_use"] = self._open - len(self._idle)
+        checkouts = snapshot["checkouts"]
+        snapshot["wait_seconds_avg"] = (
+            snapshot["wait_seconds_total"] / checkouts if checkouts else 0.0
+        )
+        return snapshot
+
+
+_pool: SqlConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(get_token) -> SqlConnectionPool:
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SqlConnectionPool(get_token)
+        return _pool
@@ -0,0 +1,51 @@
+"""
+Approximate prompt-token counting.
+
+Uses tiktoken with the encoding of the chat model (`TOKEN_ENCODING`, default
+`o200k_base` for GPT-4o) when it is available, and falls back to the usual
+four-characters-per-token estimate otherwise (e.g. when the encoding file cannot
+be downloaded).
+"""
+
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+token_encoding_name = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(token_encoding_name)
+                except Exception as e:
+                    first_line = str(e).splitlines()[0] if str(e) else repr(e)
+                    print(f"tiktoken unavailable ({first_line}); estimating tokens as characters / 4")
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def counting_method() -> str:
+    return f"tiktoken:{token_encoding_name}" if _get_encoding() is not None else "chars/4"
@@ -0,0 +1,53 @@
+"""
+Encodings for sending embedding vectors to Azure SQL.
+
+The original path stringified the vector, re-parsed it and re-serialized it as a
+JSON NVARCHAR(MAX), which travels as UTF-16 and is then cast through a temp table.
+The compact path sends the vector as a table-valued parameter of
+`dbo.FeedbackVector` rows (ordinal SMALLINT, value REAL), which TDS encodes as
+fixed-width binary.
+
+Only the transport is compact: Azure SQL builds a `vector` value from text, so
+InsertServiceFeedback still formats the TVP rows as a JSON array and casts it on
+the server. `python -m benchmarks.vector_transport_bench --live` measures the
+bytes each path actually sends.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+FEEDBACK_VECTOR_TYPE = "FeedbackVector"
+
+
+def as_float32(vector) -> np.ndarray:
+    return np.asarray(vector, dtype=np.float32).ravel()
+
+
+def vector_to_tvp_rows(vector) -> list[tuple[int, float]]:
+    """Rows for the `dbo.FeedbackVector` table-valued parameter."""
+    values = as_float32(vector)
+    return list(zip(range(len(values)), values.tolist()))
+
+
+def vector_to_json(vector) -> str:
+    """Legacy JSON array encoding accepted by `CAST(... AS vector(n))`."""
+    return json.dumps([float(v) for v in vector])
+
+
+def pack_float32(vector) -> bytes:
+    """Little-endian packed float32, the theoretical lower bound for the payload."""
+    values = as_float32(vector)
+    return struct.pack(f"<{len(values)}f", *values.tolist())
+
+
+def json_param_bytes(vector) -> int:
+    """Bytes of the JSON parameter value: NVARCHAR is sent as UTF-16."""
+    return len(vector_to_json(vector).encode("utf-16-le"))
+
+
+def tvp_param_bytes(vector) -> int:
+    """Bytes of the TVP row values as the client binds them (SMALLINT + REAL per row)."""
+    rows = vector_to_tvp_rows(vector)
+    return len(struct.pack(f"<{'hf' * len(rows)}", *(v for row in rows for v in row)))